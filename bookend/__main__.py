@@ -64,6 +64,15 @@ def import_object(object_name):
     elif object_name == 'ELRsorter':
         from .core.elr_sort import ELRsorter
         objectClass = ELRsorter
+    elif object_name == 'ELRsubsetter':
+        from .core.elr_subset import ELRsubsetter
+        objectClass = ELRsubsetter
+    elif object_name == 'ELRbinaryConverter':
+        from .core.elr_binary import ELRbinaryConverter
+        objectClass = ELRbinaryConverter
+    elif object_name == 'GenomeIndexer':
+        from .core.genome_index import GenomeIndexer
+        objectClass = GenomeIndexer
     elif object_name == 'GTFconverter':
         from .core.gtf_to_bed import GTFconverter
         objectClass = GTFconverter
@@ -25,6 +25,7 @@ Subcommands (use -h/--help for more info):
     elr-sort
     elr-subset
     elr-combine
+    elr-convert
     
     --file conversion--
     gtf-to-bed
@@ -34,6 +35,7 @@ Subcommands (use -h/--help for more info):
     sam-to-sj
     sj-to-bed
     sj-merge
+    genome-index
 
 """
     
@@ -64,7 +66,7 @@ Each line is a read or read stack with seven columns:
 
 ### assemble.py ###
 assemble_parser = subparsers.add_parser('assemble',help="Assembles an end-labeled read (ELR) file. Produces an output assembly (BED12/ELR/GTF) and a table of summary statistics (bookend_stats.tsv)", formatter_class=ArgumentDefaultsHelpFormatter)
-assemble_parser.add_argument('-o','--output', dest='OUT', type=str, default='bookend_assembly.gtf', help="Destination file for assembly. File extension (bed, elr, gtf) determines output type.")
+assemble_parser.add_argument('-o','--output', dest='OUT', type=str, default='bookend_assembly.gtf', help="Destination file for assembly ('-' for stdout). File extension (bed, elr, gtf) determines output type.")
 assemble_parser.add_argument("--source", dest='SOURCE', default='bookend', type=str, help="Name to add to the GTF source column.")
 assemble_parser.add_argument('--cov_out', dest='COV_OUT', type=str, default=None, help="Destination for a TSV of coverage estimates for each transcript in each source.")
 assemble_parser.add_argument('--max_gap', dest='MAX_GAP', type=int, default=50, help="Largest gap size to tolerate (nucleotides).")
@@ -85,23 +87,31 @@ assemble_parser.add_argument("--use_sources", dest='USE_SOURCES', default=False,
 assemble_parser.add_argument("--ignore_labels", dest='IGNORE_LABELS', default=False, action='store_true', help="(overrides other options) Ignore all 5' and 3' end labels.")
 assemble_parser.add_argument("--require_cap", dest='REQUIRE_CAP', default=False, action='store_true', help="No start site is allowed to have less than cap_filter of uuG reads.")
 assemble_parser.add_argument('--verbose', dest='VERBOSE', default=False, action='store_true', help="Display a verbose summary of each assembly in stdout.")
-assemble_parser.add_argument(dest='INPUT', type=str, nargs='+', help="Input ELR filepath(s). MUST be coordinate-sorted.")
+assemble_parser.add_argument("--genome", dest='GENOME', default=None, type=str, help="(BAM/SAM input) Genome FASTA file (or a .gpack from genome-index) for end label QC, as in bookend elr.")
+assemble_parser.add_argument("-s", dest='START', default=False, action='store_true', help="(BAM/SAM input) Read 5' ends are transcript start sites.")
+assemble_parser.add_argument("-c", dest='CAPPED', default=False, action='store_true', help="(BAM/SAM input) 5' end data is capped.")
+assemble_parser.add_argument("-e", dest='END', default=False, action='store_true', help="(BAM/SAM input) Read 3' ends are transcript end sites.")
+assemble_parser.add_argument("--stranded", dest='STRANDED', default=False, action="store_true", help="(BAM/SAM input) The reads are strand-specific.")
+assemble_parser.add_argument("--elr_out", dest='ELR_OUT', type=str, default=None, help="(BAM/SAM input) Also write the converted reads to this sorted ELR file.")
+assemble_parser.add_argument("--tmpdir", dest='TMPDIR', type=str, default=None, help="Directory for temp files (default: beside the input/output; system temp dir for stdin/stdout).")
+assemble_parser.add_argument(dest='INPUT', type=str, nargs='+', help="Input ELR filepath(s) ('-' for stdin), or one coordinate-sorted BAM/SAM file.")
 assemble_parser.set_defaults(object='Assembler')
 
 ### bedgraph.py ###
 bedgraph_parser = subparsers.add_parser('bedgraph',help="Produces a Bedgraph file from an end-labeled read (ELR) file.", formatter_class=ArgumentDefaultsHelpFormatter)
-bedgraph_parser.add_argument('-o','--output', dest='OUT', type=str, default='bookend.bedgraph', help="Bedgraph destination file.")
+bedgraph_parser.add_argument('-o','--output', dest='OUT', type=str, default='bookend.bedgraph', help="Bedgraph destination file ('-' for stdout).")
 bedgraph_parser.add_argument('-t','--type', dest='TYPE', choices=['','COV','5P','3P','S', 'E', 'C'], type=str, default='COV', help="Coverage type: filters Bedgraph output by read label.")
 bedgraph_parser.add_argument('-s','--strand', dest='STRAND', type=str, choices=['.','+','-'], default='.', help="Strand (-|+|.)")
 # bedgraph_parser.add_argument('--scale', dest='SCALE', default=False, action='store_true', help="Perform per-million scaling on output values.")
-bedgraph_parser.add_argument(dest='INPUT', type=str, nargs='+', help="Input ELR filepath(s). MUST be coordinate-sorted.")
+bedgraph_parser.add_argument("--tmpdir", dest='TMPDIR', type=str, default=None, help="Directory for temp files (default: beside the input/output; system temp dir for stdin/stdout).")
+bedgraph_parser.add_argument(dest='INPUT', type=str, nargs='+', help="Input ELR filepath(s) ('-' for stdin).")
 bedgraph_parser.set_defaults(object='Bedgrapher')
 
 ### bam_to_elr.py ###
 bam_to_elr_parser = subparsers.add_parser('elr',help="Converts a BAM or SAM file to an End-Labeled Read (ELR) or BED12 file.", description=ELRdesc, formatter_class=ArgumentDefaultsHelpFormatter)
-bam_to_elr_parser.add_argument("-o", "--output", dest='OUTPUT', type=str, default=None, help="Filepath to write end-labeled file.")
+bam_to_elr_parser.add_argument("-o", "--output", dest='OUTPUT', type=str, default=None, help="Filepath to write end-labeled file ('-' for stdout).")
 bam_to_elr_parser.add_argument("--source", dest='SOURCE', default=None, type=str, help="Name the source of BAM/SAM reads.")
-bam_to_elr_parser.add_argument("--genome", dest='GENOME', default=None, type=str, help="Genome FASTA file")
+bam_to_elr_parser.add_argument("--genome", dest='GENOME', default=None, type=str, help="Genome FASTA file (or a .gpack from genome-index)")
 bam_to_elr_parser.add_argument("--start_seq", dest='START_SEQ', default='ACATGGG', type=str, help="Sequence of the oligo that marks a 5' read (sense)")
 bam_to_elr_parser.add_argument("--end_seq", dest='END_SEQ', default='RRRRRRRRRRRRRRRRRRRRRRRRRRRRRR', type=str, help="Sequence of the oligo that marks a 3' read (sense)")
 bam_to_elr_parser.add_argument("--mismatch_rate", dest='MM_RATE', default=0.20, type=float, help="Mismatch tolerance of S label matches")
@@ -119,7 +129,14 @@ bam_to_elr_parser.add_argument("--sj_shift", dest='SJ_SHIFT', default=2, type=in
 bam_to_elr_parser.add_argument("--minlen_strict", dest='MINLEN_STRICT', default=18, type=int, help="Keep reads down to this length only if perfectly aligned.")
 bam_to_elr_parser.add_argument("--minlen_loose", dest='MINLEN_LOOSE', default=25, type=int, help="Keep reads down to this length if they passed alignment parameters.")
 bam_to_elr_parser.add_argument("--error_rate", dest='ERROR_RATE', default=0.10, type=float, help="Maximum allowed error rate (mismatches+indels) per exon.")
-bam_to_elr_parser.add_argument("INPUT", type=str, default=None, help="Input BAM/SAM file")
+bam_to_elr_parser.add_argument("--threads", dest='THREADS', default=1, type=int, help="Number of worker processes converting reads in parallel.")
+bam_to_elr_parser.add_argument("--memory", dest='MEMORY', default='2G', type=str, help="Memory budget for sorting reads before spilling sorted runs to temp files (e.g. 500M, 8G).")
+bam_to_elr_parser.add_argument("--sj_out", dest='SJ_OUT', type=str, default=None, help="Also write the splice junctions of converted reads to this file (SJ.out.tab format, or SJ.bed if it ends in .bed).")
+bam_to_elr_parser.add_argument("--by_region", dest='BY_REGION', default=False, action='store_true', help="Read a coordinate-sorted, indexed BAM region by region, writing sorted output without a separate sort.")
+bam_to_elr_parser.add_argument("--region_size", dest='REGION_SIZE', default=10000000, type=int, help="Length of the genomic regions read with --by_region; should exceed the length of any read.")
+bam_to_elr_parser.add_argument("--dedup_umi", dest='DEDUP_UMI', default=False, action='store_true', help="Collapse reads with the same UMI (from bookend label --umi), strand, labeled end positions and intron chain. Implies --by_region.")
+bam_to_elr_parser.add_argument("--tmpdir", dest='TMPDIR', type=str, default=None, help="Directory for temp files (default: beside the input/output; system temp dir for stdin/stdout).")
+bam_to_elr_parser.add_argument("INPUT", type=str, default=None, help="Input BAM/SAM file ('-' for stdin)")
 bam_to_elr_parser.set_defaults(object='BAMtoELRconverter')
 
 ### bed_to_elr.py ###
@@ -137,15 +154,20 @@ bed_to_elr_parser.set_defaults(object='BEDtoELRconverter')
 
 ### elr_combine.py ###
 combine_parser = subparsers.add_parser('elr-combine',help="Makes one unified End-Labeled Read (ELR) file from multiple sorted files.", description=ELRdesc, formatter_class=ArgumentDefaultsHelpFormatter)
-combine_parser.add_argument(dest='INPUT', help="Input sorted ELR files.", type=str, nargs='+')
-combine_parser.add_argument("-o", "--output", dest='OUTPUT', type=str, default=None, required=True, help="Filepath to write BED file.")
+combine_parser.add_argument(dest='INPUT', help="Input sorted ELR files ('-' for stdin).", type=str, nargs='+')
+combine_parser.add_argument("-o", "--output", dest='OUTPUT', type=str, default=None, required=True, help="Filepath to write ELR file ('-' for stdout).")
 combine_parser.add_argument("--temp", dest='TEMPDIR', type=str, default='_combinetmp', help="Prefix for temp files.")
+combine_parser.add_argument("--tmpdir", dest='TMPDIR', type=str, default=None, help="Directory for temp files (default: beside the input/output; system temp dir for stdin/stdout).")
+combine_parser.add_argument("--threads", dest='THREADS', type=int, default=1, help="Number of groups to merge in parallel when inputs exceed the fan-in.")
+combine_parser.add_argument("--fan_in", dest='FAN_IN', type=int, default=None, help="Maximum number of files merged at once (default: open file limit).")
+combine_parser.add_argument("--manifest", dest='MANIFEST', type=str, default=None, help="Write a table of locus cut points (chrom, offset, first, last, reads, weight) to this file.")
+combine_parser.add_argument("--max_gap", dest='MAX_GAP', type=int, default=50, help="Largest gap size within one locus of the --manifest (nucleotides).")
 combine_parser.set_defaults(object='ELRcombiner')
 
 
 ### elr_condense.py ###
 condense_parser = subparsers.add_parser('condense',help="Partial assembly an end-labeled read (ELR) file. Outputs all loci (no filters) to a new sorted ELR.", formatter_class=ArgumentDefaultsHelpFormatter)
-condense_parser.add_argument('-o','--output', dest='OUT', type=str, default=None, help="Destination file for assembly. File extension (bed, elr, gtf) determines output type.")
+condense_parser.add_argument('-o','--output', dest='OUT', type=str, default=None, help="Destination ELR file ('-' for stdout).")
 condense_parser.add_argument('--max_gap', dest='MAX_GAP', type=int, default=0, help="Largest gap size to tolerate (nucleotides).")
 condense_parser.add_argument('--end_cluster', dest='END_CLUSTER', type=int, default=50, help="Largest distance between end-labeled reads to consider the same cluster (nucleotides).")
 condense_parser.add_argument('--min_overhang', dest='MIN_OVERHANG', type=int, default=3, help="Smallest overhang to count for a read overlapping two exon fragments (number of nucleotides).")
@@ -159,20 +181,21 @@ condense_parser.add_argument('--cap_filter', dest='CAP_FILTER', type=float, defa
 condense_parser.add_argument("--starts", dest='STARTS', default=False, action='store_true', help="Sample is a Start Tag (5' end) file, e.g. CAGE")
 condense_parser.add_argument("--ends", dest='ENDS', default=False, action='store_true', help="Sample is an End Tag (3' end) file, e.g. 3P-Seq")
 condense_parser.add_argument("--sparse", dest='SPARSE', default=False, action='store_true', help="Sample is sparsely end-labeled, e.g. Smart-seq")
-condense_parser.add_argument(dest='INPUT', type=str, help="Input single ELR filepath. MUST be coordinate-sorted.")
+condense_parser.add_argument("--tmpdir", dest='TMPDIR', type=str, default=None, help="Directory for temp files (default: beside the input/output; system temp dir for stdin/stdout).")
+condense_parser.add_argument(dest='INPUT', type=str, help="Input single ELR filepath ('-' for stdin).")
 condense_parser.set_defaults(object='Condenser')
 
 
 ### elr_to_bed.py ###
 elr_to_bed_parser = subparsers.add_parser('elr-to-bed',help="Converts an End-Labeled Read (ELR) file to BED12.", formatter_class=ArgumentDefaultsHelpFormatter)
-elr_to_bed_parser.add_argument("-o", "--output", dest='OUTPUT', type=str, default=None, required=True, help="Filepath to write BED file.")
-elr_to_bed_parser.add_argument("INPUT", help='Input ELR file')
+elr_to_bed_parser.add_argument("-o", "--output", dest='OUTPUT', type=str, default=None, required=True, help="Filepath to write BED file ('-' for stdout).")
+elr_to_bed_parser.add_argument("INPUT", help="Input ELR file ('-' for stdin)")
 elr_to_bed_parser.set_defaults(object='ELRtoBEDconverter')
 
 ### fasta.py ###
 fasta_parser = subparsers.add_parser('fasta',help="Writes a transcript FASTA file for each input feature.", formatter_class=ArgumentDefaultsHelpFormatter)
 fasta_parser.add_argument("-o", "--output", dest='OUT', type=str, default='bookend.fasta', help="Filepath to write feature FASTA file.")
-fasta_parser.add_argument('--genome', dest='GENOME', required=True, help="(required) Path to genome FASTA file.", default=None)
+fasta_parser.add_argument('--genome', dest='GENOME', required=True, help="(required) Path to genome FASTA file (or a .gpack from genome-index).", default=None)
 fasta_parser.add_argument('--allow_unstranded', dest='UNSTRANDED', default=False, action='store_true', help="Allow unstranded transcripts to be written to output (forward strand).")
 fasta_parser.add_argument('INPUT', type=str, help="[GFF3/GTF/ELR/BED] Path to feature file(s)", nargs='*')
 fasta_parser.set_defaults(object='FastaWriter')
@@ -245,7 +268,7 @@ classify_parser.set_defaults(object='AssemblyClassifier')
 
 ### sam_sj_out.py ###
 sam_sj_parser = subparsers.add_parser('sam-to-sj',help="Generates a splice junction file (SJ.out.tab) from SAM.", formatter_class=ArgumentDefaultsHelpFormatter)
-sam_sj_parser.add_argument("-F", "--fasta", dest='FASTA', help="Genome FASTA file", default=None, type=str, required=True)
+sam_sj_parser.add_argument("-F", "--fasta", dest='FASTA', help="Genome FASTA file (or a .gpack from genome-index)", default=None, type=str, required=True)
 sam_sj_parser.add_argument("--format", dest='FORMAT', help="Output file format", default='star', type=str, choices=['bed','star'])
 sam_sj_parser.add_argument("--filter", dest='FILTER', help="Remove noncanonical splice junctions from the output", default=False, action='store_true')
 sam_sj_parser.add_argument("INPUT", type=str, help="Input SAM file")
@@ -269,20 +292,41 @@ sj_to_bed_parser.set_defaults(object='SJtoBEDconverter')
 
 ### elr_sort.py ###
 elr_sort_parser = subparsers.add_parser('elr-sort',help="Sorts an End-Labeled Read (ELR) file.", formatter_class=ArgumentDefaultsHelpFormatter)
-elr_sort_parser.add_argument("-o", "--output", dest='OUT', help="Output file path (default: stdout)", default='stdout')
+elr_sort_parser.add_argument("-o", "--output", dest='OUT', help="Output file path ('-' or default: stdout)", default='stdout')
 elr_sort_parser.add_argument("-f" ,"--force", dest='FORCE', help="Force overwrite of --output file if it exists.", default=False, action='store_true')
-elr_sort_parser.add_argument("INPUT", type=str, help="Input ELR file")
+elr_sort_parser.add_argument("--threads", dest='THREADS', help="Number of worker processes for sorting chunks in parallel.", default=1, type=int)
+elr_sort_parser.add_argument("--memory", dest='MEMORY', help="Memory budget for in-memory sort chunks (e.g. 500M, 8G).", default='2G', type=str)
+elr_sort_parser.add_argument("--manifest", dest='MANIFEST', help="Write a table of locus cut points (chrom, offset, first, last, reads, weight) to this file.", default=None, type=str)
+elr_sort_parser.add_argument("--max_gap", dest='MAX_GAP', help="Largest gap size within one locus of the --manifest (nucleotides).", default=50, type=int)
+elr_sort_parser.add_argument("--tmpdir", dest='TMPDIR', type=str, default=None, help="Directory for temp files (default: beside the input/output; system temp dir for stdin/stdout).")
+elr_sort_parser.add_argument("INPUT", type=str, help="Input ELR file ('-' for stdin)")
 elr_sort_parser.set_defaults(object='ELRsorter')
 
 ### elr_subset.py ###
 elr_subset_parser = subparsers.add_parser('elr-subset',help="Writes a subsetted region of an ELR file.", formatter_class=ArgumentDefaultsHelpFormatter)
-elr_subset_parser.add_argument("-o", "--output", dest='OUT', help="Output file path (default: stdout)", default='stdout')
+elr_subset_parser.add_argument("-o", "--output", dest='OUT', help="Output file path ('-' or default: stdout)", default='stdout')
 elr_subset_parser.add_argument("-f" ,"--force", dest='FORCE', help="Force overwrite of --output file if it exists.", default=False, action='store_true')
 elr_subset_parser.add_argument("-r" ,"--region", dest='REGION', help="[chrom:start-end] Region to write to output", type=str, required=True)
-elr_subset_parser.add_argument("INPUT", type=str, help="Input ELR file")
+elr_subset_parser.add_argument("INPUT", type=str, help="Input ELR file ('-' for stdin)")
 elr_subset_parser.set_defaults(object='ELRsubsetter')
 
 
+### elr_binary.py ###
+elr_convert_parser = subparsers.add_parser('elr-convert',help="Converts between text ELR (.elr, .elr.gz) and binary ELR (.elrb).", formatter_class=ArgumentDefaultsHelpFormatter)
+elr_convert_parser.add_argument("-o", "--output", dest='OUT', help="Output file path (.elrb for binary, .elr or .elr.gz for text, '-' for stdout)", type=str, required=True)
+elr_convert_parser.add_argument("-f" ,"--force", dest='FORCE', help="Force overwrite of --output file if it exists.", default=False, action='store_true')
+elr_convert_parser.add_argument("INPUT", type=str, help="Input ELR file (.elr, .elr.gz, .elrb, '-' for stdin)")
+elr_convert_parser.set_defaults(object='ELRbinaryConverter')
+
+
+### genome_index.py ###
+genome_index_parser = subparsers.add_parser('genome-index',help="Packs a genome FASTA file (2 bits per base, with N and soft-masked runs) into a .gpack directory that loads instantly.", formatter_class=ArgumentDefaultsHelpFormatter)
+genome_index_parser.add_argument("-o", "--output", dest='OUT', help="Output directory (default: INPUT.gpack, which is used automatically in place of INPUT)", type=str, default=None)
+genome_index_parser.add_argument("-f" ,"--force", dest='FORCE', help="Force overwrite of --output if it exists.", default=False, action='store_true')
+genome_index_parser.add_argument("INPUT", type=str, help="Genome FASTA file (.fa, .fasta, optionally .gz)")
+genome_index_parser.set_defaults(object='GenomeIndexer')
+
+
 ### gtf_to_bed.py ###
 gtf_to_bed_parser = subparsers.add_parser('gtf-to-bed',help="Converts a GTF/GFF3 annotation file to BED12.", formatter_class=ArgumentDefaultsHelpFormatter)
 gtf_to_bed_parser.add_argument("INPUT", type=str, help="Input GTF/GFF3 file")
@@ -3,11 +3,13 @@
 
 import sys
 import time
-import gzip
-import pysam
 from bookend.core.cython_utils._rnaseq_utils import RNAseqDataset, read_generator
 from bookend.core.cython_utils._assembly_utils import Locus
 from bookend.core.elr_combine import ELRcombiner
+from bookend.core.elr_sort import open_sorted_input
+from bookend.core.block_writer import BlockWriter
+from bookend.core.bam_to_elr import BAMtoELRconverter
+from bookend.core.argument_parsers import bam_to_elr_parser
 
 if __name__ == '__main__':
     sys.path.append('../../bookend')
@@ -19,6 +21,9 @@ class Assembler:
         # print(args)
         self.start_time = time.time()
         self.output = args['OUT']
+        if self.output == '-':
+            self.output = 'stdout'
+        
         self.source = args['SOURCE']
         self.cov_out = args['COV_OUT']
         self.incomplete = args['INCOMPLETE']
@@ -37,9 +42,16 @@ class Assembler:
         self.minlen = args['MINLEN']
         self.verbose = args['VERBOSE']
         self.input = args['INPUT']
+        self.tmpdir = args['TMPDIR']
         self.ignore_labels = args['IGNORE_LABELS']
         self.ignore_sources = not args['USE_SOURCES']
         self.require_cap = args['REQUIRE_CAP']
+        self.genome = args['GENOME']
+        self.start = args['START']
+        self.capped = args['CAPPED']
+        self.end = args['END']
+        self.stranded = args['STRANDED']
+        self.elr_out = args['ELR_OUT']
         self.antisense_filter = 0.01
         if self.ignore_labels:
             self.incomplete = True
@@ -50,24 +62,20 @@ class Assembler:
         
         if len(self.input) == 1:
             self.input = self.input[0]
-            if self.input_is_valid(self.input):
-                self.file_type = self.file_extension(self.input)
-                if self.file_type in ['bam','sam']:
-                    save = pysam.set_verbosity(0)
-                    self.input_file = pysam.AlignmentFile(self.input)
-                    save = pysam.set_verbosity(save)
-                    self.dataset = RNAseqDataset(chrom_array=self.input_file.header.references)
-                elif self.file_type == 'elr.gz':
+            if self.input == '-' or self.input_is_valid(self.input):
+                self.file_type = 'elr' if self.input == '-' else self.file_extension(self.input)
+                if self.file_type in ['bam','sam']: # Converted to sorted ELR as the file is read
                     self.dataset = RNAseqDataset()
-                    self.input_file = gzip.open(self.input, 'rt')
+                    self.input_file = self.stream_alignments(self.input)
+                    self.file_type = 'elr'
                 else:
                     self.dataset = RNAseqDataset()
-                    self.input_file = open(self.input, 'r')
+                    self.input_file, self.file_type = open_sorted_input(self.input, self.file_type, self.tmpdir)
             else:
                 print("\nERROR: input file must be a valid format (BED, ELR, BAM, SAM).")
                 sys.exit(1)
         elif len(self.input) > 1: # Interleave multiple input files for assembly
-            if not all([self.input_is_valid(filename, valid_formats=['elr','elr.gz']) for filename in self.input]):
+            if not all([self.input_is_valid(filename, valid_formats=['elr','elr.gz','elrb']) for filename in self.input]):
                 print("\nERROR: Multi-input assembly can only be performed on position-sorted ELR files.")
                 sys.exit(1)
             
@@ -76,7 +84,12 @@ class Assembler:
             combine_args = {
                 'INPUT':self.input,
                 'OUTPUT':'stdout',
-                'TEMPDIR':'{}_combinetmp'.format(self.input[0])
+                'TEMPDIR':'{}_combinetmp'.format(self.input[0]),
+                'TMPDIR':self.tmpdir,
+                'THREADS':1,
+                'FAN_IN':None,
+                'MANIFEST':None,
+                'MAX_GAP':0
             }
             combiner = ELRcombiner(combine_args)
             self.input_file = combiner.combine_files(combiner.input, combiner.output_file, iterator=True)
@@ -93,10 +106,32 @@ class Assembler:
         self.output_type = self.file_extension(self.output)
         if self.output_type is None:
             self.output_type = 'gtf'
+        elif self.output_type.endswith('.gz'): # Compressed output
+            self.output_type = self.output_type[:-3]
         
         self.generator = read_generator(self.input_file, self.dataset, self.file_type, self.max_gap, 0)
         self.chunk_counter = 0
-        self.output_file = open(self.output,'w')
+        self.output_file = BlockWriter(self.output)
+    
+    def stream_alignments(self, filename):
+        """Returns a generator of sorted ELR lines converted from a
+        coordinate-sorted BAM/SAM file, with the same label QC as bookend elr.
+        Options that assemble does not take keep the bookend elr defaults."""
+        convert_args = vars(bam_to_elr_parser.parse_args([filename]))
+        convert_args.update({
+            'GENOME':self.genome,
+            'START':self.start,
+            'CAPPED':self.capped,
+            'END':self.end,
+            'STRANDED':self.stranded,
+            'OUTPUT':self.elr_out
+        })
+        converter = BAMtoELRconverter(convert_args)
+        if converter.bam_in.header.to_dict().get('HD', {}).get('SO', 'coordinate') != 'coordinate':
+            print("\nERROR: BAM/SAM input to assemble must be sorted by position (samtools sort).")
+            sys.exit(1)
+        
+        return converter.generate_stream_lines(self.elr_out)
     
     def output_transcripts(self, transcript, output_type):
         """Writes the RNAseqMapping object 'transcript' to an output stream,
@@ -179,6 +214,8 @@ class Assembler:
         options_string += "  Input file:                                       {}\n".format(self.input)
         options_string += "  Output file (-o):                                 {}\n".format(self.output)
         options_string += "  Source name (--source):                           {}\n".format(self.source)
+        if self.elr_out is not None:
+            options_string += "  ELR side output (--elr_out):                      {}\n".format(self.elr_out)
         options_string += "  *** Experiment parameters ***\n"
         options_string += "  Max allowed gap in coverage (--max_gap):          {}\n".format(self.max_gap)
         options_string += "  Max end cluster distance (--end_cluster):         {}\n".format(self.end_cluster)
@@ -213,7 +250,7 @@ class Assembler:
         else:
             return split_name[-1].lower()
     
-    def input_is_valid(self, filename, valid_formats=['bed','elr','bam','sam','gtf','gff3','gff','elr.gz']):
+    def input_is_valid(self, filename, valid_formats=['bed','elr','bam','sam','gtf','gff3','gff','elr.gz','elrb']):
         """Boolean if the file is a format that Assembler can parse."""
         if self.file_extension(filename) in valid_formats:
             return True
@@ -255,14 +292,13 @@ class Assembler:
             
             self.process_entry(locus)
         
-        if len(self.input) == 1:
-            self.output_file.close()
-        
+        self.output_file.close()
         if self.cov_out:
             self.covfile.close()
         
         self.end_time = time.time()
-        print(self.display_summary())
+        if self.output != 'stdout':
+            print(self.display_summary())
 
 if __name__ == '__main__':
     from argument_parsers import assemble_parser as parser
@@ -1,16 +1,305 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from distutils import extension
 import sys
 import os
+import heapq
+from collections import deque
+from multiprocessing import Pool
 if __name__ == '__main__':
     sys.path.append('../../bookend')
 
-from bookend.core.cython_utils._rnaseq_utils import RNAseqDataset
+from bookend.core.cython_utils._rnaseq_utils import RNAseqDataset, SharedDataset
 import pysam
-from bookend.core.elr_sort import ELRsorter
-from bookend.core.elr_to_bed import ELRtoBEDconverter
+from bookend.core.elr_sort import ELRsorter, sorted_lines
+from bookend.core.block_writer import open_elr_output
+from bookend.core.sam_sj_out import SJcollector
+
+batch_size = 1000 # Read groups sent to a worker process at a time
+region_size = 10000000 # Default length of the regions of an indexed BAM read with --by_region
+dedup_window = 10000 # Bases behind the current read that UMIdeduplicator keeps keys for
+pair_window = 1000000 # Largest distance between mates that MatePairer waits for
+worker = None # (dataset, reference_ids, convert_args, collect_junctions, bam_in, dedup_umi) of a worker process, set by attach_worker()
+
+def attach_worker(shared_dataset, reference_ids, convert_args, collect_junctions=False, bam_filename=None, dedup_umi=False):
+    """Pool initializer. Rebuilds the dataset from its shared description once per worker process.
+    If bam_filename is given, the worker opens its own handle to the indexed BAM."""
+    global worker
+    bam_in = None
+    if bam_filename is not None:
+        save = pysam.set_verbosity(0)
+        bam_in = pysam.AlignmentFile(bam_filename)
+        save = pysam.set_verbosity(save)
+    
+    worker = (shared_dataset.attach(), reference_ids, convert_args, collect_junctions, bam_in, dedup_umi)
+
+class UMIdeduplicator:
+    def __init__(self, window=dedup_window):
+        """Drops reads that repeat the UMI, chrom, strand, labeled end
+        positions and intron chain of a read seen before. Unlabeled ends
+        are not compared, so duplicates that were fragmented differently
+        are still found. Reads must arrive roughly in position order: keys
+        are kept in a heap by the rightmost end of their read and forgotten
+        once reads start more than window bases past it, so the state stays
+        bounded however deep the library is, and a pair with a long insert
+        is remembered until the stream has passed both of its mates."""
+        self.window = window
+        self.seen = set()
+        self.ends = [] # Heap of (rightmost end, count, key)
+        self.chrom = None
+        self.counter = 0
+        self.removed = 0
+    
+    def is_duplicate(self, umi, read):
+        if read.chrom != self.chrom:
+            self.seen = set()
+            self.ends = []
+            self.chrom = read.chrom
+        
+        start, end = read.span
+        while self.ends and self.ends[0][0] < start - self.window:
+            self.seen.discard(heapq.heappop(self.ends)[2])
+        
+        key = (umi, read.strand, label_positions(read), tuple(read.junctions()))
+        if key in self.seen:
+            self.removed += 1
+            return True
+        
+        self.seen.add(key)
+        heapq.heappush(self.ends, (end, self.counter, key))
+        self.counter += 1
+        return False
+
+def label_positions(read):
+    """Genomic positions of the labeled start and end of a read, or None for an unlabeled end"""
+    if read.strand == -1:
+        start, end = read.span[1], read.span[0]
+    else:
+        start, end = read.span
+    
+    return (start if read.s_tag else None, end if read.e_tag else None)
+
+def read_umi(sam_line):
+    """The UMI that bookend label --umi appended to a read name, or None"""
+    name = sam_line.split('\t', 1)[0]
+    if '_UMI=' not in name:
+        return None
+    
+    return name.split('_UMI=')[-1]
+
+def mapping_number(sam_lines):
+    """The number of places a read aligned to: its NH tag, or else the
+    number of its SAM lines (halved if paired), as in bookend sam-to-sj"""
+    fields = sam_lines[0].rstrip().split('\t')
+    for tag in fields[11:]:
+        if tag.startswith('NH:i:'):
+            return int(tag[5:])
+    
+    if int(fields[1]) & 0x1:
+        return int(len(sam_lines)*0.5)
+    
+    return len(sam_lines)
+
+def convert_groups(dataset, read_groups, reference_ids, ignore_ends, secondary, error_rate, record_artifacts, sj_collector=None, group_sizes=None, deduplicator=None):
+    """Returns a list of ELR lines for each group of SAM lines with the same read ID.
+    The records of all groups are parsed together as one columnar block.
+    If an SJcollector is given, the junctions of each read are added to it;
+    a read with more than one mapping_number() counts as a multimapper.
+    group_sizes is passed on to add_read_groups_from_SAM() for groups that
+    hold a single alignment of each read. If a UMIdeduplicator is given,
+    mappings of reads with a UMI that duplicate an earlier read are dropped."""
+    dataset.read_list = []
+    counts = dataset.add_read_groups_from_SAM(read_groups, reference_ids, ignore_ends=ignore_ends, secondary=secondary, error_rate=error_rate, group_sizes=group_sizes)
+    elr_lines = [mapping.write_as_elr(record_artifacts=record_artifacts).rstrip() for mapping in dataset.read_list]
+    group_lines = []
+    first = 0
+    for i, count in enumerate(counts):
+        reads = dataset.read_list[first:first+count]
+        lines = elr_lines[first:first+count]
+        first += count
+        if deduplicator is not None and count > 0:
+            umi = read_umi(read_groups[i][0])
+            if umi is not None:
+                kept = [j for j in range(count) if not deduplicator.is_duplicate(umi, reads[j])]
+                reads = [reads[j] for j in kept]
+                lines = [lines[j] for j in kept]
+        
+        group_lines.append(lines)
+        if sj_collector is not None:
+            multi = mapping_number(read_groups[i]) > 1 if group_sizes is None else group_sizes[i] > len(read_groups[i])
+            sj_collector.add_reads(reads, multi)
+    
+    return group_lines
+
+def split_regions(bam_in, size=region_size):
+    """Splits the references of a BAM header into (chrom, start, end) regions of up to size bases"""
+    return [(chrom, start, min(length, start+size)) for chrom, length in zip(bam_in.header.references, bam_in.header.lengths) for start in range(0, length, size)]
+
+def line_position(elr_line):
+    """(chrom, start) of an ELR line, as integers"""
+    chrom, start = elr_line.split('\t', 2)[:2]
+    return int(chrom), int(start)
+
+def alignment_key(line):
+    """Identifies one mate pair: read ID, then the position of each mate"""
+    return (line.query_name, line.reference_id, line.reference_start, line.next_reference_id, line.next_reference_start)
+
+def mate_key(line):
+    """The alignment_key() of line's mate"""
+    return (line.query_name, line.next_reference_id, line.next_reference_start, line.reference_id, line.reference_start)
+
+def find_mate(bam_in, line):
+    """Fetches the mate of a paired alignment from an indexed BAM, or None"""
+    key = mate_key(line)
+    for candidate in bam_in.fetch(line.next_reference_name, line.next_reference_start, line.next_reference_start+1):
+        if alignment_key(candidate) == key and candidate.flag & 0xC0 != line.flag & 0xC0:
+            return candidate
+    
+    return None
+
+def group_size(bam_lines):
+    """The number of SAM lines a read would have if all its alignments were grouped"""
+    if bam_lines[0].has_tag('NH'):
+        return int(bam_lines[0].get_tag('NH')) * len(bam_lines)
+    
+    return len(bam_lines)
+
+def generate_region_groups(bam_in, chrom, start, end):
+    """Yields the read groups of a region of an indexed, coordinate-sorted
+    BAM as lists of pysam objects: each group is one alignment, with both
+    mates if it is a proper pair. A region owns the reads whose leftmost
+    mate starts in it. Left mates wait in a hash until their mate is read;
+    mates that start past the region's end are fetched from the index."""
+    pending = {}
+    for line in bam_in.fetch(chrom, start, end):
+        if line.reference_start < start: # Starts in an earlier region
+            continue
+        
+        if not line.flag & 0x1 or not line.flag & 0x2 or line.flag & 0x804: # Not part of a proper pair
+            yield [line]
+            continue
+        
+        own = (line.reference_id, line.reference_start)
+        mate = (line.next_reference_id, line.next_reference_start)
+        if mate < own:
+            if mate < (line.reference_id, start): # Owned by an earlier region
+                continue
+            
+            left = pending.pop(mate_key(line), None)
+            yield [line] if left is None else sorted([left, line], key=lambda l:not l.flag & 0x40)
+        elif mate == own and mate_key(line) in pending:
+            left = pending.pop(mate_key(line))
+            yield sorted([left, line], key=lambda l:not l.flag & 0x40)
+        else:
+            pending[alignment_key(line)] = line
+    
+    for line in pending.values(): # Mates not found in the region
+        right = None
+        if (line.next_reference_id, line.next_reference_start) >= (line.reference_id, end):
+            right = find_mate(bam_in, line)
+        
+        yield [line] if right is None else sorted([line, right], key=lambda l:not l.flag & 0x40)
+
+class MatePairer:
+    def __init__(self, bam_lines, window=pair_window):
+        """Iterates over a stream of coordinate-sorted alignments, yielding
+        read groups as generate_region_groups() does. A left mate waits
+        until the stream reaches its mate's position; left mates whose mate
+        is more than window bases away (or on another chrom), or is not found
+        where expected, are yielded alone. frontier() bounds the start of
+        any group still to come, so the caller can release sorted output."""
+        self.bam_lines = bam_lines
+        self.window = window
+        self.pending = {} # Left mates by alignment_key(), in stream order
+        self.due = [] # Heap of (mate position, count, key) of pending left mates
+        self.position = (-1, -1)
+        self.counter = 0
+    
+    def frontier(self):
+        """(chrom, start) of the earliest alignment that can still be yielded"""
+        for line in self.pending.values():
+            return min(self.position, (line.reference_id, line.reference_start))
+        
+        return self.position
+    
+    def __iter__(self):
+        for line in self.bam_lines:
+            if line.reference_id < 0: # Unplaced reads are at the end of the file
+                break
+            
+            position = (line.reference_id, line.reference_start)
+            if position < self.position:
+                print("\nERROR: alignments must be sorted by position (samtools sort).")
+                sys.exit(1)
+            
+            self.position = position
+            while self.due and self.due[0][0] < position: # The stream passed the mate without finding it
+                left = self.pending.pop(heapq.heappop(self.due)[2], None)
+                if left is not None:
+                    yield [left]
+            
+            if not line.flag & 0x1 or not line.flag & 0x2 or line.flag & 0x804: # Not part of a proper pair
+                yield [line]
+                continue
+            
+            mate = (line.next_reference_id, line.next_reference_start)
+            if mate < position or (mate == position and mate_key(line) in self.pending):
+                left = self.pending.pop(mate_key(line), None)
+                yield [line] if left is None else sorted([left, line], key=lambda l:not l.flag & 0x40)
+            elif mate[0] != position[0] or mate[1] - position[1] > self.window:
+                yield [line]
+            else:
+                self.pending[alignment_key(line)] = line
+                heapq.heappush(self.due, (mate, self.counter, alignment_key(line)))
+                self.counter += 1
+        
+        for line in self.pending.values():
+            yield [line]
+        
+        self.pending = {}
+        self.due = []
+
+def convert_region(dataset, bam_in, region, reference_ids, convert_args, sj_collector=None, dedup_umi=False):
+    """Converts the reads owned by a region of an indexed BAM. Returns
+    their ELR lines, sorted and collapsed as by elr-sort, and the number
+    of UMI duplicates removed if dedup_umi is set."""
+    deduplicator = UMIdeduplicator() if dedup_umi else None
+    groups = []
+    sizes = []
+    for bam_lines in generate_region_groups(bam_in, *region):
+        groups.append([line.to_string() for line in bam_lines])
+        sizes.append(group_size(bam_lines))
+    
+    elr_lines = []
+    for first in range(0, len(groups), batch_size):
+        for group_lines in convert_groups(dataset, groups[first:first+batch_size], reference_ids, sj_collector=sj_collector, group_sizes=sizes[first:first+batch_size], deduplicator=deduplicator, **convert_args):
+            elr_lines += group_lines
+    
+    return list(sorted_lines(elr_lines)), deduplicator.removed if dedup_umi else 0
+
+def convert_batch(batch):
+    """Converts a batch of read groups, each a list of SAM strings, to ELR
+    lines in a worker process. Returns (elr_lines, label_tally, junctions)
+    for the batch, where junctions is an SJcollector tally or None."""
+    dataset, reference_ids, convert_args, collect_junctions, bam_in, dedup_umi = worker
+    for tally in dataset.label_tally.values():
+        tally.clear()
+    
+    sj_collector = SJcollector() if collect_junctions else None
+    elr_lines = [line for group_lines in convert_groups(dataset, batch, reference_ids, sj_collector=sj_collector, **convert_args) for line in group_lines]
+    return elr_lines, dataset.label_tally, sj_collector.junctions if collect_junctions else None
+
+def convert_region_batch(region):
+    """Converts one region of an indexed BAM in a worker process.
+    Returns (elr_lines, label_tally, junctions) as convert_batch(),
+    then the number of UMI duplicates removed."""
+    dataset, reference_ids, convert_args, collect_junctions, bam_in, dedup_umi = worker
+    for tally in dataset.label_tally.values():
+        tally.clear()
+    
+    sj_collector = SJcollector() if collect_junctions else None
+    elr_lines, duplicates = convert_region(dataset, bam_in, region, reference_ids, convert_args, sj_collector, dedup_umi)
+    return elr_lines, dataset.label_tally, sj_collector.junctions if collect_junctions else None, duplicates
 
 class BAMtoELRconverter:
     def __init__(self, args):
@@ -35,14 +324,29 @@ class BAMtoELRconverter:
         self.input = args['INPUT']
         self.error_rate = args['ERROR_RATE']
         self.remove_noncanonical = args['REMOVE_NONCANONICAL']
+        self.tmpdir = args['TMPDIR']
+        self.threads = max(1, args['THREADS'])
+        self.memory = args['MEMORY']
+        self.sj_out = args['SJ_OUT']
+        self.by_region = args['BY_REGION']
+        self.region_size = args['REGION_SIZE']
+        self.dedup_umi = args['DEDUP_UMI']
+        self.duplicates = 0
         if self.start or self.end or self.capped:
             self.stranded = True
         
+        if self.dedup_umi: # Duplicates are found in a window over position-sorted reads
+            self.by_region = True
+        
         self.ext = 'elr'
-        if self.output is None:
+        if self.output in ['-', 'stdout'] or (self.output is None and self.input == '-'):
+            self.output = 'stdout'
+        elif self.output is None:
             self.output = '{}.{}'.format(self.input,self.ext)
         elif '.' in self.output:
             self.ext = self.output.split('.')[-1]
+            if self.ext.lower() == 'gz' and self.output.count('.') > 1: # Compressed output
+                self.ext = self.output.split('.')[-2]
         else:
             self.output = '{}.{}'.format(self.output,self.ext)
         
@@ -52,22 +356,18 @@ class BAMtoELRconverter:
         if self.end_seq.lower == 'none':
             self.end_seq = ''
         
-        if self.input.split('.')[-1].lower() not in ['bam','sam']:
+        if self.input != '-' and self.input.split('.')[-1].lower() not in ['bam','sam']:
             print("\nERROR: input file must be BAM/SAM format.")
             sys.exit(1)
         
-        if self.output.split('.')[-1].lower() not in ['elr','bed', 'bed12']:
+        if self.ext.lower() not in ['elr','bed', 'bed12']:
             print("\nERROR: output file must be ELR or BED format.")
             sys.exit(1)
         
+        self.sj_format = 'bed' if self.sj_out is not None and self.sj_out.lower().endswith('.bed') else 'star'
+        self.sj_collector = SJcollector() if self.sj_out is not None else None
+        
         self.output_dict = {}
-        self.tempout = '_unsorted.'+self.output
-        self.tempout_file = open(self.tempout, 'w')
-        if self.ext.lower() in ['bed','bed12']:
-            self.output_format = 'bed'
-        else:
-            self.output_format = 'elr'
-
         self.config_dict = {
             'source':self.source,
             's_tag':self.start,
@@ -95,6 +395,10 @@ class BAMtoELRconverter:
         if self.source is None:
             self.source = self.bam_in.header['PG'][0]['ID']
         
+        if self.by_region and (self.input == '-' or not self.bam_in.has_index()):
+            print("\nERROR: --by_region and --dedup_umi require a coordinate-sorted BAM file with an index (samtools index).")
+            sys.exit(1)
+        
         self.dataset = RNAseqDataset(
             chrom_array=self.bam_in.header.references, 
             chrom_lengths=list(self.bam_in.header.lengths),
@@ -105,11 +409,20 @@ class BAMtoELRconverter:
         self.sort_args = {
             'OUT':self.output,
             'FORCE':True,
-            'INPUT':self.tempout
+            'INPUT':self.output,
+            'TMPDIR':self.tmpdir,
+            'THREADS':self.threads,
+            'MEMORY':self.memory,
+            'MANIFEST':None,
+            'MAX_GAP':0
         }
-        if self.output_format == 'bed':
-            self.sort_args['OUT'] += '.elr'
-        
+        self.convert_args = {
+            'ignore_ends':self.no_ends,
+            'secondary':self.secondary,
+            'error_rate':self.error_rate,
+            'record_artifacts':self.record_artifacts
+        }
+        self.reference_ids = {name:i for i,name in enumerate(self.bam_in.header.references)}
         self.failures = []
         self.generator = self.generate_bam_entries()
     
@@ -130,27 +443,176 @@ class BAMtoELRconverter:
         
         yield bam_lines
 
-    def output_lines(self, lines, output):
-        """Takes a list of bed lines and writes
-        them to the output stream.
-        """
-        if output == 'stdout':
-            for output_string in lines:
-                print(output_string)
-        else:
-            output.write('\n'.join(lines)+'\n')
-
-    def write_elr(self, output):
-        out_strings = [mapping.write_as_elr(record_artifacts=self.record_artifacts).rstrip() for mapping in self.dataset.read_list]
-        self.output_lines(out_strings, output)
-
-    def process_entry(self, bam_lines):
-        self.dataset.read_list = []
-        self.dataset.add_read_from_BAM(bam_lines, ignore_ends=self.no_ends, secondary=self.secondary, error_rate=self.error_rate)
-        if len(self.dataset.read_list) > 0:
-            self.write_elr(self.tempout_file)
+    def process_batch(self, read_groups):
+        """Converts a batch of read groups and adds the ELR lines to the sorter"""
+        for bam_lines, group_lines in zip(read_groups, convert_groups(self.dataset, read_groups, self.reference_ids, sj_collector=self.sj_collector, **self.convert_args)):
+            if len(group_lines) > 0:
+                self.sorter.add_lines(group_lines)
+            else:
+                self.failures += bam_lines
+    
+    def generate_batches(self):
+        """Yields lists of batch_size read groups as SAM strings"""
+        batch = []
+        for bam_lines in self.generator:
+            batch.append([line.to_string() for line in bam_lines])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        
+        if len(batch) > 0:
+            yield batch
+    
+    def process_batches(self):
+        """Converts read groups on a pool of worker processes. Workers
+        attach to a SharedDataset, so the genome is mapped once rather
+        than copied into each worker. Results are written in input order,
+        with at most two batches per worker in flight."""
+        shared_dataset = SharedDataset(self.dataset, self.tmpdir)
+        pool = Pool(self.threads, attach_worker, (shared_dataset, self.reference_ids, self.convert_args, self.sj_collector is not None))
+        pending = deque()
+        for batch in self.generate_batches():
+            pending.append(pool.apply_async(convert_batch, (batch,)))
+            while len(pending) > 2 * self.threads:
+                self.write_batch(*pending.popleft().get())
+        
+        while pending:
+            self.write_batch(*pending.popleft().get())
+        
+        pool.close()
+        pool.join()
+        shared_dataset.close()
+    
+    def generate_region_results(self, regions):
+        """Yields (elr_lines, label_tally, junctions, duplicates) for each
+        region in order. With more than one thread, regions are converted on
+        a pool of worker processes that each fetch from their own BAM handle."""
+        if self.threads == 1:
+            for region in regions:
+                elr_lines, duplicates = convert_region(self.dataset, self.bam_in, region, self.reference_ids, self.convert_args, self.sj_collector, self.dedup_umi)
+                yield elr_lines, {}, None, duplicates
+            
+            return
+        
+        shared_dataset = SharedDataset(self.dataset, self.tmpdir)
+        pool = Pool(self.threads, attach_worker, (shared_dataset, self.reference_ids, self.convert_args, self.sj_collector is not None, self.input, self.dedup_umi))
+        pending = deque()
+        for region in regions:
+            pending.append(pool.apply_async(convert_region_batch, (region,)))
+            while len(pending) > 2 * self.threads:
+                yield pending.popleft().get()
+        
+        while pending:
+            yield pending.popleft().get()
+        
+        pool.close()
+        pool.join()
+        shared_dataset.close()
+    
+    def generate_stream_lines(self, elr_out=None):
+        """Yields the ELR header, then the reads of a coordinate-sorted BAM
+        in sort order as the file streams, without an index or temp files.
+        Mates are paired by a MatePairer, and reads are converted in batches.
+        Converted lines are held until the pairer's frontier, less the longest
+        leading softclip seen, has passed them, then collapsed as by elr-sort.
+        If elr_out is a filename, the lines are also written there."""
+        output_file = open_elr_output(elr_out, self.threads) if elr_out is not None else None
+        for header_line in self.dataset.dump_header():
+            if output_file is not None:
+                output_file.write('{}\n'.format(header_line))
+            
+            yield header_line
+        
+        pairer = MatePairer(self.bam_in)
+        held = []
+        batch = []
+        sizes = []
+        flank = 0
+        groups = iter(pairer)
+        while True:
+            bam_lines = next(groups, None)
+            if bam_lines is not None:
+                batch.append([line.to_string() for line in bam_lines])
+                sizes.append(group_size(bam_lines))
+                flank = max([flank] + [line.query_alignment_start for line in bam_lines])
+                if len(batch) < batch_size:
+                    continue
+            
+            elr_lines = [line for group_lines in convert_groups(self.dataset, batch, self.reference_ids, sj_collector=self.sj_collector, group_sizes=sizes, **self.convert_args) for line in group_lines]
+            held = list(heapq.merge(held, sorted(elr_lines, key=line_position), key=line_position))
+            batch = []
+            sizes = []
+            if bam_lines is None: # End of the file
+                bound = (len(self.reference_ids), 0)
+            else:
+                chrom, start = pairer.frontier()
+                bound = (chrom, start - flank)
+            
+            i = 0
+            while i < len(held) and line_position(held[i]) < bound:
+                i += 1
+            
+            for elr_line in sorted_lines(held[:i]): # Identical reads share a position, so they are released together
+                if output_file is not None:
+                    output_file.write('{}\n'.format(elr_line))
+                
+                yield elr_line
+            
+            held = held[i:]
+            if bam_lines is None:
+                break
+        
+        if output_file is not None:
+            output_file.close()
+    
+    def process_regions(self):
+        """Converts a coordinate-sorted, indexed BAM region by region. Each
+        region's reads come back sorted, so they only need to be merged
+        with the lines held back from the regions before it: reads can start
+        slightly outside the region that owns them (after softclip repair
+        or exon trimming), but never before the previous region's start.
+        Lines before the start of the latest region are collapsed as by
+        elr-sort and written out, so identical reads from neighboring
+        regions become one line."""
+        if self.output == 'stdout':
+            self.output_file = sys.stdout
         else:
-            self.failures += bam_lines
+            self.output_file = open_elr_output(self.output, self.threads)
+        
+        for header_line in self.dataset.dump_header():
+            self.output_file.write('{}\n'.format(header_line))
+        
+        held = []
+        regions = split_regions(self.bam_in, self.region_size)
+        for region, (elr_lines, label_tally, junctions, duplicates) in zip(regions, self.generate_region_results(regions)):
+            self.write_batch(elr_lines, label_tally, junctions, write=False)
+            self.duplicates += duplicates
+            held = list(heapq.merge(held, elr_lines, key=line_position))
+            bound = (self.reference_ids[region[0]], region[1])
+            i = 0
+            while i < len(held) and line_position(held[i]) < bound:
+                i += 1
+            
+            for elr_line in sorted_lines(held[:i]): # Identical reads share a position, so they are released together
+                self.output_file.write('{}\n'.format(elr_line))
+            
+            held = held[i:]
+        
+        for elr_line in sorted_lines(held):
+            self.output_file.write('{}\n'.format(elr_line))
+        
+        if self.output != 'stdout':
+            self.output_file.close()
+    
+    def write_batch(self, elr_lines, label_tally, junctions=None, write=True):
+        if write:
+            self.sorter.add_lines(elr_lines)
+        
+        for label, tally in label_tally.items():
+            self.dataset.label_tally[label].update(tally)
+        
+        if junctions is not None:
+            self.sj_collector.update(junctions)
     
     def display_options(self):
         """Returns a string describing all input args"""
@@ -158,6 +620,12 @@ class BAMtoELRconverter:
         options_string += "  Input file:                         {}\n".format(self.input)
         options_string += "  Reference genome file:              {}\n".format(self.genome)
         options_string += "  Output file (-o):                   {}\n".format(self.output)
+        options_string += "  Threads (--threads):                {}\n".format(self.threads)
+        options_string += "  Splice junction file (--sj_out):    {}\n".format(self.sj_out)
+        if self.by_region:
+            options_string += "  Region length (--region_size):      {}\n".format(self.region_size)
+        
+        options_string += "  Remove UMI duplicates (--dedup_umi): {}\n".format(self.dedup_umi)
         options_string += "  *** Experiment parameters ***\n"
         options_string += "  Reads start at RNA 5' ends (-s):    {}\n".format(self.start)
         options_string += "  Reads are from capped RNA (-c):     {}\n".format(self.capped)
@@ -222,6 +690,9 @@ class BAMtoELRconverter:
             )
             
         
+        if self.dedup_umi:
+            summary += 'Removed {} UMI duplicates.\n'.format(self.duplicates)
+        
         return summary
     
     def run(self):
@@ -229,26 +700,24 @@ class BAMtoELRconverter:
         if self.output != 'stdout':
             print(self.display_options())
         
-        self.output_lines(self.dataset.dump_header(),self.tempout_file)       
-        for entry in self.generator:
-            self.process_entry(entry)
-        
-        self.tempout_file.close()
-        Sorter = ELRsorter(self.sort_args)
-        Sorter.run()
-        os.remove(self.tempout)
-        if self.output_format == 'bed':
-            convert_args = {
-                'INPUT':self.sort_args['OUT'],
-                'HEADER':None,
-                'OUTPUT':self.output
-            }
-            Converter = ELRtoBEDconverter(convert_args)
-            print('Converting to BED...')
-            Converter.run()
-            os.remove(self.sort_args['OUT'])
-        
-        print(self.display_summary())
+        if self.by_region: # Regions are converted in sort order
+            self.process_regions()
+        else:
+            self.sorter = ELRsorter(self.sort_args) # Reads are sorted as they are converted
+            self.sorter.add_lines(self.dataset.dump_header())
+            if self.threads > 1:
+                self.process_batches()
+            else:
+                for batch in self.generate_batches():
+                    self.process_batch(batch)
+            
+            self.sorter.finish()
+        
+        if self.sj_collector is not None:
+            self.sj_collector.write(self.sj_out, self.dataset, self.sj_format)
+        
+        if self.output != 'stdout':
+            print(self.display_summary())
 
 
 
@@ -3,10 +3,11 @@
 
 import sys
 import time
-import gzip
 from pysam import AlignmentFile
 import bookend.core.cython_utils._rnaseq_utils as ru
 from bookend.core.elr_combine import ELRcombiner
+from bookend.core.elr_sort import open_sorted_input
+from bookend.core.block_writer import BlockWriter
 
 if __name__ == '__main__':
     sys.path.append('../../bookend')
@@ -20,12 +21,16 @@ class Bedgrapher:
         self.strand = args['STRAND']
         self.intstrand = {'.':0,'+':1,'-':-1}[self.strand]
         self.output = args['OUT']
+        if self.output == '-':
+            self.output = 'stdout'
+        
         self.input = args['INPUT']    
+        self.tmpdir = args['TMPDIR']
         # self.scale = args['SCALE']    
         if len(self.input) == 1:
             self.input = self.input[0]
-            if self.input_is_valid(self.input):
-                self.file_type = self.file_extension(self.input)
+            if self.input == '-' or self.input_is_valid(self.input):
+                self.file_type = 'elr' if self.input == '-' else self.file_extension(self.input)
                 if self.file_type in ['bam','sam']:
                     try:
                         self.input_file = AlignmentFile(self.input)
@@ -34,17 +39,14 @@ class Bedgrapher:
                         sys.exit(1)
                     
                     self.dataset = ru.RNAseqDataset(chrom_array=self.input_file.header.references)
-                elif self.file_type == 'elr.gz':
-                    self.dataset = ru.RNAseqDataset()
-                    self.input_file = gzip.open(self.input, 'rt')
                 else:
                     self.dataset = ru.RNAseqDataset()
-                    self.input_file = open(self.input,'r')
+                    self.input_file, self.file_type = open_sorted_input(self.input, self.file_type, self.tmpdir)
             else:
                 print("\nERROR: input file must be a valid format (BED, ELR, BAM, SAM).")
                 sys.exit(1)
         elif len(self.input) > 1: # Interleave multiple input files for assembly
-            if not all([self.input_is_valid(filename, valid_formats=['elr','elr.gz']) for filename in self.input]):
+            if not all([self.input_is_valid(filename, valid_formats=['elr','elr.gz','elrb']) for filename in self.input]):
                 print("\nERROR: Multi-input assembly can only be performed on position-sorted ELR files.")
                 sys.exit(1)
             
@@ -53,7 +55,12 @@ class Bedgrapher:
             combine_args = {
                 'INPUT':self.input,
                 'OUTPUT':'stdout',
-                'TEMPDIR':'{}_combinetmp'.format(self.input[0])
+                'TEMPDIR':'{}_combinetmp'.format(self.input[0]),
+                'TMPDIR':self.tmpdir,
+                'THREADS':1,
+                'FAN_IN':None,
+                'MANIFEST':None,
+                'MAX_GAP':0
             }
             combiner = ELRcombiner(combine_args)
             self.input_file = combiner.combine_files(combiner.input, combiner.output_file, iterator=True)
@@ -63,15 +70,15 @@ class Bedgrapher:
         
         self.generator = ru.read_generator(self.input_file, self.dataset, self.file_type, 0, 0)
         self.chunk_counter = 0
-        self.output_file = open(self.output,'w')
+        self.output_file = BlockWriter(self.output)
     
     def process_entry(self, chunk):
         if len(chunk) > 0:
             chrom = self.dataset.chrom_array[chunk[0].chrom]
             self.chunk_counter += 1
             leftmost, rightmost = ru.range_of_reads(chunk)
-            depth_matrix, J_plus, J_minus = ru.build_depth_matrix(leftmost, rightmost, tuple(chunk), use_attributes=True, splice=True)
-            self.output_file.write(ru.bedgraph(chrom, leftmost, depth_matrix, self.type, self.intstrand))
+            coverage, end_signal, J_plus, J_minus = ru.build_depth_matrix(leftmost, rightmost, tuple(chunk), use_attributes=True, splice=True)
+            self.output_file.write(ru.bedgraph(chrom, leftmost, coverage, end_signal, self.type, self.intstrand))
     
     def display_options(self):
         """Returns a string describing all input args"""
@@ -97,7 +104,7 @@ class Bedgrapher:
         else:
             return split_name[-1].lower()
     
-    def input_is_valid(self, filename, valid_formats=['bed','elr','bam','sam','gtf','gff3','gff','elr.gz']):
+    def input_is_valid(self, filename, valid_formats=['bed','elr','bam','sam','gtf','gff3','gff','elr.gz','elrb']):
         """Boolean if the file is a format that Assembler can parse."""
         if self.file_extension(filename) in valid_formats:
             return True
@@ -126,11 +133,11 @@ class Bedgrapher:
             chunk = self.filter_readtypes(chunk)
             self.process_entry(chunk)
         
-        if len(self.input) == 1:
-            self.output_file.close()
+        self.output_file.close()
         
         self.end_time = time.time()
-        print(self.display_summary())
+        if self.output != 'stdout':
+            print(self.display_summary())
 
 if __name__ == '__main__':
     from argument_parsers import assemble_parser as parser
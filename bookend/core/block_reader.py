@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import io
+import sys
+import gzip
+import queue
+import threading
+
+read_size = 1 << 20 # Bytes read (after decompression) per line block
+queue_blocks = 8 # Line blocks held ahead of the consumer
+
+class BlockReader:
+    def __init__(self, filename, block_size=read_size, max_blocks=queue_blocks):
+        """Iterates over the lines of a text or gzipped file. A background
+        thread reads, decompresses and splits the input into blocks of lines,
+        handing them over through a bounded queue, so decompression overlaps
+        with the work done on each line. zlib releases the GIL, so the two
+        run concurrently without a process pool. A filename of '-' reads
+        standard input, which is decompressed if it starts with gzip magic."""
+        self.filename = filename
+        self.block_size = block_size
+        self.blocks = queue.Queue(max_blocks)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.read_blocks, daemon=True)
+        self.thread.start()
+    
+    def read_blocks(self):
+        """Puts lists of lines on the queue, then None at the end of the file.
+        An exception is handed to the consumer to be raised there."""
+        try:
+            if self.filename == '-':
+                file = sys.stdin.buffer
+                if file.peek(2)[:2] == b'\x1f\x8b':
+                    file = gzip.GzipFile(fileobj=file, mode='rb')
+            elif self.filename.lower().endswith('.gz'):
+                file = gzip.open(self.filename, 'rb')
+            else:
+                file = open(self.filename, 'rb')
+            
+            remainder = b''
+            while not self.stopped.is_set():
+                data = file.read(self.block_size)
+                if not data:
+                    break
+                
+                data = remainder + data
+                cut = data.rfind(b'\n') + 1 # Keep any partial last line for the next block
+                remainder = data[cut:]
+                if cut > 0:
+                    self.put(io.StringIO(data[:cut].decode()).readlines())
+            
+            if remainder:
+                self.put([remainder.decode()])
+            
+            file.close()
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+    
+    def put(self, item):
+        """Waits for space on the queue unless the reader was closed"""
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def __iter__(self):
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                return
+            elif isinstance(block, Exception):
+                raise block
+            
+            for line in block:
+                yield line
+    
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import zlib
+import struct
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+bgzf_block_size = 0xff00 # Uncompressed bytes per BGZF block
+batch_size = bgzf_block_size * 16 # Bytes buffered before a batch is written or compressed
+bgzf_eof = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+index_bin_size = 16384 # Genomic bin width of the region index of a block-gzipped ELR file
+
+def is_stream(filename):
+    """True if filename names standard input or output ('-')"""
+    return filename in ['-', 'stdin', 'stdout']
+
+def temp_name(filename, tmpdir=None, prefix='', suffix=''):
+    """Path of a temp file named after filename. Temp files are written
+    beside filename, or in tmpdir if one is given. Temp files of a stream
+    go in the system temp directory under a name unique to this process."""
+    if is_stream(filename):
+        filename = 'bookend{}'.format(os.getpid())
+        if tmpdir is None:
+            tmpdir = tempfile.gettempdir()
+    
+    if tmpdir is None:
+        tmpdir = os.path.dirname(filename)
+    
+    return os.path.join(tmpdir, prefix + os.path.basename(filename) + suffix)
+
+def compress_block(data, level):
+    """Compresses up to bgzf_block_size bytes as one BGZF block: a gzip
+    member whose header carries the block size in a 'BC' extra field."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    return header + deflated + struct.pack('<2I', zlib.crc32(data), len(data))
+
+def compress_batch(data, level):
+    """Splits data into BGZF-sized pieces and compresses each. zlib releases
+    the GIL, so batches compress in parallel on a thread pool."""
+    return [compress_block(data[i:i+bgzf_block_size], level) for i in range(0, len(data), bgzf_block_size)]
+
+class BlockWriter:
+    def __init__(self, filename, threads=1, level=6):
+        """Buffered text output shared by the ELR/BED/GTF writers.
+        Strings are collected into large batches before they are written.
+        If filename ends in .gz, each batch is compressed into BGZF blocks
+        by a pool of background threads while the caller keeps formatting
+        records, and blocks are written in order. Output stays readable
+        by gzip and by BGZF-aware tools. A filename of '-' or 'stdout'
+        writes uncompressed text to standard output."""
+        self.filename = filename
+        self.stream = is_stream(filename)
+        self.compressed = filename.lower().endswith('.gz') and not self.stream
+        self.threads = max(1, threads)
+        self.level = level
+        if self.stream:
+            sys.stdout.flush()
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(filename, 'wb')
+        
+        self.buffer = []
+        self.buffered = 0
+        self.bytes_written = 0
+        self.blocks_submitted = 0
+        self.block_offsets = []
+        self.pending = deque()
+        self.pool = ThreadPoolExecutor(self.threads) if self.compressed else None
+    
+    def write(self, string):
+        data = string.encode()
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= batch_size:
+            self.submit()
+    
+    def submit(self):
+        """Writes the buffer, or queues it for compression. At most
+        two batches per thread are held in memory at once."""
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if not self.compressed:
+            self.file.write(data)
+            self.bytes_written += len(data)
+            return
+        
+        self.blocks_submitted += -(-len(data) // bgzf_block_size)
+        self.pending.append(self.pool.submit(compress_batch, data, self.level))
+        while len(self.pending) > 2 * self.threads:
+            self.write_blocks(self.pending.popleft().result())
+    
+    def write_blocks(self, blocks):
+        for block in blocks:
+            self.block_offsets.append(self.bytes_written)
+            self.file.write(block)
+            self.bytes_written += len(block)
+    
+    def tell(self):
+        """Returns the address of the next byte to be written. For plain
+        output this is the byte offset. For compressed output it is
+        block_number << 16 | offset_in_block, which resolve() converts
+        to a BGZF virtual offset once that block has been written."""
+        if not self.compressed:
+            return self.bytes_written + self.buffered
+        
+        return (self.blocks_submitted + self.buffered // bgzf_block_size) << 16 | (self.buffered % bgzf_block_size)
+    
+    def resolve(self, address):
+        if not self.compressed:
+            return address
+        
+        block = address >> 16
+        if block >= len(self.block_offsets): # End of the written data
+            return self.bytes_written << 16
+        
+        return self.block_offsets[block] << 16 | (address & 0xFFFF)
+    
+    def flush(self):
+        """Writes all buffered and pending data"""
+        if self.buffered > 0:
+            self.submit()
+        
+        while self.pending:
+            self.write_blocks(self.pending.popleft().result())
+        
+        self.file.flush()
+    
+    def close(self):
+        self.flush()
+        if self.compressed:
+            self.file.write(bgzf_eof)
+            self.pool.shutdown()
+        
+        if not self.stream:
+            self.file.close()
+
+def index_name(filename):
+    """Path of the region index written alongside a block-gzipped ELR file"""
+    return '{}.idx'.format(filename)
+
+def index_is_current(filename):
+    """True if filename has a region index that is at least as new as the file.
+    An index older than its data file is stale and must not be used for seeking."""
+    return os.path.exists(index_name(filename)) and os.path.getmtime(index_name(filename)) >= os.path.getmtime(filename)
+
+def open_elr_output(filename, threads=1):
+    """Opens an ELR output file for writing. Files ending in .gz are
+    written as block-gzipped (BGZF) ELR with a region index, compressed
+    on a pool of threads, and files ending in .elrb as binary ELR.
+    BED filenames (.bed, .bed12, optionally .gz) are written as BED12."""
+    # elr_binary and elr_to_bed import this module, so their writers are imported here
+    from bookend.core.elr_binary import ELRbinaryWriter, is_binary_elr
+    from bookend.core.elr_to_bed import BEDwriter
+    extension = filename.lower()[:-3] if filename.lower().endswith('.gz') else filename.lower()
+    if extension.split('.')[-1] in ['bed', 'bed12']:
+        return BEDwriter(filename, threads)
+    elif filename.lower().endswith('.gz'):
+        return IndexedELRwriter(filename, threads)
+    elif is_binary_elr(filename):
+        return ELRbinaryWriter(filename)
+    
+    return BlockWriter(filename)
+
+class IndexedELRwriter:
+    def __init__(self, filename, threads=1):
+        """Writes sorted ELR lines to a BGZF file, which stays readable by gzip,
+        and records the virtual offset of the first read in each genomic bin.
+        On close(), the index is written to filename.idx as lines of
+            #M chrom max_length   (longest read on each chrom)
+            chrom  position  virtual_offset
+        """
+        self.filename = filename
+        self.writer = BlockWriter(filename, threads)
+        self.entries = []
+        self.max_length = {}
+        self.last_chrom = None
+        self.last_bin = -1
+    
+    def write(self, string):
+        for line in string.splitlines(True):
+            if line[0] != '#':
+                chrom, start, length = line.split('\t', 3)[:3]
+                start = int(start)
+                length = int(length)
+                if chrom != self.last_chrom or start // index_bin_size != self.last_bin:
+                    self.entries.append((chrom, start, self.writer.tell()))
+                    self.last_chrom = chrom
+                    self.last_bin = start // index_bin_size
+                
+                if length > self.max_length.get(chrom, 0):
+                    self.max_length[chrom] = length
+            
+            self.writer.write(line)
+    
+    def tell(self):
+        """Address of the next line to be written; see BlockWriter.tell()"""
+        return self.writer.tell()
+    
+    def resolve(self, address):
+        return self.writer.resolve(address)
+    
+    def flush(self):
+        self.writer.flush()
+    
+    def close(self):
+        self.writer.close()
+        index_file = open(index_name(self.filename), 'w')
+        for chrom, length in self.max_length.items():
+            index_file.write('#M {} {}\n'.format(chrom, length))
+        
+        for chrom, position, address in self.entries:
+            index_file.write('{}\t{}\t{}\n'.format(chrom, position, self.writer.resolve(address)))
+        
+        index_file.close()
@@ -58,11 +58,12 @@ cdef class Locus:
     cdef public float weight, bases, raw_bases, minimum_proportion, cap_bonus, cap_filter, intron_filter, antisense_filter, dead_end_penalty, min_start, min_end
     cdef public dict J_plus, J_minus, end_ranges, source_lookup, adj, exc, assembly_source_cov
     cdef public set branchpoints, SPbp, EPbp, SMbp, EMbp, DPbp, DMbp, APbp, AMbp
-    cdef public list transcripts, traceback, sources, subproblem_indices, splits, gaps_plus, gaps_minus
+    cdef public list transcripts, traceback, sources, subproblem_indices, splits, gaps_plus, gaps_minus, end_signal, coverage
     cdef public object graph
     cdef EndRange nullRange
     cdef Locus sublocus
-    cdef public np.ndarray depth_matrix, strandratio, cov_plus, cov_minus, depth, read_lengths, discard_frags, member_lengths, frag_len, frag_by_pos, strand_array, weight_array, rep_array, membership, overlap, information_content, member_content, frag_strand_ratios, member_weights
+    cdef public object strandratio, cov_plus, cov_minus, depth
+    cdef public np.ndarray read_lengths, discard_frags, member_lengths, frag_len, frag_by_pos, strand_array, weight_array, rep_array, membership, overlap, information_content, member_content, frag_strand_ratios, member_weights
     def __init__(self, chrom, chunk_number, list_of_reads, max_gap=50, end_cluster=200, min_overhang=3, reduce=True, minimum_proportion=0.01, min_intron_length=50, antisense_filter=0.01, cap_bonus=5, cap_filter=.02, complete=False, verbose=False, naive=False, intron_filter=0.10, use_attributes=True, oligo_len=20, ignore_ends=False, allow_incomplete=False, require_cap=False, splittable=True, simplify=True, min_start=0, min_end=0):
         self.nullRange = EndRange(-1, -1, -1, -1, -1)
         self.oligo_len = oligo_len
@@ -115,25 +116,32 @@ cdef class Locus:
             self.source_lookup = ru.get_source_dict(self.sources)
             self.extend = max_gap
             self.end_extend = end_cluster
-            self.depth_matrix, self.J_plus, self.J_minus = ru.build_depth_matrix(self.leftmost, self.rightmost, self.reads, self.use_attributes)
-            Sp, Ep, Sm, Em, Cp, Cm, covp, covm, covn = range(9)
-            self.gaps_plus = ru.get_gaps(np.sum(self.depth_matrix[[covp,covn],:],0), self.extend)
-            self.gaps_minus = ru.get_gaps(np.sum(self.depth_matrix[[covm,covn],:],0), self.extend)
-            covstranded = np.sum(self.depth_matrix[(covp,covm),:],axis=0)
-            strandedpositions = np.where(covstranded > 0)[0]
-            if strandedpositions.shape[0] > 0: # Some reads to inform the strand
-                strandratio = np.array(np.interp(range(covstranded.shape[0]), strandedpositions, self.depth_matrix[covp,strandedpositions]/covstranded[strandedpositions]),dtype=np.float32)
-                strandratio[strandratio < self.antisense_filter] = 0
-                strandratio[strandratio > 1-self.antisense_filter] = 1
-                self.strandratio = strandratio
-                self.cov_plus = self.depth_matrix[covp,:] + self.depth_matrix[covn,:]*self.strandratio
-                self.cov_minus = self.depth_matrix[covm,:] + self.depth_matrix[covn,:]*(1-self.strandratio)
-                self.depth = self.cov_plus + self.cov_minus
+            self.coverage, self.end_signal, self.J_plus, self.J_minus = ru.build_depth_matrix(self.leftmost, self.rightmost, self.reads, self.use_attributes)
+            covp, covm, covn = range(3)
+            self.gaps_plus = self.coverage[covp].add(self.coverage[covn]).gaps(self.extend)
+            self.gaps_minus = self.coverage[covm].add(self.coverage[covn]).gaps(self.extend)
+            covstranded = self.coverage[covp].add(self.coverage[covm])
+            stranded_runs = covstranded.values > 0
+            if np.any(stranded_runs): # Some reads to inform the strand
+                ratio = np.zeros(stranded_runs.shape[0], dtype=np.float32)
+                ratio[stranded_runs] = self.coverage[covp].values[stranded_runs]/covstranded.values[stranded_runs]
+                # Unknown runs only need per-base ratios where unstranded reads or read ends are
+                end_runs = np.zeros(stranded_runs.shape[0], dtype=bool)
+                end_runs[np.searchsorted(covstranded.starts, np.concatenate([signal[0] for signal in self.end_signal]), side='right')-1] = True
+                self.strandratio = ru.RunLengthCoverage(covstranded.starts, ratio, covstranded.length).interp(stranded_runs, np.logical_or(self.coverage[covn].values > 0, end_runs))
+                self.strandratio.values[self.strandratio.values < self.antisense_filter] = 0
+                self.strandratio.values[self.strandratio.values > 1-self.antisense_filter] = 1
+                starts = self.strandratio.starts
+                cov_plus = self.coverage[covp].at(starts) + self.coverage[covn].at(starts)*self.strandratio.values
+                cov_minus = self.coverage[covm].at(starts) + self.coverage[covn].at(starts)*(1-self.strandratio.values)
+                self.cov_plus = ru.RunLengthCoverage(starts, cov_plus, len(self)).merge()
+                self.cov_minus = ru.RunLengthCoverage(starts, cov_minus, len(self)).merge()
+                self.depth = ru.RunLengthCoverage(starts, cov_plus + cov_minus, len(self)).merge()
             else:
-                self.strandratio = np.full(self.depth_matrix.shape[1], .5)
-                self.cov_plus = self.depth_matrix[covn,:]*self.strandratio
-                self.cov_minus = self.depth_matrix[covn,:]*self.strandratio
-                self.depth = self.depth_matrix[covn,:]
+                self.strandratio = ru.RunLengthCoverage([0], [.5], len(self))
+                self.cov_plus = self.coverage[covn].scale(.5)
+                self.cov_minus = self.coverage[covn].scale(.5)
+                self.depth = self.coverage[covn]
             
             self.prune_junctions(self.min_intron_length)
             # Split locus into coherent subchunks
@@ -181,21 +189,20 @@ cdef class Locus:
         """Check whether, given the filtered splice junctions, the list_of_reads can be separated
         into a list of smaller coherent read sets with no overlap.
         Returns the list of read indices that begin new coherent subchunks."""
-        cdef np.ndarray split_bool, difs, run_starts, run_ends
-        cdef str k, kl, kr
-        cdef int rs, rl
-        split_bool = self.depth == 0
-        for k in self.J_plus.keys():
-            kl,kr = k.split(':')
-            split_bool[int(kl)-1:int(kr)+1] = False
-
-        for k in self.J_minus.keys():
-            kl,kr = k.split(':')
-            split_bool[int(kl)-1:int(kr)+1] = False
-        
-        difs = np.diff(np.hstack(([0], split_bool, [0])))
-        run_starts = np.where(difs > 0)[0]
-        run_ends = np.where(difs < 0)[0]
+        cdef np.ndarray run_starts, run_ends
+        cdef list lefts, rights
+        cdef long long k
+        cdef int rs, rl, kl, kr
+        lefts, rights = [], []
+        for k in list(self.J_plus.keys()) + list(self.J_minus.keys()):
+            kl,kr = self.key_to_span(k)
+            lefts.append(kl-1)
+            rights.append(min(kr+1, len(self)))
+        
+        # Positions with no coverage and no junction spanning them can be split
+        split_runs = self.coverage[0].add(self.coverage[1]).add(self.coverage[2])
+        split_runs = split_runs.add(ru.accumulate_runs([0]*len(lefts), lefts, rights, [1]*len(lefts), 1, len(self))[0])
+        run_starts, run_ends = split_runs.stretches(split_runs.values == 0)
         return [rs+self.leftmost for rs,rl in zip(run_starts, run_ends-run_starts) if rl > self.extend]
     
     cpdef void prune_junctions(self, int min_intron_length=50):
@@ -203,34 +210,34 @@ cdef class Locus:
         that either share its donor or its acceptor site, remove it."""
         cdef dict jdict, leftsides, rightsides
         cdef list keys, spans
-        cdef str k
+        cdef long long k
         cdef int i,l,r, Sp, Ep, Sm, Em, covp, covm, covn
         cdef set prune
         cdef np.ndarray counts
         cdef float total, jcov, spanning_cov
         cdef bint passes
-        cdef np.ndarray jspans
+        cdef list jlefts, jrights, jweights
         Sp, Ep, Sm, Em, Cp, Cm, covp, covm, covn = range(9)
-        jspans = np.zeros(self.depth.shape[0], dtype=np.float32)
-        for k in self.J_plus.keys():
-            l,r = self.string_to_span(k)
-            jspans[l:r+1] += self.J_plus[k]
-        
-        for k in self.J_minus.keys():
-            l,r = self.string_to_span(k)
-            jspans[l:r+1] += self.J_minus[k]
+        jlefts, jrights, jweights = [], [], []
+        for jdict in [self.J_plus, self.J_minus]:
+            for k in jdict.keys():
+                l,r = self.key_to_span(k)
+                jlefts.append(l)
+                jrights.append(r+1)
+                jweights.append(jdict[k])
         
+        jspans = ru.accumulate_runs([0]*len(jlefts), jlefts, jrights, jweights, 1, len(self))[0]
 
         for jdict in [self.J_plus, self.J_minus]:
             if jdict:
                 prune = set()
                 keys = sorted(list(jdict.keys()))
-                spans = [self.string_to_span(k) for k in keys]
+                spans = [self.key_to_span(k) for k in keys]
                 leftsides = {}
                 rightsides = {}
                 for i in range(len(keys)):
                     l,r = spans[i]
-                    spanning_cov = np.max(jspans[l:r+1])
+                    spanning_cov = np.max(jspans.slice(l, r+1).values)
                     jcov = jdict[keys[i]]
                     if jcov < spanning_cov * self.minimum_proportion or r-l < min_intron_length:
                         prune.add(keys[i])
@@ -257,7 +264,7 @@ cdef class Locus:
         """Estimate strand-specific coverage, then use it to generate an ordered array of
         positions where branching could occur in the overlap graph."""
         cdef:
-            np.ndarray strandratio, covstranded, strandedpositions, pos, vals, rawvals, value_order
+            np.ndarray strandratio, covstranded, strandedpositions, pos, vals, rawvals, value_order, passes
             float threshold_depth, cumulative_depth, cutoff
             int l, r, p, Sp, Ep, Sm, Em, covp, covm, covn
             (int, int) span
@@ -272,7 +279,7 @@ cdef class Locus:
         prohibited_plus = set([l+1 for l,r in self.gaps_plus]+[r-1 for l,r in self.gaps_plus])
         prohibited_minus = set([l+1 for l,r in self.gaps_minus]+[r-1 for l,r in self.gaps_minus])
         for j in self.J_plus.keys():
-            span = self.string_to_span(j)
+            span = self.key_to_span(j)
             self.DPbp.add(span[0])
             self.APbp.add(span[1])
             self.branchpoints.update(list(span))
@@ -281,7 +288,7 @@ cdef class Locus:
                 prohibited_plus.update(range(span[1]-self.min_overhang, span[1]+self.min_overhang+1))
         
         for j in self.J_minus.keys():
-            span = self.string_to_span(j)
+            span = self.key_to_span(j)
             self.DMbp.add(span[1])
             self.AMbp.add(span[0])
             self.branchpoints.update(list(span))
@@ -291,24 +298,26 @@ cdef class Locus:
         
         for endtype in [Ep, Em, Sp, Sm]:
             if endtype == Sp:
-                pos = np.where(np.sum(self.depth_matrix[[Sp,Cp],],axis=0)>0)[0]
-                rawvals = self.depth_matrix[Sp, pos] + self.cap_bonus*self.depth_matrix[Cp, pos]
-                vals = np.power(rawvals, 2)/self.cov_plus[pos]*(self.strandratio[pos]!=0).astype(float)
+                pos, rawvals = ru.sum_signals([self.end_signal[Sp], self.end_signal[Cp]], [1, self.cap_bonus])
+                passes = ru.sum_signals([self.end_signal[Sp], self.end_signal[Cp]])[1] > 0
+                pos, rawvals = pos[passes], rawvals[passes]
+                vals = np.power(rawvals, 2)/self.cov_plus.at(pos)*(self.strandratio.at(pos)!=0).astype(float)
                 prohibited_positions = prohibited_plus
             elif endtype == Sm:
-                pos = np.where(np.sum(self.depth_matrix[[Sm,Cm],],axis=0)>0)[0]
-                rawvals = self.depth_matrix[Sm, pos] + self.cap_bonus*self.depth_matrix[Cm, pos]
-                vals = np.power(rawvals, 2)/self.cov_minus[pos]*(self.strandratio[pos]!=1).astype(float)
+                pos, rawvals = ru.sum_signals([self.end_signal[Sm], self.end_signal[Cm]], [1, self.cap_bonus])
+                passes = ru.sum_signals([self.end_signal[Sm], self.end_signal[Cm]])[1] > 0
+                pos, rawvals = pos[passes], rawvals[passes]
+                vals = np.power(rawvals, 2)/self.cov_minus.at(pos)*(self.strandratio.at(pos)!=1).astype(float)
                 prohibited_positions = prohibited_minus
             elif endtype == Ep:
-                pos = np.where(self.depth_matrix[endtype,]>0)[0]
-                rawvals = self.depth_matrix[endtype, pos]
-                vals = np.power(rawvals, 2)/self.cov_plus[pos]*(self.strandratio[pos]!=0).astype(float)
+                pos, rawvals = self.end_signal[endtype]
+                pos, rawvals = pos[rawvals > 0], rawvals[rawvals > 0]
+                vals = np.power(rawvals, 2)/self.cov_plus.at(pos)*(self.strandratio.at(pos)!=0).astype(float)
                 prohibited_positions = prohibited_plus
             elif endtype == Em:
-                pos = np.where(self.depth_matrix[endtype,]>0)[0]
-                rawvals = self.depth_matrix[endtype, pos]
-                vals = np.power(rawvals, 2)/self.cov_minus[pos]*(self.strandratio[pos]!=1).astype(float)
+                pos, rawvals = self.end_signal[endtype]
+                pos, rawvals = pos[rawvals > 0], rawvals[rawvals > 0]
+                vals = np.power(rawvals, 2)/self.cov_minus.at(pos)*(self.strandratio.at(pos)!=1).astype(float)
                 prohibited_positions = prohibited_minus
             
             self.end_ranges[endtype] = self.make_end_ranges(pos, vals, rawvals, endtype, prohibited_positions)
@@ -428,7 +437,7 @@ cdef class Locus:
     cpdef void enforce_cap_filter(self, int endtype):
         cdef int caps
         cdef float startcounts, capcounts
-        cdef np.ndarray allstarts, allcaps
+        cdef tuple allstarts
         cdef EndRange rng
         if endtype == 0:
             caps = 4
@@ -437,10 +446,10 @@ cdef class Locus:
         else:
             return
         
-        allstarts = self.depth_matrix[endtype,:]+self.depth_matrix[caps,:]
+        allstarts = ru.sum_signals([self.end_signal[endtype], self.end_signal[caps]])
         for rng in self.end_ranges[endtype]:
-            startcounts = np.sum(allstarts[rng.left:rng.right])
-            capcounts = np.sum(self.depth_matrix[caps, rng.left:rng.right])
+            startcounts = ru.signal_in_range(allstarts, rng.left, rng.right)
+            capcounts = ru.signal_in_range(self.end_signal[caps], rng.left, rng.right)
             rng.capped = capcounts
             rng.weight = startcounts
         
@@ -559,13 +568,13 @@ cdef class Locus:
             if closest_bp == 0:
                 return True
             
-            cov_through = np.mean(self.cov_plus[closest_bp:rng.right])
-            cov_in = self.cov_plus[rng.right]
+            cov_through = self.cov_plus.mean(closest_bp, rng.right)
+            cov_in = self.cov_plus.at(rng.right)
             if cov_through < cov_in*self.intron_filter:
                 return True
             
-            noncaps = np.sum(self.depth_matrix[Sp, rng.left:rng.right])
-            caps = np.sum(self.depth_matrix[Cp, rng.left:rng.right])
+            noncaps = ru.signal_in_range(self.end_signal[Sp], rng.left, rng.right)
+            caps = ru.signal_in_range(self.end_signal[Cp], rng.left, rng.right)
             if caps >= self.cap_filter * (caps + noncaps):
                 return True
             
@@ -574,20 +583,20 @@ cdef class Locus:
             if sum(rng.positions.values())/self.cap_bonus < self.min_start:
                 return False
             
-            if rng.right >= self.cov_minus.shape[0]:
+            if rng.right >= len(self):
                 return True
             
-            closest_bp = min([self.cov_minus.shape[0]]+[bp for bp in self.branchpoints if bp > rng.left+1])
-            if closest_bp == self.cov_minus.shape[0]:
+            closest_bp = min([len(self)]+[bp for bp in self.branchpoints if bp > rng.left+1])
+            if closest_bp == len(self):
                 return True
             
-            cov_through = np.mean(self.cov_minus[rng.left+1:closest_bp])
-            cov_in = self.cov_minus[rng.left]
+            cov_through = self.cov_minus.mean(rng.left+1, closest_bp)
+            cov_in = self.cov_minus.at(rng.left)
             if cov_through < cov_in*self.intron_filter:
                 return True
             
-            noncaps = np.sum(self.depth_matrix[Sm, rng.left:rng.right])
-            caps = np.sum(self.depth_matrix[Cm, rng.left:rng.right])
+            noncaps = ru.signal_in_range(self.end_signal[Sm], rng.left, rng.right)
+            caps = ru.signal_in_range(self.end_signal[Cm], rng.left, rng.right)
             if caps >= self.cap_filter * (caps + noncaps):
                 return True
             
@@ -711,14 +720,13 @@ cdef class Locus:
         # bestrng.add(pos, weight, capped)
         return bestrng
     
-    cpdef str span_to_string(self, (int, int) span):
-        """Converts a tuple of two ints to a string connected by ':'"""
-        return '{}:{}'.format(span[0], span[1])
+    cpdef long long span_to_key(self, (int, int) span):
+        """Packs a tuple of two ints into the int64 key used by J_plus and J_minus"""
+        return (<long long>span[0] << 32) | span[1]
     
-    cpdef (int, int) string_to_span(self, str string):
-        """Converts a string from span_to_string() back into a span"""
-        cdef list splitstring = string.split(':')
-        return (int(splitstring[0]), int(splitstring[1]))
+    cpdef (int, int) key_to_span(self, long long key):
+        """Converts a key from span_to_key() back into a span"""
+        return (<int>(key >> 32), <int>(key & 0xFFFFFFFF))
     
     cpdef bint build_membership_matrix(self, float threshold=1):
         """After branchpoints are identified, populate a table that stores information about
@@ -756,8 +764,8 @@ cdef class Locus:
         self.frag_strand_ratios[-2:] = 0.
         for i in range(len(self.frags)):
             span = self.frags[i]
-            fragcov_plus = np.sum(self.cov_plus[span[0]:span[1]])
-            fragcov_minus = np.sum(self.cov_minus[span[0]:span[1]])
+            fragcov_plus = self.cov_plus.total(span[0], span[1])
+            fragcov_minus = self.cov_minus.total(span[0], span[1])
             if fragcov_plus + fragcov_minus > 0:
                 self.frag_strand_ratios[i] = fragcov_plus/(fragcov_plus+fragcov_minus)
             else:
@@ -847,7 +855,8 @@ cdef class Locus:
         cdef char s, jstrand
         cdef bint junctions_are_linear
         cdef list spans, splice_sites, sorted_splice_sites, intervening_junctions, skipped_frags
-        cdef str junction_hash, junction, membership_hash
+        cdef str membership_hash
+        cdef long long junction_key, junction
         membership = np.zeros(width, dtype=np.int8)
         source_plus, sink_plus, source_minus, sink_minus = range(width-4, width)
         last_rfrag = 0
@@ -925,11 +934,11 @@ cdef class Locus:
                     # Check that this junction is in the list of splice junctions
                     # If it was filtered out, this read is invalid and should be removed.
                     span = (self.frags[last_rfrag][1], self.frags[lfrag][0])
-                    junction_hash = self.span_to_string(span)
-                    if strand == 1 and junction_hash not in self.J_plus:
+                    junction_key = self.span_to_key(span)
+                    if strand == 1 and junction_key not in self.J_plus:
                         membership[:] = -1 # Read contains a filtered junction, remove
                         break
-                    elif strand == -1 and junction_hash not in self.J_minus:
+                    elif strand == -1 and junction_key not in self.J_minus:
                         membership[:] = -1 # Read contains a filtered junction, remove
                         break
                     else:
@@ -939,7 +948,7 @@ cdef class Locus:
                     if len(intervening_junctions) == 0: # Fill in the intervening gap if no junctions exist in the range
                         membership[(last_rfrag+1):lfrag] = 1
                     else: # Fill in as much information as possible based on filtered junctions and membership
-                        spans = sorted([self.string_to_span(junction) for junction in intervening_junctions])
+                        spans = sorted([self.key_to_span(junction) for junction in intervening_junctions])
                         splice_sites = [site for span in spans for site in span] # 'unlist' the splice sites in the order they appear
                         membership[(last_rfrag+1):self.frag_by_pos[min(splice_sites)]] = 1 # Fill in up to the first junction boundary
                         membership[self.frag_by_pos[max(splice_sites)]:rfrag] = 1 # Fill in after the last junction boundary
@@ -996,10 +1005,10 @@ cdef class Locus:
         return membership
     
     cpdef list junctions_between(self, int lpos, int rpos, char strand):
-        """Returns a list of junction hashes that fall between the two specified positions
+        """Returns a list of junction keys that fall between the two specified positions
         on the specified strand (either strand if strand==0)."""
         cdef list candidates, junctions_in_range
-        cdef str junction_hash
+        cdef long long junction_key
         cdef (int, int) span
         if strand == 1:
             candidates = list(self.J_plus.keys())
@@ -1009,10 +1018,10 @@ cdef class Locus:
             candidates = list(self.J_plus.keys()) + list(self.J_minus.keys())
         
         junctions_in_range = list()
-        for junction_hash in candidates:
-            span = self.string_to_span(junction_hash)
+        for junction_key in candidates:
+            span = self.key_to_span(junction_key)
             if span[0] >= lpos and span[1] <= rpos:
-                junctions_in_range.append(junction_hash)
+                junctions_in_range.append(junction_key)
         
         return junctions_in_range
     
@@ -1046,21 +1055,21 @@ cdef class Locus:
         i.e. a retained intron, run-on transcription downstream of a 3' end, or
         transcriptional noise upstream of a 5' end. The argument 'intron_filter' is used here."""
         cdef EndRange endrange
-        cdef np.ndarray remove_plus, remove_minus, overlappers, flowthrough, terminal, sb, fills_intron, cov, junction_membership, discard_frags
+        cdef np.ndarray remove_plus, remove_minus, overlappers, flowthrough, terminal, sb, fills_intron, junction_membership, discard_frags
         cdef list stranded_branches, nonterminal_frags
         cdef int strand, number_of_frags, frag, l, r, maxgap
-        cdef str junction
+        cdef long long junction
         cdef (int, int) span
         # Check flowthrough across all starts/ends
         # Use self.frag_strand_ratios to assign non-stranded reads to strand-specific flowthroughs
         number_of_frags = len(self.frags)
         discard_frags = np.zeros((2,number_of_frags), dtype=bool)
         maxgap = self.extend
-        nonterminal_frags = [frag for frag,span in enumerate(self.frags) if span[0] not in set([0])|self.SPbp|self.EMbp and span[1] not in set([self.depth.shape[0]])|self.SMbp|self.EPbp]
+        nonterminal_frags = [frag for frag,span in enumerate(self.frags) if span[0] not in set([0])|self.SPbp|self.EMbp and span[1] not in set([len(self)])|self.SMbp|self.EPbp]
         # for frag,span in nonterminal_frags:
         for frag,span in enumerate(self.frags):
             if frag in nonterminal_frags:
-                if not passes_threshold(self.depth[span[0]:span[1]], maxgap, threshold):
+                if not passes_threshold(self.depth.slice(span[0], span[1]), maxgap, threshold):
                     discard_frags[:,frag] = True
         
         for endtype in range(4):
@@ -1073,22 +1082,21 @@ cdef class Locus:
                 frag = self.frag_by_pos[endrange.terminal - (endtype in [1,2])]
                 if endtype == 0 and frag > 0: # S+, check plus-stranded left flowthrough
                     strand, overrun_frag = 1, frag-1
-                    terminal_weight = cov[endrange.right-1]
+                    terminal_weight = cov.at(endrange.right-1)
                 elif endtype == 1 and frag < number_of_frags-1: # E+, check plus-stranded right flowthrough
                     strand, overrun_frag = 1, frag+1
-                    terminal_weight = cov[endrange.left]
+                    terminal_weight = cov.at(endrange.left)
                 elif endtype == 2 and frag < number_of_frags-1: # S-, check minus-stranded right flowthrough
                     strand, overrun_frag = -1, frag+1
-                    terminal_weight = cov[endrange.left]
+                    terminal_weight = cov.at(endrange.left)
                 elif endtype == 3 and frag > 0: # E-, check minus-stranded left flowthrough
                     strand, overrun_frag = -1, frag-1
-                    terminal_weight = cov[endrange.right-1]
+                    terminal_weight = cov.at(endrange.right-1)
                 else:
                     continue
                 
-                overrun_cov = cov[self.frags[overrun_frag][0]:self.frags[overrun_frag][1]]
-                flowthrough_weight = np.mean(overrun_cov)
-                if np.any(self.depth[self.frags[overrun_frag][0]:self.frags[overrun_frag][1]] < threshold) or flowthrough_weight < self.intron_filter * terminal_weight:
+                flowthrough_weight = cov.mean(self.frags[overrun_frag][0], self.frags[overrun_frag][1])
+                if np.any(self.depth.slice(self.frags[overrun_frag][0], self.frags[overrun_frag][1]).values < threshold) or flowthrough_weight < self.intron_filter * terminal_weight:
                     if strand == 1:
                         discard_frags[0,overrun_frag] = True
                     else:
@@ -1098,7 +1106,7 @@ cdef class Locus:
         strand = 1
         stranded_branches = list()
         for k in self.J_plus.keys():
-            l,r = self.string_to_span(k)
+            l,r = self.key_to_span(k)
             stranded_branches += [l,r]
         
         for i in [0,1]:
@@ -1107,20 +1115,20 @@ cdef class Locus:
         
         sb = np.unique(sorted(stranded_branches))
         for junction in self.J_plus.keys():
-            l,r = self.string_to_span(junction)
+            l,r = self.key_to_span(junction)
             if not np.any(np.logical_and(sb>l, sb<r)): # Intron has no intervening stranded branchpoints
                 lfrag = self.frag_by_pos[l]
                 rfrag = self.frag_by_pos[r]
-                cov_in_junction = self.depth[self.frags[lfrag][0]:self.frags[rfrag][0]]
-                spanning_cov = np.max(np.append(self.depth[self.frags[lfrag][0]], self.depth[self.frags[rfrag][0]]))
-                if np.any(cov_in_junction < threshold) or np.mean(cov_in_junction) < spanning_cov*self.intron_filter:
+                cov_in_junction = self.depth.slice(self.frags[lfrag][0], self.frags[rfrag][0])
+                spanning_cov = max(self.depth.at(self.frags[lfrag][0]), self.depth.at(self.frags[rfrag][0]))
+                if np.any(cov_in_junction.values < threshold) or self.depth.mean(self.frags[lfrag][0], self.frags[rfrag][0]) < spanning_cov*self.intron_filter:
                     discard_frags[0, lfrag:rfrag] = True
         
         # Repeat the procedure for the minus strand
         strand = -1
         stranded_branches = list()
         for k in self.J_minus.keys():
-            l,r = self.string_to_span(k)
+            l,r = self.key_to_span(k)
             stranded_branches += [l,r]
         
         for i in [2,3]:
@@ -1129,13 +1137,13 @@ cdef class Locus:
         
         sb = np.unique(sorted(stranded_branches))
         for junction in self.J_minus.keys():
-            l,r = self.string_to_span(junction)
+            l,r = self.key_to_span(junction)
             if not np.any(np.logical_and(sb>l, sb<r)): # Intron has no intervening stranded branchpoints
                 lfrag = self.frag_by_pos[l]
                 rfrag = self.frag_by_pos[r]
-                cov_in_junction = self.depth[self.frags[lfrag][0]:self.frags[rfrag][0]]
-                spanning_cov = np.max(np.append(self.depth[self.frags[lfrag][0]], self.depth[self.frags[rfrag][0]]))
-                if np.any(cov_in_junction < threshold) or np.mean(cov_in_junction) < spanning_cov*self.intron_filter:
+                cov_in_junction = self.depth.slice(self.frags[lfrag][0], self.frags[rfrag][0])
+                spanning_cov = max(self.depth.at(self.frags[lfrag][0]), self.depth.at(self.frags[rfrag][0]))
+                if np.any(cov_in_junction.values < threshold) or self.depth.mean(self.frags[lfrag][0], self.frags[rfrag][0]) < spanning_cov*self.intron_filter:
                     discard_frags[1, lfrag:rfrag] = True
         
         return discard_frags        
@@ -1357,10 +1365,12 @@ cdef class Locus:
     
     cpdef void trim_transcript_ends(self, transcript):
         """(for endless transcripts only) Cuts 5' and 3' down
-        to the position with the largest relative delta."""
-        cdef np.ndarray d, dd, posdelta, negdelta, dist_from_end
+        to the position with the largest relative delta.
+        Depth only changes between runs, so only run boundaries are candidates."""
+        cdef np.ndarray dd, before, after, deltas, dist_from_end
         cdef bint update_left, update_right
         cdef int l, r, maxdelta
+        cdef float mean_depth
         update_left, update_right = False, False
         if transcript.strand == 0:
             update_left = True
@@ -1375,23 +1385,29 @@ cdef class Locus:
         if update_left:
             l = transcript.ranges[0][0] - self.leftmost
             r = transcript.ranges[0][1] - self.leftmost
-            d = self.depth[l:r]
-            dd = np.diff(d)
-            posdeltas = np.where(np.logical_and(dd > 0,d[1:]<np.mean(d)))[0]
-            if len(posdeltas) > 0:
+            d = self.depth.slice(l, r)
+            mean_depth = d.mean(0, r-l)
+            before, after = d.values[:-1], d.values[1:]
+            dd = after - before
+            deltas = np.where(np.logical_and(dd > 0, after < mean_depth))[0]
+            if len(deltas) > 0:
+                posdeltas = d.starts[1:][deltas] - 1
                 dist_from_end = 1 - posdeltas / (r-l)
-                maxdelta = posdeltas[np.argsort(dist_from_end * -np.power(dd[posdeltas],2)/d[posdeltas])[0]]
+                maxdelta = posdeltas[np.argsort(dist_from_end * -np.power(dd[deltas],2)/before[deltas])[0]]
                 transcript.ranges[0] = (transcript.ranges[0][0]+maxdelta, transcript.ranges[0][1])
         
         if update_right:
             l = transcript.ranges[-1][0] - self.leftmost
             r = transcript.ranges[-1][1] - self.leftmost
-            d = self.depth[l:r]
-            dd = np.diff(d)
-            negdeltas = np.where(np.logical_and(dd < 0, d[:-1] < np.mean(d)))[0]
-            if len(negdeltas) > 0:
+            d = self.depth.slice(l, r)
+            mean_depth = d.mean(0, r-l)
+            before, after = d.values[:-1], d.values[1:]
+            dd = after - before
+            deltas = np.where(np.logical_and(dd < 0, before < mean_depth))[0]
+            if len(deltas) > 0:
+                negdeltas = d.starts[1:][deltas] - 1
                 dist_from_end = negdeltas / (r-l)
-                maxdelta = negdeltas[np.argsort(dist_from_end * -np.power(dd[negdeltas],2)/d[negdeltas-1])[0]]
+                maxdelta = negdeltas[np.argsort(dist_from_end * -np.power(dd[deltas],2)/d.at((negdeltas-1) % (r-l)))[0]]
                 transcript.ranges[-1] = (transcript.ranges[-1][0], transcript.ranges[-1][0]+maxdelta)
         
         return
@@ -1554,7 +1570,8 @@ cdef class Locus:
         cdef list ranges, splice, members, output
         cdef (int, int) frag, exon
         cdef set nonmembers
-        cdef str gene_id, transcript_id, junction_hash, weight_string
+        cdef str gene_id, transcript_id, weight_string
+        cdef long long junction_key
         cdef dict junctions
         cdef EndRange S, E
         output = []
@@ -1594,8 +1611,8 @@ cdef class Locus:
             elif last_member == m-1:
                 r = frag[1]
             else: # A gap was jumped
-                junction_hash = self.span_to_string((r, frag[0]))
-                if junction_hash in junctions:
+                junction_key = self.span_to_key((r, frag[0]))
+                if junction_key in junctions:
                     gap_is_splice = True
                 else:
                     gap_is_splice = False
@@ -1824,25 +1841,16 @@ cpdef np.ndarray calculate_overlap_matrix(np.ndarray[char, ndim=2] membership_ma
     
     return overlap_matrix
 
-cpdef bint passes_threshold(np.ndarray array, int max_gap, float threshold=1):
-    """Returns boolean of whether a contiguous region of values
-    less than threshold and longer than max_gap exists in array."""
-    cdef Py_ssize_t i
-    cdef int run = 0
-    cdef float a
-    cdef bint passed = False
-    for i in range(array.shape[0]):
-        a = array[i]
-        if a < threshold:
-            run += 1
-            if run > max_gap:
-                return False
-        else:
-            run = 0
-            if passed is False:
-                passed = True
+cpdef bint passes_threshold(runs, int max_gap, float threshold=1):
+    """Returns boolean of whether a RunLengthCoverage reaches threshold
+    somewhere and has no contiguous region of values less than
+    threshold that is longer than max_gap."""
+    cdef np.ndarray lefts, rights
+    lefts, rights = runs.stretches(runs.values < threshold)
+    if np.any(rights - lefts > max_gap):
+        return False
     
-    return passed
+    return np.any(runs.values >= threshold)
 
 cpdef np.ndarray remove_ends(np.ndarray[char, ndim=2] membership_matrix):
     """Given a full membership matrix, return a reduced version in which
@@ -1,5 +1,10 @@
 #cython: language_level=3
 import re
+import os
+import mmap
+import json
+import gzip
+import numpy as np
 from cpython cimport array
 import array
 
@@ -1042,9 +1047,458 @@ cpdef import_genome(str genome_FASTA, str split_on=' ', bint keep_case=True, bin
     return genome, index
 
 
-def generate_softbridges(dict genome_dict, int minlen, int maxlen):
+cpdef index_fasta(str genome_FASTA, str split_on=' '):
+    """Indexes a FASTA file without loading its sequence. Returns the index
+    as the text of a samtools .fai file (name, length, offset, bases per
+    line, bytes per line) and saves it to genome_FASTA.fai if possible.
+    Returns None if line lengths vary within a chromosome."""
+    cdef:
+        bytes rawline
+        str chromname, index
+        long offset, start_position, length, line_bases, line_width, bases
+        bint last_line
+        list index_lines = []
+    
+    chromname = ''
+    offset = start_position = length = line_bases = line_width = 0
+    last_line = False
+    genome_file = open(genome_FASTA, 'rb')
+    for rawline in genome_file:
+        if rawline[:1] == b'>':
+            if chromname:
+                index_lines.append('{}\t{}\t{}\t{}\t{}\n'.format(chromname, length, start_position, line_bases, line_width))
+            
+            chromname = rawline[1:].decode().rstrip().split(split_on)[0]
+            start_position = offset + len(rawline)
+            length = line_bases = line_width = 0
+            last_line = False
+        else:
+            bases = len(rawline.rstrip())
+            if bases > 0:
+                if last_line: # Only the last line of a chromosome may be shorter
+                    genome_file.close()
+                    return None
+                
+                if line_bases == 0:
+                    line_bases = bases
+                    line_width = len(rawline)
+                elif bases > line_bases:
+                    genome_file.close()
+                    return None
+                
+                if bases < line_bases or len(rawline) != line_width:
+                    last_line = True
+                
+                length += bases
+            else:
+                last_line = True
+        
+        offset += len(rawline)
+    
+    genome_file.close()
+    if chromname:
+        index_lines.append('{}\t{}\t{}\t{}\t{}\n'.format(chromname, length, start_position, line_bases, line_width))
+    
+    index = ''.join(index_lines)
+    try:
+        index_file = open(genome_FASTA+'.fai', 'w')
+        index_file.write(index)
+        index_file.close()
+    except OSError: # The index can't be saved beside the FASTA; keep it in memory
+        pass
+    
+    return index
+
+
+cdef class ChromSequence:
+    """One chromosome of an IndexedGenome. Slicing it like a str
+    returns that part of the sequence, read from the mapped file."""
+    cdef readonly object data
+    cdef readonly long offset, length, line_bases, line_width
+    def __init__(self, data, long offset, long length, long line_bases, long line_width):
+        self.data = data
+        self.offset = offset
+        self.length = length
+        self.line_bases = line_bases
+        self.line_width = line_width
+    
+    def __len__(self):
+        return self.length
+    
+    cdef long file_position(self, long position):
+        return self.offset + (position // self.line_bases) * self.line_width + position % self.line_bases
+    
+    def __getitem__(self, key):
+        cdef long start, stop, step
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+        else:
+            start = key + self.length if key < 0 else key
+            if start < 0 or start >= self.length:
+                raise IndexError('sequence index out of range')
+            
+            stop, step = start + 1, 1
+        
+        if stop <= start:
+            return ''
+        
+        sequence = self.data[self.file_position(start):self.file_position(stop)].replace(b'\n', b'').replace(b'\r', b'').decode()
+        if step != 1:
+            return sequence[::step]
+        
+        return sequence
+    
+    def __str__(self):
+        return self[:]
+
+
+cdef class MappedGenome:
+    """Read-only genome with the interface of the dict made by
+    import_genome(): genome[chrom][l:r] returns a str. Subclasses
+    fill chroms with sequence objects that read from a mapped file."""
+    cdef readonly dict chroms
+    
+    def __getitem__(self, chrom):
+        return self.chroms[chrom]
+    
+    def __contains__(self, chrom):
+        return chrom in self.chroms
+    
+    def __len__(self):
+        return len(self.chroms)
+    
+    def __iter__(self):
+        return iter(self.chroms)
+    
+    def keys(self):
+        return self.chroms.keys()
+    
+    def get(self, chrom, default=None):
+        return self.chroms.get(chrom, default)
+
+
+cdef class IndexedGenome(MappedGenome):
+    """Genome read from a memory-mapped FASTA file. Sequence is only read
+    when it is sliced, so opening a genome is fast and its pages are
+    shared between processes."""
+    cdef readonly object file, data
+    def __init__(self, str genome_FASTA, str index):
+        cdef list fields
+        self.file = open(genome_FASTA, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.chroms = {}
+        for line in index.rstrip().split('\n'):
+            fields = line.split('\t')
+            self.chroms[fields[0]] = ChromSequence(self.data, int(fields[2]), int(fields[1]), int(fields[3]), int(fields[4]))
+    
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+# A packed genome (.gpack) is a directory written by pack_genome():
+#   sequence.bin    uint8  four bases per byte, 2 bits each (A=0 C=1 G=2 T=3),
+#                          first base in the high bits; each chrom starts a new byte
+#   n_runs.bin      int64  (rows x 2) start, end of each run of N
+#   soft_runs.bin   int64  (rows x 2) start, end of each lowercase (soft-masked) run
+#   other.bin       int64  (rows x 2) position, character of each base that is
+#                          not A/C/G/T/N (stored uppercase)
+#   header.json     chroms, lengths, and the first byte/row of each chrom in
+#                   the files above (one more entry than chroms)
+genome_pack_suffix = '.gpack'
+pack_chunk_size = 1 << 22 # Bases packed at a time; a multiple of 4
+packed_columns = ['n_runs', 'soft_runs', 'other']
+cdef const char* base_letters = b'ACGT'
+base_codes = np.zeros(256, dtype=np.uint8)
+standard_bases = np.zeros(256, dtype=bool)
+for code, base in enumerate(b'ACGT'):
+    base_codes[base] = base_codes[base+32] = code
+
+for base in b'ACGTNacgtn':
+    standard_bases[base] = True
+
+def is_packed_genome(path):
+    return path.lower().rstrip('/').endswith(genome_pack_suffix)
+
+def find_runs(mask, long offset):
+    """Returns a (rows x 2) array of the start, end of each run of True in mask"""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)), axis=1).astype(np.int64) + offset
+
+def merge_runs(list runs_list):
+    """Concatenates runs found in consecutive chunks, joining runs that meet at a chunk boundary"""
+    if len(runs_list) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    
+    runs = np.concatenate(runs_list)
+    if len(runs) > 1:
+        joined = runs[1:,0] == runs[:-1,1]
+        runs = np.stack((runs[np.concatenate(([True], ~joined)),0], runs[np.concatenate((~joined, [True])),1]), axis=1)
+    
+    return runs
+
+def pack_chunk(bytes chunk, long offset, dict runs, sequence_file):
+    """Writes the 2-bit packed bases of chunk and adds its runs
+    of N, soft-masked runs and nonstandard bases to runs."""
+    bases = np.frombuffer(chunk, dtype=np.uint8)
+    lowercase = (bases >= 97) & (bases <= 122)
+    uppercase = np.where(lowercase, bases - 32, bases).astype(np.uint8)
+    runs['n_runs'].append(find_runs(uppercase == 78, offset))
+    runs['soft_runs'].append(find_runs(lowercase, offset))
+    other = np.flatnonzero(~standard_bases[bases])
+    runs['other'].append(np.stack((other + offset, uppercase[other]), axis=1).astype(np.int64))
+    codes = base_codes[bases]
+    if len(codes) % 4 != 0:
+        codes = np.concatenate((codes, np.zeros(4 - len(codes) % 4, dtype=np.uint8)))
+    
+    (codes[0::4] << 6 | codes[1::4] << 4 | codes[2::4] << 2 | codes[3::4]).astype(np.uint8).tofile(sequence_file)
+
+cdef write_packed_chrom(dict header, str chromname, long length, dict runs, dict column_files):
+    """Records a finished chromosome in header and writes its runs"""
+    header['chroms'].append(chromname)
+    header['lengths'].append(length)
+    header['sequence_offsets'].append(header['sequence_offsets'][-1] + (length + 3) // 4)
+    for name in packed_columns:
+        if name == 'other':
+            rows = np.concatenate(runs[name]) if runs[name] else np.zeros((0, 2), dtype=np.int64)
+        else:
+            rows = merge_runs(runs[name])
+        
+        rows.tofile(column_files[name])
+        header['{}_offsets'.format(name)].append(header['{}_offsets'.format(name)][-1] + len(rows))
+
+cpdef dict pack_genome(str genome_FASTA, str path, str split_on=' '):
+    """Writes genome_FASTA (optionally gzipped) as a packed genome directory.
+    Chromosomes are packed in chunks, so the whole genome is never in memory.
+    Returns the header."""
+    cdef:
+        bytes rawline, line, data
+        str chromname
+        list lines
+        long length, buffered
+        dict header, runs, column_files
+    
+    path = path.rstrip('/')
+    if not os.path.exists(path):
+        os.mkdir(path)
+    
+    genome_file = gzip.open(genome_FASTA, 'rb') if genome_FASTA.lower().endswith('.gz') else open(genome_FASTA, 'rb')
+    sequence_file = open(os.path.join(path, 'sequence.bin'), 'wb')
+    column_files = {name:open(os.path.join(path, '{}.bin'.format(name)), 'wb') for name in packed_columns}
+    header = {'chroms':[], 'lengths':[], 'sequence_offsets':[0]}
+    for name in packed_columns:
+        header['{}_offsets'.format(name)] = [0]
+    
+    chromname = None
+    lines = []
+    buffered = length = 0
+    runs = {name:[] for name in packed_columns}
+    for rawline in genome_file:
+        if rawline[:1] == b'>':
+            if chromname is not None:
+                data = b''.join(lines)
+                if len(data) > 0:
+                    pack_chunk(data, length, runs, sequence_file)
+                
+                write_packed_chrom(header, chromname, length + len(data), runs, column_files)
+            
+            chromname = rawline[1:].decode().rstrip().split(split_on)[0]
+            lines = []
+            buffered = length = 0
+            runs = {name:[] for name in packed_columns}
+            continue
+        
+        line = rawline.rstrip()
+        lines.append(line)
+        buffered += len(line)
+        if buffered >= pack_chunk_size:
+            data = b''.join(lines)
+            while len(data) >= pack_chunk_size:
+                pack_chunk(data[:pack_chunk_size], length, runs, sequence_file)
+                length += pack_chunk_size
+                data = data[pack_chunk_size:]
+            
+            lines = [data]
+            buffered = len(data)
+    
+    if chromname is not None:
+        data = b''.join(lines)
+        if len(data) > 0:
+            pack_chunk(data, length, runs, sequence_file)
+        
+        write_packed_chrom(header, chromname, length + len(data), runs, column_files)
+    
+    genome_file.close()
+    sequence_file.close()
+    for f in column_files.values():
+        f.close()
+    
+    header_file = open(os.path.join(path, 'header.json'), 'w')
+    json.dump(header, header_file)
+    header_file.close()
+    return header
+
+
+cdef inline long bisect_column(const long long[:, :] rows, int column, long long value):
+    """Index of the first row whose column is greater than value"""
+    cdef long lo = 0, hi = rows.shape[0], mid
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if rows[mid, column] <= value:
+            lo = mid + 1
+        else:
+            hi = mid
+    
+    return lo
+
+
+cdef class PackedSequence:
+    """One chromosome of a PackedGenome. Slicing it like a str unpacks
+    that part of the sequence and restores its Ns, case and other bases."""
+    cdef const unsigned char[:] packed
+    cdef const long long[:, :] n_runs, soft_runs, other
+    cdef readonly long length
+    def __init__(self, packed, n_runs, soft_runs, other, long length):
+        self.packed = packed
+        self.n_runs = n_runs
+        self.soft_runs = soft_runs
+        self.other = other
+        self.length = length
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, key):
+        cdef long start, stop, step, i, r
+        cdef bytearray sequence
+        cdef unsigned char *bases
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+        else:
+            start = key + self.length if key < 0 else key
+            if start < 0 or start >= self.length:
+                raise IndexError('sequence index out of range')
+            
+            stop, step = start + 1, 1
+        
+        if stop <= start:
+            return ''
+        
+        sequence = bytearray(stop - start)
+        bases = sequence
+        for i in range(start, stop):
+            bases[i - start] = base_letters[(self.packed[i >> 2] >> (6 - 2 * (i & 3))) & 3]
+        
+        r = bisect_column(self.n_runs, 1, start)
+        while r < self.n_runs.shape[0] and self.n_runs[r, 0] < stop:
+            for i in range(max(start, self.n_runs[r, 0]), min(stop, self.n_runs[r, 1])):
+                bases[i - start] = b'N'
+            
+            r += 1
+        
+        r = bisect_column(self.other, 0, start - 1)
+        while r < self.other.shape[0] and self.other[r, 0] < stop:
+            bases[self.other[r, 0] - start] = self.other[r, 1]
+            r += 1
+        
+        r = bisect_column(self.soft_runs, 1, start)
+        while r < self.soft_runs.shape[0] and self.soft_runs[r, 0] < stop:
+            for i in range(max(start, self.soft_runs[r, 0]), min(stop, self.soft_runs[r, 1])):
+                bases[i - start] += 32
+            
+            r += 1
+        
+        if step != 1:
+            return sequence.decode()[::step]
+        
+        return sequence.decode()
+    
+    def __str__(self):
+        return self[:]
+
+
+cdef class PackedGenome(MappedGenome):
+    """Genome read from a packed genome directory. All files are
+    memory-mapped, so opening a genome takes milliseconds and its
+    pages are shared between processes."""
+    cdef readonly str path
+    cdef readonly dict header, columns
+    def __init__(self, str path):
+        cdef Py_ssize_t i
+        self.path = path.rstrip('/')
+        header_file = open(os.path.join(self.path, 'header.json'), 'r')
+        self.header = json.load(header_file)
+        header_file.close()
+        self.columns = {'sequence':self.map_column('sequence', np.uint8, (self.header['sequence_offsets'][-1],))}
+        for name in packed_columns:
+            self.columns[name] = self.map_column(name, np.int64, (self.header['{}_offsets'.format(name)][-1], 2))
+        
+        self.chroms = {}
+        for i, chrom in enumerate(self.header['chroms']):
+            self.chroms[chrom] = PackedSequence(*[self.chrom_rows(name, i) for name in ['sequence'] + packed_columns], self.header['lengths'][i])
+    
+    def map_column(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        
+        return np.memmap(os.path.join(self.path, '{}.bin'.format(name)), dtype=dtype, mode='r', shape=shape)
+    
+    def chrom_rows(self, name, i):
+        offsets = self.header['{}_offsets'.format(name)]
+        return self.columns[name][offsets[i]:offsets[i+1]]
+    
+    def soft_mask_runs(self, chrom):
+        """Returns the (start, end) of each soft-masked run on chrom"""
+        return self.chrom_rows('soft_runs', self.header['chroms'].index(chrom))
+    
+    def index(self):
+        """Chromosome names and lengths in the first two columns of a .fai index"""
+        return ''.join(['{}\t{}\n'.format(c, l) for c, l in zip(self.header['chroms'], self.header['lengths'])])
+    
+    def close(self):
+        self.chroms = {}
+        self.columns = {}
+
+
+cpdef open_genome(str genome_FASTA):
+    """Returns (genome, index) like import_genome(). A packed genome is
+    opened as a PackedGenome, as is genome_FASTA.gpack if it is current.
+    Otherwise an uncompressed FASTA is opened as an IndexedGenome, using
+    genome_FASTA.fai if it is current or indexing the file otherwise;
+    other files are read into memory."""
+    cdef str fai = genome_FASTA+'.fai'
+    cdef str packed = genome_FASTA.rstrip('/')+genome_pack_suffix
+    if is_packed_genome(genome_FASTA):
+        genome = PackedGenome(genome_FASTA)
+        return genome, genome.index()
+    
+    if os.path.exists(os.path.join(packed, 'header.json')) and os.path.getmtime(os.path.join(packed, 'header.json')) >= os.path.getmtime(genome_FASTA):
+        genome = PackedGenome(packed)
+        return genome, genome.index()
+    
+    index = None
+    if not genome_FASTA.lower().endswith('.gz'):
+        if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(genome_FASTA):
+            index_file = open(fai, 'r')
+            index = index_file.read()
+            index_file.close()
+        else:
+            index = index_fasta(genome_FASTA)
+    
+    if index is None or len(index) == 0:
+        genome, index = import_genome(genome_FASTA)
+        if len(index) == 0: # Line lengths vary; index only the names and lengths
+            index = ''.join(['{}\t{}\n'.format(c, len(s)) for c, s in genome.items()])
+        
+        return genome, index
+    
+    return IndexedGenome(genome_FASTA, index), index
+
+
+def generate_softbridges(genome_dict, int minlen, int maxlen):
     """From a genome dict, yields one BED12 line for each start/stop
     of a softmasked region of the FASTA file, demarcated by lowercase letters.
+    The soft-masked runs of a PackedGenome are read from its index.
     """
     cdef:
         bint soft_toggle
@@ -1056,11 +1510,22 @@ def generate_softbridges(dict genome_dict, int minlen, int maxlen):
     soft_toggle = False
     current_pos = start_pos = end_pos = sb_length = 0
     for chromname in sorted(list(genome_dict.keys())):
+        if isinstance(genome_dict, PackedGenome):
+            for start_pos, end_pos in genome_dict.soft_mask_runs(chromname).tolist():
+                sb_length = end_pos - start_pos
+                if sb_length >= minlen and sb_length <= maxlen and end_pos < len(genome_dict[chromname]):
+                    out_string = '{}\t{}\t{}\t.\t0.01\t.\t0\t0\t204,204,180\t1\t{}\t0\t0.01\tsoftbridge\t..\n'.format(
+                        chromname, start_pos, end_pos, sb_length
+                    )
+                    yield out_string
+            
+            continue
+        
         soft_toggle = False
         current_pos = 0
         start_pos = 0
         end_pos = 0
-        chromstring = genome_dict[chromname]
+        chromstring = str(genome_dict[chromname])
         for i in range(len(chromstring)):
             c = chromstring[i]
             lowercase = c.islower()
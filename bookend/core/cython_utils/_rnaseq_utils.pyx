@@ -8,6 +8,10 @@ import bookend.core.cython_utils._fasta_utils as fu
 from collections import namedtuple, Counter
 from ast import literal_eval
 import copy
+import os
+import sys
+import shutil
+import tempfile
 ctypedef unsigned char uint8
 ctypedef np.float32_t float32
 
@@ -19,10 +23,9 @@ cdef class RNAseqMapping():
     cdef public int chrom, source, strand, s_len, e_len
     cdef public list ranges, splice
     cdef public bint s_tag, e_tag, capped, complete, is_reference, condensed
-    cdef public dict attributes
+    cdef dict _attributes
     cdef public (int, int) span
-    cdef public float weight, coverage
-    cdef public (float, float, float) tripleweight
+    cdef public float weight, coverage, s_weight, e_weight
     def __init__(self, input_data, attributes = None):
         """Initializes a Read Object given a tuple of input data.
         Requires a chromosome, strand, source, weight, a sorted tuple of
@@ -44,22 +47,46 @@ cdef class RNAseqMapping():
         if self.s_tag and self.e_tag and False not in self.splice:
             self.complete = True
         
-        if attributes is not None:
-            self.attributes = attributes
-        else:
-            self.attributes = {}
-        
+        self._attributes = attributes
+        self.s_weight = self.e_weight = -1 # End weights default to weight
         if '|' in str(input_data.weight):
             tripleweight = tuple(float(s) for s in str(input_data.weight).split('|'))
             self.weight = tripleweight[0]
-            self.attributes['E.reads'] = tripleweight[2]
-            if self.capped:
-                self.attributes['S.capped'] = tripleweight[1]
-            else:
-                self.attributes['S.reads'] = tripleweight[1]
+            self.s_weight = tripleweight[1]
+            self.e_weight = tripleweight[2]
         else:
             self.weight = float(input_data.weight)
     
+    property attributes:
+        """Dict of optional key:value annotations. Only created on first access,
+        so reads that never carry annotations do not allocate one."""
+        def __get__(self):
+            if self._attributes is None:
+                self._attributes = {}
+            
+            return self._attributes
+        
+        def __set__(self, dict value):
+            self._attributes = value
+    
+    cpdef float start_weight(self):
+        """Weight of the read's start tag (S.capped if capped, else S.reads)."""
+        if self.s_weight >= 0:
+            return self.s_weight
+        elif self._attributes is not None:
+            return float(self._attributes.get('S.capped' if self.capped else 'S.reads', self.weight))
+        
+        return self.weight
+    
+    cpdef float end_weight(self):
+        """Weight of the read's end tag (E.reads)."""
+        if self.e_weight >= 0:
+            return self.e_weight
+        elif self._attributes is not None:
+            return float(self._attributes.get('E.reads', self.weight))
+        
+        return self.weight
+    
     def __eq__(self, other): return self.span == other.span
     def __gt__(self, other): return self.span > other.span
     def __ge__(self, other): return self.span >= other.span
@@ -266,7 +293,26 @@ cdef class RNAseqMapping():
         if self.e_tag != other.e_tag: return False
         if self.capped != other.capped: return False
         return True
-    
+
+    cpdef tuple identity(self):
+        """Returns a hashable tuple of all attributes compared by is_identical(),
+        so that identical reads can be found with a dict lookup."""
+        return (self.chrom, self.source, self.strand, tuple(self.ranges), tuple(self.splice), self.s_tag, self.e_tag, self.capped, self.condensed)
+
+    cpdef void collapse(self, RNAseqMapping other, list totals):
+        """Adds the weight of an identical read to self. totals holds the
+        running [weight, start weight, end weight] of self as doubles, so
+        that float32 rounding does not build up over many collapsed reads.
+        End weights are summed if either read has them, using weight as the default."""
+        totals[0] += other.weight
+        totals[1] += other.start_weight()
+        totals[2] += other.end_weight()
+        if self.s_weight >= 0 or other.s_weight >= 0 or self.e_weight >= 0 or other.e_weight >= 0:
+            self.s_weight = totals[1]
+            self.e_weight = totals[2]
+
+        self.weight = totals[0]
+
     cpdef bint merge(self, RNAseqMapping other):
         """Combines with another Mapping object. Must be compatible."""
         if not self.is_compatible(other):
@@ -336,8 +382,8 @@ cdef class RNAseqMapping():
         if endweights and (self.s_tag or self.e_tag):
             weightstring = '{}|{}|{}'.format(
                 round(self.weight,2),
-                round(float(self.attributes.get('S.reads', 0))+float(self.attributes.get('S.capped', 0)),2),
-                round(float(self.attributes.get('E.reads', 0)),2)
+                round(self.s_weight if self.s_weight >= 0 else float(self.attributes.get('S.reads', 0))+float(self.attributes.get('S.capped', 0)),2),
+                round(self.e_weight if self.e_weight >= 0 else float(self.attributes.get('E.reads', 0)),2)
             )
         else:
             weightstring = str(round(self.weight,2))
@@ -472,7 +518,9 @@ cdef class RNAseqDataset():
     cdef public list read_list, chrom_array, source_array, chrom_lengths
     cdef public int chrom_index, source_index
     cdef public dict chrom_dict, source_dict
-    cdef readonly dict config, genome, label_tally
+    cdef readonly dict config, label_tally
+    cdef readonly object genome
+    cdef readonly str genome_fasta
     cdef readonly bint s_tag, e_tag, capped, stranded, ignore_ends, remove_noncanonical
     cdef readonly str start_seq, end_seq
     cdef readonly int minlen, minlen_strict, minlen_loose
@@ -500,6 +548,7 @@ cdef class RNAseqDataset():
         self.start_array = fu.nuc_to_int(self.start_seq)
         self.end_array = fu.nuc_to_int(self.end_seq)
         self.chrom_lengths = chrom_lengths
+        self.genome_fasta = genome_fasta
         self.chrom_dict = {}
         self.chrom_index = 0
         self.chrom_array = []
@@ -508,7 +557,7 @@ cdef class RNAseqDataset():
                 self.add_chrom(c)
         
         if genome_fasta is not None:
-            self.genome, index = fu.import_genome(genome_fasta)
+            self.genome, index = fu.open_genome(genome_fasta)
             index_lines = [l.split('\t') for l in index.rstrip().split('\n')]
             self.chrom_array = [l[0] for l in index_lines]
             self.chrom_lengths = [int(l[1]) for l in index_lines]
@@ -572,15 +621,80 @@ cdef class RNAseqDataset():
         new_read = elr_to_readobject(elr_line)
         self.read_list.append(new_read)
     
+    cpdef add_read_from_columns(self, tuple columns):
+        """Adds a read from one row of a binary ELR file:
+        (chrom, start, strand, EL_CIGAR, source, weight, s_weight, e_weight).
+        A negative s_weight or e_weight means that end has no separate weight."""
+        cdef RNAseqMapping new_read
+        cdef int chrom, start, strand, source
+        cdef str EL_CIGAR
+        cdef float weight, s_weight, e_weight
+        chrom, start, strand, EL_CIGAR, source, weight, s_weight, e_weight = columns
+        ranges, splice, s_tag, e_tag, capped, condensed = parse_EL_CIGAR(EL_CIGAR, start)
+        new_read = RNAseqMapping(ELdata(chrom, source, strand, ranges, splice, s_tag, e_tag, capped, weight, condensed))
+        new_read.s_weight = s_weight
+        new_read.e_weight = e_weight
+        self.read_list.append(new_read)
+    
     cpdef add_read_from_BAM(self, bam_lines, bint ignore_ends=False, bint secondary=False, float error_rate=0.1):
         cdef list new_read_list
-        cdef RNAseqMapping read
         cdef BAMobject BAM
         if type(bam_lines) is not list:
             bam_lines = [bam_lines]
         
         BAM = BAMobject(self, bam_lines, ignore_ends, secondary, self.remove_noncanonical, error_rate)
         new_read_list = BAM.generate_read()
+        self.tally_labels(new_read_list)
+        self.read_list += new_read_list
+    
+    cpdef list add_read_groups_from_BAM(self, list read_groups, bint ignore_ends=False, bint secondary=False, float error_rate=0.1):
+        """Adds reads from a batch of read groups, each a list of pysam
+        objects with the same read ID. Returns the number of reads added
+        to read_list for each group; see add_read_groups_from_SAM()."""
+        cdef list records = [line for bam_lines in read_groups for line in bam_lines]
+        return self.add_read_groups_from_SAM(
+            [[line.to_string() for line in bam_lines] for bam_lines in read_groups],
+            {line.reference_name:line.reference_id for line in records},
+            ignore_ends, secondary, error_rate
+        )
+    
+    cpdef list add_read_groups_from_SAM(self, list read_groups, dict reference_ids, bint ignore_ends=False, bint secondary=False, float error_rate=0.1, list group_sizes=None):
+        """Adds reads from a batch of read groups, each a list of SAM
+        strings with the same read ID. reference_ids maps reference names
+        to their index in the BAM header. The records of the whole batch
+        are extracted into one AlignmentColumns block. Returns the number
+        of reads added to read_list for each group.
+        If a group holds only one alignment of a multimapping read (as when
+        reading by region), group_sizes gives the number of SAM lines of
+        the whole read for each group; see BAMobject. Labels are then
+        tallied only for the first alignment of each read."""
+        cdef list new_read_list, counts
+        cdef AlignmentColumns columns
+        cdef BAMobject BAM
+        cdef Py_ssize_t first, g
+        cdef int group_size = 0
+        columns = AlignmentColumns([line for sam_lines in read_groups for line in sam_lines], reference_ids, error_rate)
+        counts = []
+        first = 0
+        for g in range(len(read_groups)):
+            sam_lines = read_groups[g]
+            if group_sizes is not None:
+                group_size = group_sizes[g]
+            
+            BAM = BAMobject(self, sam_lines, ignore_ends, secondary, self.remove_noncanonical, error_rate, columns, first, group_size)
+            new_read_list = BAM.generate_read()
+            if group_sizes is None or columns.hits_v[first] <= 1:
+                self.tally_labels(new_read_list)
+            
+            self.read_list += new_read_list
+            counts.append(len(new_read_list))
+            first += len(sam_lines)
+        
+        return counts
+    
+    cdef void tally_labels(self, list new_read_list):
+        """Counts the end label lengths of the first mapping of a read"""
+        cdef RNAseqMapping read
         if len(new_read_list) > 0:
             read = new_read_list[0]
             if read.s_tag:
@@ -592,8 +706,6 @@ cdef class RNAseqDataset():
                 self.label_tally['E'][read.e_len] += 1
             elif read.e_len > 0:
                 self.label_tally['e'][read.e_len] += 1
-        
-        self.read_list += new_read_list
 
     cpdef pop_read(self, read_format='elr', as_string=True):
         """Remove the last read added to the stack and write it in 'format'.
@@ -617,6 +729,45 @@ cdef class RNAseqDataset():
         return header_list
 
 
+cdef class SharedDataset:
+    """A picklable description of an RNAseqDataset that worker processes
+    rebuild with attach(), in place of pickling the dataset and its genome.
+    The chrom/source tables and config are small and are copied; lookup
+    tables such as start_array/end_array are rebuilt from the config.
+    The genome is shared as a memory-mapped file that each worker opens
+    by name, so the page cache holds one copy for any number of workers.
+    A genome that was read into memory is first packed into a temporary
+    .gpack directory, which close() removes."""
+    cdef readonly dict config
+    cdef readonly list chrom_array, chrom_lengths, source_array
+    cdef readonly str genome_fasta, temp_dir
+    def __init__(self, RNAseqDataset dataset, tmpdir=None):
+        self.config = dataset.config
+        self.chrom_array = list(dataset.chrom_array)
+        self.chrom_lengths = None if dataset.chrom_lengths is None else list(dataset.chrom_lengths)
+        self.source_array = list(dataset.source_array)
+        self.genome_fasta = dataset.genome_fasta
+        self.temp_dir = None
+        if self.genome_fasta is not None and isinstance(dataset.genome, dict):
+            self.temp_dir = tempfile.mkdtemp(prefix='bookend', dir=tmpdir)
+            self.genome_fasta = os.path.join(self.temp_dir, 'genome'+fu.genome_pack_suffix)
+            fu.pack_genome(dataset.genome_fasta, self.genome_fasta)
+    
+    cpdef RNAseqDataset attach(self):
+        """Returns a new RNAseqDataset with the same tables that reads the shared genome"""
+        cdef RNAseqDataset dataset = RNAseqDataset(source_array=self.source_array, genome_fasta=self.genome_fasta, config=self.config)
+        dataset.chrom_array = list(self.chrom_array)
+        dataset.chrom_lengths = None if self.chrom_lengths is None else list(self.chrom_lengths)
+        dataset.chrom_index = len(self.chrom_array)
+        dataset.chrom_dict = dict(zip(self.chrom_array, range(dataset.chrom_index)))
+        return dataset
+    
+    def close(self):
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+
 ######################################
 # Utilities for GTF/GFF file parsing #
 ######################################
@@ -1235,11 +1386,8 @@ cdef parse_ELR_line(str elr_line):
     Example:
       0 6787 1950 - E282A87D294A113D86A586D90A91D48A129D144S 0 1.0
     """
-    cdef str chrom_num, chromStart, read_len, elr_strand, EL_CIGAR, source_num, weight_string, first, last
-    cdef int chrom, source, startpos, strand, position, i, f, a, b, rightside, l_index
-    cdef float weight
-    cdef list label_indices, feature_lengths, ranges, splice
-    cdef bint gap
+    cdef str chrom_num, chromStart, read_len, elr_strand, EL_CIGAR, source_num, weight_string
+    cdef int chrom, source, startpos, strand
     chrom_num, chromStart, read_len, elr_strand, EL_CIGAR, source_num, weight_string = elr_line.rstrip().split('\t')
     if elr_strand == '+':
         strand = 1
@@ -1251,6 +1399,17 @@ cdef parse_ELR_line(str elr_line):
     chrom = int(chrom_num)
     source = int(source_num)
     startpos = int(chromStart)
+    ranges, splice, s_tag, e_tag, capped, condensed = parse_EL_CIGAR(EL_CIGAR, startpos)
+    # chrom source strand ranges splice s_tag e_tag capped weight
+    return ELdata(chrom, source, strand, ranges, splice, s_tag, e_tag, capped, weight_string, condensed)
+
+cdef tuple parse_EL_CIGAR(str EL_CIGAR, int startpos):
+    """Converts an EL_CIGAR string of a read starting at startpos to
+    (ranges, splice, s_tag, e_tag, capped, condensed)."""
+    cdef str first, last
+    cdef int position, i, f, a, b, rightside, l_index
+    cdef list label_indices, feature_lengths, ranges, splice
+    cdef bint gap, s_tag, e_tag, capped, condensed
     label_indices = [i for i,character in enumerate(EL_CIGAR) if not character.isdigit()]
     feature_lengths = [int(EL_CIGAR[a+1:b]) for a,b in zip(label_indices[:-1],label_indices[1:])]
     ranges = []
@@ -1281,9 +1440,7 @@ cdef parse_ELR_line(str elr_line):
     s_tag = first in ['C', 'S'] or last in ['C','S']
     capped = first == 'C' or last == 'C'
     e_tag = first == 'E' or last == 'E'
-    
-    # chrom source strand ranges splice s_tag e_tag capped weight
-    return ELdata(chrom, source, strand, ranges, splice, s_tag, e_tag, capped, weight_string, condensed)
+    return ranges, splice, s_tag, e_tag, capped, condensed
 
 cpdef list get_sources(list list_of_reads):
     cdef:
@@ -1303,24 +1460,158 @@ cpdef dict get_source_dict(list list_of_sources):
     source_lookup = dict(zip(sources, range(len(sources))))
     return source_lookup
 
+cdef class RunLengthCoverage:
+    """Piecewise-constant coverage over positions [0, length).
+    Run i covers [starts[i], starts[i+1]) at height values[i]; the last run ends at length."""
+    cdef public np.ndarray starts, values
+    cdef public int length
+    def __init__(self, starts, values, int length):
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.length = length
+    
+    def __len__(self): return self.length
+    
+    def __repr__(self):
+        return 'RunLengthCoverage({} runs over {})'.format(self.starts.shape[0], self.length)
+    
+    cpdef np.ndarray ends(self):
+        """Returns the (exclusive) right edge of each run"""
+        return np.append(self.starts[1:], self.length).astype(np.int32)
+    
+    cpdef at(self, positions):
+        """Returns the height at a position, or at each of an array of positions"""
+        return self.values[np.searchsorted(self.starts, positions, side='right')-1]
+    
+    cpdef RunLengthCoverage add(self, RunLengthCoverage other):
+        """Returns the sum of two coverages; runs are split at the union of breakpoints."""
+        cdef np.ndarray starts
+        if np.array_equal(self.starts, other.starts):
+            return RunLengthCoverage(self.starts, self.values + other.values, self.length)
+        
+        starts = np.union1d(self.starts, other.starts)
+        return RunLengthCoverage(starts, self.at(starts) + other.at(starts), self.length)
+    
+    cpdef RunLengthCoverage scale(self, float factor):
+        """Returns the coverage multiplied by a constant"""
+        return RunLengthCoverage(self.starts, self.values * factor, self.length)
+    
+    cpdef RunLengthCoverage merge(self):
+        """Returns an equivalent coverage with adjacent runs of equal height combined"""
+        cdef np.ndarray keep = np.append(True, self.values[1:] != self.values[:-1])
+        return RunLengthCoverage(self.starts[keep], self.values[keep], self.length)
+    
+    cpdef tuple stretches(self, np.ndarray mask):
+        """Given a boolean per run, returns (lefts, rights) arrays of the
+        maximal contiguous stretches of positions in masked runs."""
+        cdef np.ndarray edges, first, last
+        edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+        first = np.where(edges > 0)[0]
+        last = np.where(edges < 0)[0]
+        return self.starts[first], np.append(self.starts, self.length)[last]
+    
+    cpdef list gaps(self, int maxgap, float threshold=1):
+        """Run-length equivalent of get_gaps(): returns (left, right) of each stretch
+        longer than maxgap that falls below threshold and is followed by coverage."""
+        cdef np.ndarray lefts, rights
+        lefts, rights = self.stretches(self.values < threshold)
+        return [(l, r) for l,r in zip(lefts.tolist(), rights.tolist()) if r-l > maxgap and r < self.length]
+    
+    cpdef RunLengthCoverage interp(self, np.ndarray known, np.ndarray detail):
+        """Fills the runs where known is False by linear interpolation between
+        the nearest known runs, as np.interp over every position would. Unknown
+        runs where detail is True are split into single-base runs holding the
+        exact interpolated value; other unknown runs take the value at their start."""
+        cdef np.ndarray xp, fp, first, expand, counts, offsets, starts
+        xp = np.vstack((self.starts[known], self.ends()[known]-1)).T.flatten()
+        fp = np.repeat(self.values[known], 2)
+        xp, first = np.unique(xp, return_index=True)
+        expand = np.logical_and(~known, detail)
+        counts = np.where(expand, np.diff(np.append(self.starts, self.length)), 1)
+        offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        starts = np.repeat(self.starts, counts) + offsets
+        return RunLengthCoverage(starts, np.interp(starts, xp, fp[first]), self.length)
+    
+    cpdef RunLengthCoverage slice(self, int left, int right):
+        """Returns the coverage of positions [left, right), shifted to start at 0"""
+        cdef np.ndarray starts
+        cdef Py_ssize_t first, last
+        left, right = max(left, 0), min(right, self.length)
+        if right <= left:
+            return RunLengthCoverage(np.zeros(0), np.zeros(0), 0)
+        
+        first = np.searchsorted(self.starts, left, side='right') - 1
+        last = np.searchsorted(self.starts, right, side='left')
+        starts = self.starts[first:last] - left
+        starts[0] = 0
+        return RunLengthCoverage(starts, self.values[first:last], right - left)
+    
+    cpdef double total(self, int left, int right):
+        """Returns the summed height of positions [left, right)"""
+        cdef RunLengthCoverage runs = self.slice(left, right)
+        if runs.length == 0:
+            return 0
+        
+        return np.sum(runs.values.astype(np.float64) * np.diff(np.append(runs.starts, runs.length)))
+    
+    cpdef double mean(self, int left, int right):
+        """Returns the mean height of positions [left, right), or nan if the range is empty"""
+        left, right = max(left, 0), min(right, self.length)
+        if right <= left:
+            return np.nan
+        
+        return self.total(left, right) / (right - left)
+    
+    cpdef np.ndarray to_array(self):
+        """Expands to a per-base array of heights"""
+        return np.repeat(self.values, np.diff(np.append(self.starts, self.length)))
+
+cpdef list accumulate_runs(list rows, list lefts, list rights, list weights, int number_of_rows, int length):
+    """Adds the weight of each interval [left, right) to its row of coverage.
+    Returns one RunLengthCoverage per row; all rows share the same breakpoints.
+    Each interval adds its weight at its left breakpoint and removes it at its
+    right one, and the rows are summed cumulatively in double precision.
+    Runs that no interval covers are exactly zero."""
+    cdef np.ndarray starts, L, R, row_index, W, delta, depth, values
+    starts = np.unique(np.concatenate(([0], lefts, rights)).astype(np.int32))
+    starts = starts[np.logical_and(starts >= 0, starts < length)]
+    L = np.searchsorted(starts, np.array(lefts, dtype=np.int32))
+    R = np.searchsorted(starts, np.array(rights, dtype=np.int32))
+    row_index = np.array(rows, dtype=np.intp)
+    W = np.array(weights, dtype=np.float64)
+    delta = np.zeros(shape=(number_of_rows, starts.shape[0]+1), dtype=np.float64)
+    depth = np.zeros(shape=(number_of_rows, starts.shape[0]+1), dtype=np.int32)
+    np.add.at(delta, (row_index, L), W)
+    np.add.at(delta, (row_index, R), -W)
+    np.add.at(depth, (row_index, L), 1)
+    np.add.at(depth, (row_index, R), -1)
+    values = np.cumsum(delta[:,:-1], axis=1)
+    values[np.cumsum(depth[:,:-1], axis=1) == 0] = 0
+    return [RunLengthCoverage(starts, values[i,:], length) for i in range(number_of_rows)]
+
 cpdef build_depth_matrix(int leftmost, int rightmost, tuple reads, bint use_attributes=True, bint splice=True):
-    """Stores a numpy array of feature-specific coverage depth for the read list.
-    Populates an 11-row matrix:
-    S+  E+  D+  A+  S-  E-  D-  A-  cov+  cov-  cov?
-    Additionally, records splice junction D-A pairs in dicts J_plus and J_minus"""
+    """Stores run-length coverage depth for the read list.
+    Populates a list of 3 RunLengthCoverage objects:
+    cov+  cov-  cov?
+    End signals are sparse; end_signal is a list of 6 (positions, weights) arrays:
+    S+  E+  S-  E-  C+  C-
+    Additionally, records splice junction D-A pairs in dicts J_plus and J_minus,
+    keyed by span_to_key() of the locus-relative (D, A) span"""
     cdef:
-        Py_ssize_t Sp, Ep, Sm, Em, Dp, Ap, Dm, Am, covp, covm, covn, covrow
+        Py_ssize_t Sp, Ep, Sm, Em, Cp, Cm, covp, covm, covn, covrow
         int array_length, l, r, pos
         float weight, s_weight, e_weight, c_weight
         (int, int) span, block
-        str junction_hash
+        long long junction_key
         dict J_plus, J_minus
+        list end_pos, end_wt, end_signal, coverage, cov_rows, cov_lefts, cov_rights, cov_weights
         RNAseqMapping read
-        np.ndarray depth_matrix
     
-    Sp, Ep, Sm, Em, Cp, Cm, covp, covm, covn = range(9)
+    Sp, Ep, Sm, Em, Cp, Cm = range(6)
+    covp, covm, covn = range(3)
     array_length = rightmost - leftmost
-    depth_matrix = np.zeros(shape=(9, array_length), dtype=np.float32)
+    cov_rows, cov_lefts, cov_rights, cov_weights = [], [], [], []
+    end_pos, end_wt = [[] for i in range(6)], [[] for i in range(6)]
     J_plus, J_minus = {}, {}
     for read in reads:
         if read.condensed:
@@ -1328,11 +1619,10 @@ cpdef build_depth_matrix(int leftmost, int rightmost, tuple reads, bint use_attr
             c_weight = 1 if read.capped else 0
             e_weight = 1 if read.e_tag else 0
             weight = read.weight
-        elif use_attributes: # Check a read's attributes for different values of each type
+        elif use_attributes: # Check a read's end weights for different values of each type
             weight = read.weight
-            s_weight = float(read.attributes.get('S.reads', weight))
-            e_weight = float(read.attributes.get('E.reads', weight))
-            c_weight = float(read.attributes.get('S.capped', weight))
+            s_weight = c_weight = read.start_weight()
+            e_weight = read.end_weight()
         else:
             weight, s_weight, e_weight, c_weight = read.weight, read.weight, read.weight, read.weight
         
@@ -1342,122 +1632,151 @@ cpdef build_depth_matrix(int leftmost, int rightmost, tuple reads, bint use_attr
                 l = span[0] - leftmost
                 r = span[1] - leftmost
                 block = (l,r)
-                junction_hash = span_to_string(block)
-                J_plus[junction_hash] = J_plus.get(junction_hash, 0) + weight
+                junction_key = span_to_key(block)
+                J_plus[junction_key] = J_plus.get(junction_key, 0) + weight
             
             if read.s_tag:
                 pos = read.span[0] - leftmost
                 if read.capped:
-                    depth_matrix[Cp, pos] += c_weight
+                    end_pos[Cp].append(pos)
+                    end_wt[Cp].append(c_weight)
                 else:
-                    depth_matrix[Sp, pos] += s_weight
+                    end_pos[Sp].append(pos)
+                    end_wt[Sp].append(s_weight)
             
             if read.e_tag:
                 pos = read.span[1] - leftmost - 1
-                depth_matrix[Ep, pos] += e_weight
+                end_pos[Ep].append(pos)
+                end_wt[Ep].append(e_weight)
         elif read.strand == -1:
             covrow = covm
             for span in read.junctions():
                 l = span[0] - leftmost
                 r = span[1] - leftmost
                 block = (l,r)
-                junction_hash = span_to_string(block)
-                J_minus[junction_hash] = J_minus.get(junction_hash, 0) + weight
+                junction_key = span_to_key(block)
+                J_minus[junction_key] = J_minus.get(junction_key, 0) + weight
             
             if read.e_tag:
                 pos = read.span[0] - leftmost
-                depth_matrix[Em, pos] += e_weight
+                end_pos[Em].append(pos)
+                end_wt[Em].append(e_weight)
             
             if read.s_tag:
                 pos = read.span[1] - leftmost - 1
                 if read.capped:
-                    depth_matrix[Cm, pos] += c_weight
+                    end_pos[Cm].append(pos)
+                    end_wt[Cm].append(c_weight)
                 else:
-                    depth_matrix[Sm, pos] += s_weight
+                    end_pos[Sm].append(pos)
+                    end_wt[Sm].append(s_weight)
         else: # The read has no features other than non-stranded coverage
             covrow = covn
         
         if splice:
             for span in read.ranges:
-                l = span[0] - leftmost
-                r = span[1] - leftmost
-                depth_matrix[covrow, l:r] += weight
+                cov_rows.append(covrow)
+                cov_lefts.append(span[0] - leftmost)
+                cov_rights.append(span[1] - leftmost)
+                cov_weights.append(weight)
         else:
-            l = read.span[0] - leftmost
-            r = read.span[1] - leftmost
-            depth_matrix[covrow, l:r] += weight
-        
-    return depth_matrix, J_plus, J_minus
-
-cpdef str bedgraph(str chrom, int leftmost, np.ndarray depth_matrix, str seqtype='', int strand=0):
-    """Returns a list of bedgraph lines from an array of height values."""
+            cov_rows.append(covrow)
+            cov_lefts.append(read.span[0] - leftmost)
+            cov_rights.append(read.span[1] - leftmost)
+            cov_weights.append(weight)
+    
+    coverage = accumulate_runs(cov_rows, cov_lefts, cov_rights, cov_weights, 3, array_length)
+    end_signal = [sum_signals([(np.array(p, dtype=np.int32), np.array(w, dtype=np.float32))]) for p,w in zip(end_pos, end_wt)]
+    return coverage, end_signal, J_plus, J_minus
+
+cpdef tuple sum_signals(list signals, list scales=None):
+    """Merges a list of sparse (positions, weights) signals into one signal with
+    sorted, unique positions. If scales are given, each signal's weights are multiplied
+    by its scale. Weights at the same position are summed in input order."""
+    cdef np.ndarray positions, weights, inverse, values
+    if scales is not None:
+        weights = np.concatenate([signal[1]*scale for signal,scale in zip(signals, scales)])
+    else:
+        weights = np.concatenate([signal[1] for signal in signals])
+    
+    positions, inverse = np.unique(np.concatenate([signal[0] for signal in signals]), return_inverse=True)
+    values = np.zeros(positions.shape[0], dtype=np.float32)
+    np.add.at(values, inverse, weights)
+    return positions, values
+
+cpdef float signal_in_range(tuple signal, int left, int right):
+    """Returns the total weight of a sparse (positions, weights) signal in [left, right)"""
+    cdef np.ndarray positions = signal[0]
+    return np.sum(signal[1][np.searchsorted(positions, left):np.searchsorted(positions, right)])
+
+cpdef str bedgraph(str chrom, int leftmost, list coverage, list end_signal, str seqtype='', int strand=0):
+    """Returns a list of bedgraph lines from run-length coverage or end signal.
+    End signals stay sparse: only the signals the seqtype and strand need
+    are summed, and one line is written for each position whose weight is
+    nonzero and differs from the position before it."""
     cdef:
         int p, lastp
-        float v, lastv
+        float v
         str output = ''
-        np.ndarray coverage, positions, values
-        bint contiguous
+        tuple signal
+        np.ndarray positions, values, repeats, keep
+        RunLengthCoverage runs
     
     if seqtype.upper() == 'COV' or seqtype == '':
-        contiguous = True
-        coverage = np.sum(depth_matrix[-3:,:], axis=0)
-    elif seqtype.upper() == '5P':
-        contiguous = False
+        runs = coverage[0].add(coverage[1]).add(coverage[2]).merge()
+        for p, lastp, v in zip(runs.starts.tolist(), runs.ends().tolist(), runs.values):
+            if v != 0:
+                output += '{}\t{}\t{}\t{}\n'.format(chrom, p+leftmost, lastp+leftmost, v)
+        
+        return output
+    
+    if seqtype.upper() == '5P':
         if strand == 1:
-            coverage = np.sum(depth_matrix[[0,4],:], axis=0)
+            signal = sum_signals([end_signal[0], end_signal[4]])
         elif strand == -1:
-            coverage = np.sum(depth_matrix[[2,5],:], axis=0)
+            signal = sum_signals([end_signal[2], end_signal[5]])
         else:
-            coverage = np.sum(depth_matrix[[0,4],:], axis=0) - np.sum(depth_matrix[[2,5],:], axis=0)
+            signal = sum_signals([sum_signals([end_signal[0], end_signal[4]]), sum_signals([end_signal[2], end_signal[5]])], [1, -1])
     elif seqtype.upper() == 'S':
-        contiguous = False
         if strand == 1:
-            coverage = depth_matrix[0,:]
+            signal = sum_signals([end_signal[0]])
         elif strand == -1:
-            coverage = depth_matrix[2,:]
+            signal = sum_signals([end_signal[2]])
         else:
-            coverage = depth_matrix[0,:] - depth_matrix[2,:]
+            signal = sum_signals([end_signal[0], end_signal[2]], [1, -1])
     elif seqtype.upper() == 'C':
-        contiguous = False
         if strand == 1:
-            coverage = depth_matrix[4,:]
+            signal = sum_signals([end_signal[4]])
         elif strand == -1:
-            coverage = depth_matrix[5,:]
+            signal = sum_signals([end_signal[5]])
         else:
-            coverage = depth_matrix[4,:] - depth_matrix[5,:]
+            signal = sum_signals([end_signal[4], end_signal[5]], [1, -1])
     elif seqtype.upper() in ['E', '3P']:
-        contiguous = False
         if strand == 1:
-            coverage = depth_matrix[1,:]
+            signal = sum_signals([end_signal[1]])
         elif strand == -1:
-            coverage = depth_matrix[3,:]
+            signal = sum_signals([end_signal[3]])
         else:
-            coverage = depth_matrix[1,:] - depth_matrix[3,:]
-    
-    positions = np.where(np.append(coverage[0],np.diff(coverage)) != 0)[0]
-    values = coverage[positions]
-    lastp, lastv = -1, 0
-    for p,v in zip(positions, values):
-        if lastp >= 0 and lastv != 0:
-            output += '{}\t{}\t{}\t{}\n'.format(chrom, lastp+leftmost, [lastp+1, p][contiguous]+leftmost, lastv)
-        
-        lastp, lastv = p, v
-    
+            signal = sum_signals([end_signal[1], end_signal[3]], [1, -1])
     
-    if lastv != 0 and lastp >= 0:
-        output += '{}\t{}\t{}\t{}\n'.format(chrom, lastp+leftmost, [lastp+1, coverage.shape[0]][contiguous]+leftmost, lastv)
+    positions, values = signal
+    repeats = np.zeros(positions.shape[0], dtype=bool)
+    repeats[1:] = (np.diff(positions) == 1) & (values[1:] == values[:-1])
+    keep = (values != 0) & ~repeats
+    for p, v in zip(positions[keep].tolist(), values[keep]):
+        output += '{}\t{}\t{}\t{}\n'.format(chrom, p+leftmost, p+1+leftmost, v)
     
     return output
 
-cdef str span_to_string((int, int) span):
-    """Converts a tuple of two ints to a string connected by ':'"""
-    return '{}:{}'.format(span[0], span[1])
+cpdef long long span_to_key((int, int) span):
+    """Packs a tuple of two nonnegative ints into one int64 junction key.
+    Keys sort in the same order as the spans they encode."""
+    return (<long long>span[0] << 32) | span[1]
 
 
-cdef (int, int) string_to_span(str string):
-    """Converts a string from span_to_string() back into a span"""
-    cdef list splitstring = string.split(':')
-    return (int(splitstring[0]), int(splitstring[1]))
+cpdef (int, int) key_to_span(long long key):
+    """Converts a key from span_to_key() back into a span"""
+    return (<int>(key >> 32), <int>(key & 0xFFFFFFFF))
 
 
 cdef parse_BED_line(bed_line, chrom_dict, source_dict, source_string=None, s_tag=False, e_tag=False, capped=False, gaps_are_junctions=False, keep_readname=False):
@@ -1586,7 +1905,7 @@ cpdef np.ndarray calculate_coverage(list reads, int left, int right):
     
     return coverage
 
-cpdef str get_flank(dict genome, str chrom, int pos, int strand, str label_type, int label_len):
+cpdef str get_flank(genome, str chrom, int pos, int strand, str label_type, int label_len):
     """Gets flanking region to a genomic position to compare to an end label
     """
     cdef str flank
@@ -1605,7 +1924,7 @@ cpdef str get_flank(dict genome, str chrom, int pos, int strand, str label_type,
     
     return flank
 
-cdef int get_junction_strand(dict genome, str chrom, int left, int right):
+cdef int get_junction_strand(genome, str chrom, int left, int right):
     """ Returns 1(+), -1(-), or 0(.) for a left/right
     pair of splice junction positions based
     on the flanking genomic sequence """
@@ -1721,7 +2040,7 @@ cpdef parse_SAM_CIGAR(int pos, list cigartuples, str mdstring, float error_rate=
                     match_count += 1
                     mismatches += 1
             except StopIteration:
-                print("# RAN OUT")
+                print("# RAN OUT", file=sys.stderr)
                 match_count = 0
 
         if first_element:
@@ -1734,6 +2053,340 @@ cpdef parse_SAM_CIGAR(int pos, list cigartuples, str mdstring, float error_rate=
     return ranges, gaps, head, tail
 
 
+cdef inline int cigar_operator(unsigned char c) nogil:
+    """Returns the pysam code of a CIGAR operator character, or -1 for
+    operators that parse_SAM_CIGAR() ignores (P, =, X)"""
+    if c == 77: # M
+        return 0
+    elif c == 73: # I
+        return 1
+    elif c == 68: # D
+        return 2
+    elif c == 78: # N
+        return 3
+    elif c == 83: # S
+        return 4
+    elif c == 72: # H
+        return 5
+    
+    return -1
+
+
+cdef inline bint is_digit(unsigned char c) nogil:
+    return c >= 48 and c <= 57
+
+
+cdef inline long parse_int(const unsigned char[:] data, Py_ssize_t start, Py_ssize_t end) nogil:
+    """Reads a signed decimal integer from data[start:end]"""
+    cdef long value = 0
+    cdef bint negative = start < end and data[start] == 45 # -
+    if negative:
+        start += 1
+    
+    while start < end and is_digit(data[start]):
+        value = value * 10 + data[start] - 48
+        start += 1
+    
+    return -value if negative else value
+
+
+cdef inline int strand_symbol(const unsigned char[:] data, Py_ssize_t start, Py_ssize_t end) nogil:
+    """1 if data[start:end] is '+', -1 if '-', 0 otherwise"""
+    if end - start == 1:
+        if data[start] == 43:
+            return 1
+        elif data[start] == 45:
+            return -1
+    
+    return 0
+
+
+cdef void parse_sam_fields(const unsigned char[:] data, np.int64_t[:, :] bounds, np.int64_t[:] positions,
+                           np.int32_t[:] flags, np.int32_t[:] nh, np.int32_t[:] hits,
+                           np.int32_t[:] errors, np.int32_t[:] strand_tags) nogil:
+    """Splits newline-separated SAM records into the columns of an
+    AlignmentColumns block. Each row of bounds holds the start and end
+    offsets in data of the record's name, reference name, CIGAR, SEQ and
+    MD fields (start -1 for a missing MD tag)."""
+    cdef Py_ssize_t r, i, field, field_start, length
+    cdef long nm, nM
+    cdef int xs, ts
+    length = data.shape[0]
+    i = 0
+    for r in range(positions.shape[0]):
+        field = 0
+        field_start = i
+        nm = nM = -1
+        xs = ts = 2 # Not found
+        nh[r] = hits[r] = -1
+        bounds[r, 8] = bounds[r, 9] = -1
+        while True:
+            if i < length and data[i] != 9 and data[i] != 10: # Not a tab or newline
+                i += 1
+                continue
+            
+            if field == 0:
+                bounds[r, 0] = field_start
+                bounds[r, 1] = i
+            elif field == 1:
+                flags[r] = parse_int(data, field_start, i)
+            elif field == 2:
+                bounds[r, 2] = field_start
+                bounds[r, 3] = i
+            elif field == 3:
+                positions[r] = parse_int(data, field_start, i) - 1
+            elif field == 5:
+                bounds[r, 4] = field_start
+                bounds[r, 5] = i
+            elif field == 9:
+                bounds[r, 6] = field_start
+                bounds[r, 7] = i
+            elif field > 10 and i - field_start >= 5: # Optional tag XX:T:value
+                if data[field_start] == 78 and data[field_start+1] == 72: # NH
+                    nh[r] = parse_int(data, field_start+5, i)
+                elif data[field_start] == 72 and data[field_start+1] == 73: # HI
+                    hits[r] = parse_int(data, field_start+5, i)
+                elif data[field_start] == 110 and data[field_start+1] == 77: # nM
+                    nM = parse_int(data, field_start+5, i)
+                elif data[field_start] == 78 and data[field_start+1] == 77: # NM
+                    nm = parse_int(data, field_start+5, i)
+                elif data[field_start] == 77 and data[field_start+1] == 68: # MD
+                    bounds[r, 8] = field_start+5
+                    bounds[r, 9] = i
+                elif data[field_start] == 88 and data[field_start+1] == 83: # XS
+                    xs = strand_symbol(data, field_start+5, i)
+                elif data[field_start] == 116 and data[field_start+1] == 115: # ts
+                    ts = strand_symbol(data, field_start+5, i)
+            
+            if i >= length or data[i] == 10: # End of the record
+                i += 1
+                break
+            
+            i += 1
+            field += 1
+            field_start = i
+        
+        errors[r] = nM if nM >= 0 else nm if nm >= 0 else 0
+        if xs != 2:
+            strand_tags[r] = xs
+        elif ts != 2:
+            strand_tags[r] = 2 * ts
+        else:
+            strand_tags[r] = 0
+
+
+cdef void compute_blocks(const unsigned char[:] data, const np.int64_t[:, :] bounds, const np.int64_t[:] positions,
+                         double error_rate, np.int64_t[:] block_starts, np.int64_t[:] block_ends, np.int64_t[:] block_first,
+                         np.int64_t[:] intron_starts, np.int64_t[:] intron_ends, np.int64_t[:] intron_first,
+                         np.int32_t[:] head, np.int32_t[:] tail, np.uint8_t[:] ran_out) nogil:
+    """Applies parse_SAM_CIGAR() to every record of an AlignmentColumns
+    block at once, reading the CIGAR and MD fields found by parse_sam_fields().
+    The blocks (ranges) and introns of record r are rows block_first[r]:block_first[r+1]
+    and intron_first[r]:intron_first[r+1] of the output arrays."""
+    cdef Py_ssize_t r, c, c_end, m, m_end, token, nb, ni
+    cdef long current_pos, o_len, match_count, number, mismatches, exon_size
+    cdef int operator
+    cdef bint first_element, jumped
+    nb = ni = 0
+    for r in range(positions.shape[0]):
+        block_first[r] = nb
+        intron_first[r] = ni
+        head[r] = tail[r] = 0
+        ran_out[r] = 0
+        current_pos = positions[r]
+        first_element = jumped = True
+        mismatches = exon_size = 0
+        m = bounds[r, 8]
+        m_end = bounds[r, 9]
+        if m < 0: # Without an MD tag, the whole sequence is taken to match
+            match_count = 0 if bounds[r, 7] - bounds[r, 6] == 1 and data[bounds[r, 6]] == 42 else bounds[r, 7] - bounds[r, 6]
+        else:
+            match_count = 0
+            while m < m_end and is_digit(data[m]):
+                match_count = match_count * 10 + data[m] - 48
+                m += 1
+        
+        c = bounds[r, 4]
+        c_end = bounds[r, 5]
+        while c < c_end:
+            o_len = 0
+            while c < c_end and is_digit(data[c]):
+                o_len = o_len * 10 + data[c] - 48
+                c += 1
+            
+            if c >= c_end:
+                break
+            
+            operator = cigar_operator(data[c])
+            c += 1
+            if operator == 4 or operator == 5: # Softclipped ranges are stored in either head or tail
+                if first_element:
+                    head[r] = o_len
+                else:
+                    tail[r] = o_len
+            
+            if operator == 0: # Match
+                if jumped: # The last match was across an intron, dump it
+                    jumped = False
+                    if exon_size > 0 and <double>mismatches/exon_size > error_rate: # Last exon didn't pass quality threshold
+                        nb -= 1
+                        if nb == block_first[r]:
+                            head[r] = -1
+                    
+                    block_starts[nb] = current_pos
+                    block_ends[nb] = current_pos + o_len
+                    nb += 1
+                    mismatches = 0
+                    exon_size = 0
+                else: # Continuation of exon, update right side
+                    block_ends[nb-1] = current_pos + o_len
+                
+                exon_size += o_len
+                match_count -= o_len
+                current_pos += o_len
+            elif operator == 3: # Skipped region (N)
+                intron_starts[ni] = current_pos
+                current_pos += o_len
+                intron_ends[ni] = current_pos
+                ni += 1
+                jumped = True
+            elif operator == 2: # Deletion in query
+                current_pos += o_len
+                mismatches += o_len
+            elif operator == 1: # Insertion in query
+                mismatches += o_len
+            
+            while match_count < 0: # Read MD elements up to the current position
+                if m >= m_end:
+                    ran_out[r] = 1
+                    match_count = 0
+                elif is_digit(data[m]):
+                    number = 0
+                    while m < m_end and is_digit(data[m]):
+                        number = number * 10 + data[m] - 48
+                        m += 1
+                    
+                    match_count += number
+                else:
+                    token = m
+                    while m < m_end and not is_digit(data[m]):
+                        m += 1
+                    
+                    if data[token] != 94: # Not a deletion (^)
+                        match_count += 1
+                        mismatches += 1
+            
+            first_element = False
+        
+        if exon_size > 0 and <double>mismatches/exon_size > error_rate: # Last exon didn't pass quality threshold
+            nb -= 1
+            tail[r] = -1
+    
+    block_first[positions.shape[0]] = nb
+    intron_first[positions.shape[0]] = ni
+
+
+cdef class AlignmentColumns:
+    """Columns of a block of SAM records, given as strings without newlines
+    (as from pysam's AlignedSegment.to_string()). The records are joined
+    into one buffer that parse_sam_fields() splits into fields and tags,
+    then compute_blocks() converts the CIGAR and MD strings to mapped
+    blocks and introns, both without the GIL. Per-record Python work is
+    left to the label and flank checks.
+    reference_ids maps each reference name to its index in the BAM header.
+    Missing NH and HI tags are stored as -1. strand_tags holds 1/-1 for an
+    XS tag of +/-, 2/-2 for a ts tag of +/- (relative to the read strand),
+    and 0 otherwise."""
+    cdef readonly bytes data
+    cdef readonly list chroms
+    cdef readonly np.ndarray bounds, flags, ref_ids, nh, hits, errors, strand_tags
+    cdef readonly np.ndarray block_starts, block_ends, block_first, intron_starts, intron_ends, intron_first, head, tail, ran_out
+    cdef np.int64_t[:, :] bounds_v
+    cdef np.int64_t[:] block_starts_v, block_ends_v, block_first_v, intron_starts_v, intron_ends_v, intron_first_v
+    cdef np.int32_t[:] flags_v, ref_ids_v, nh_v, hits_v, errors_v, strand_tags_v, head_v, tail_v
+    cdef np.uint8_t[:] ran_out_v
+    def __init__(self, list sam_lines, dict reference_ids, float error_rate=0.1):
+        cdef Py_ssize_t r, number_of_records, max_rows
+        cdef const unsigned char[:] data_v
+        cdef np.int64_t[:] positions_v
+        cdef double rate = error_rate
+        number_of_records = len(sam_lines)
+        self.data = '\n'.join(sam_lines).encode()
+        data_v = self.data
+        positions = np.zeros(number_of_records, dtype=np.int64)
+        positions_v = positions
+        self.bounds = np.zeros((number_of_records, 10), dtype=np.int64)
+        self.flags = np.zeros(number_of_records, dtype=np.int32)
+        self.nh = np.zeros(number_of_records, dtype=np.int32)
+        self.hits = np.zeros(number_of_records, dtype=np.int32)
+        self.errors = np.zeros(number_of_records, dtype=np.int32)
+        self.strand_tags = np.zeros(number_of_records, dtype=np.int32)
+        self.bounds_v = self.bounds
+        self.flags_v = self.flags
+        self.nh_v = self.nh
+        self.hits_v = self.hits
+        self.errors_v = self.errors
+        self.strand_tags_v = self.strand_tags
+        with nogil:
+            parse_sam_fields(data_v, self.bounds_v, positions_v, self.flags_v, self.nh_v, self.hits_v, self.errors_v, self.strand_tags_v)
+        
+        self.chroms = [self.data[self.bounds_v[r, 2]:self.bounds_v[r, 3]].decode() for r in range(number_of_records)]
+        self.chroms = [None if chrom == '*' else chrom for chrom in self.chroms]
+        self.ref_ids = np.array([reference_ids.get(chrom, -1) for chrom in self.chroms], dtype=np.int32)
+        self.ref_ids_v = self.ref_ids
+        max_rows = max(1, self.data.count(b"M") + self.data.count(b"N")) # At most one block per M and one intron per N
+        self.block_starts = np.zeros(max_rows, dtype=np.int64)
+        self.block_ends = np.zeros(max_rows, dtype=np.int64)
+        self.block_first = np.zeros(number_of_records+1, dtype=np.int64)
+        self.intron_starts = np.zeros(max_rows, dtype=np.int64)
+        self.intron_ends = np.zeros(max_rows, dtype=np.int64)
+        self.intron_first = np.zeros(number_of_records+1, dtype=np.int64)
+        self.head = np.zeros(number_of_records, dtype=np.int32)
+        self.tail = np.zeros(number_of_records, dtype=np.int32)
+        self.ran_out = np.zeros(number_of_records, dtype=np.uint8)
+        self.block_starts_v = self.block_starts
+        self.block_ends_v = self.block_ends
+        self.block_first_v = self.block_first
+        self.intron_starts_v = self.intron_starts
+        self.intron_ends_v = self.intron_ends
+        self.intron_first_v = self.intron_first
+        self.head_v = self.head
+        self.tail_v = self.tail
+        self.ran_out_v = self.ran_out
+        with nogil:
+            compute_blocks(data_v, self.bounds_v, positions_v, rate,
+                self.block_starts_v, self.block_ends_v, self.block_first_v,
+                self.intron_starts_v, self.intron_ends_v, self.intron_first_v,
+                self.head_v, self.tail_v, self.ran_out_v)
+    
+    def __len__(self):
+        return self.bounds.shape[0]
+    
+    cpdef str name(self, Py_ssize_t r):
+        """The read name of record r"""
+        return self.data[self.bounds_v[r, 0]:self.bounds_v[r, 1]].decode()
+    
+    cpdef str seq(self, Py_ssize_t r):
+        """The query sequence of record r, or None if it is not stored ('*')"""
+        cdef str seq = self.data[self.bounds_v[r, 6]:self.bounds_v[r, 7]].decode()
+        return None if seq == '*' else seq
+    
+    cpdef list ranges(self, Py_ssize_t r):
+        """The mapped (left, right) blocks of record r"""
+        cdef Py_ssize_t j
+        return [(self.block_starts_v[j], self.block_ends_v[j]) for j in range(self.block_first_v[r], self.block_first_v[r+1])]
+    
+    cpdef list introns(self, Py_ssize_t r):
+        """The (left, right) skipped regions (N) of record r"""
+        cdef Py_ssize_t j
+        return [(self.intron_starts_v[j], self.intron_ends_v[j]) for j in range(self.intron_first_v[r], self.intron_first_v[r+1])]
+
+
+cpdef AlignmentColumns columns_from_records(list records, float error_rate=0.1):
+    """AlignmentColumns of a list of pysam.AlignedSegment records, read from their SAM text"""
+    return AlignmentColumns([record.to_string() for record in records], {record.reference_name:record.reference_id for record in records}, error_rate)
+
+
 cdef bint is_homopolymer(str string, float threshold=0.8):
     """Returns whether a single character composes > threshold
     of a string."""
@@ -1794,9 +2447,11 @@ cdef (bint, bint, int, int) parse_tag(str string, str tagsplit='_TAG='):
 cdef class BAMobject:
     cdef readonly RNAseqDataset dataset
     cdef readonly list input_lines
+    cdef readonly AlignmentColumns columns
+    cdef readonly int first, group_size
     cdef readonly float error_rate
     cdef readonly bint ignore_ends, secondary, remove_noncanonical
-    def __init__(self, RNAseqDataset dataset, list input_lines, bint ignore_ends=False, bint secondary=False, bint remove_noncanonical=False, float error_rate=0.1):
+    def __init__(self, RNAseqDataset dataset, list input_lines, bint ignore_ends=False, bint secondary=False, bint remove_noncanonical=False, float error_rate=0.1, AlignmentColumns columns=None, int first=0, int group_size=0):
         """Convert a list of pysam.AlignedSegment objects into RNAseqMappings that can be added to an RNAseqDataset.
         Quality control of end labels:
         1) An improperly mapped 5'/3' end of a read should be stripped of its tag
@@ -1804,9 +2459,22 @@ cdef class BAMobject:
         3) End labels that match the genome-templated sequence are false positive trims (requires genome)
         4) False positive oligo-dT priming can occur at genome-templated purine-rich sites (requires genome)
         5) False positive template-switching can occur at matching RNA sites of 3+ nucleotides (requires genome)
+        The records are read through an AlignmentColumns block. If columns is
+        given, input_lines are its rows first to first+len(input_lines) and
+        may be SAM strings rather than pysam objects.
+        input_lines are normally every line with the read ID. If they are
+        only the mates of one alignment, group_size is the number of lines
+        the whole read would have, which sets its weight and mapping number.
         """
         self.dataset = dataset
         self.input_lines = input_lines
+        if columns is None:
+            columns = columns_from_records(input_lines, error_rate)
+            first = 0
+        
+        self.columns = columns
+        self.first = first
+        self.group_size = group_size if group_size > 0 else len(input_lines)
         self.ignore_ends = ignore_ends
         self.secondary = secondary
         self.remove_noncanonical = remove_noncanonical
@@ -1815,7 +2483,7 @@ cdef class BAMobject:
     cpdef list generate_read(self):
         cdef:
             int s_len, s_tag_len, e_len, e_tag_len, Nmap, counter, input_len, map_number, mate, strand, number_of_blocks
-            int i, gap_len, pos, junction_strand, chrom_id, start_pos, end_pos, trim_pos, errors
+            int i, r, gap_len, junction_strand, chrom_id, start_pos, end_pos, trim_pos, errors, flag
             float weight
             str ID, chrom, js, seq, aligned_seq, trimmed_nuc
             (bint, bint, int, int) ID_tags = (False, False, 0, 0)
@@ -1833,7 +2501,7 @@ cdef class BAMobject:
         
         capped = self.dataset.capped
         input_len = len(self.input_lines)
-        weight = float(1)/input_len
+        weight = float(1)/self.group_size
         mappings = {} # Make an empty dict to store each mapping object
         s_len = len(self.dataset.start_array)
         e_len = len(self.dataset.end_array)
@@ -1844,7 +2512,7 @@ cdef class BAMobject:
         if input_len == 0:
             return []
 
-        ID = self.input_lines[0].query_name
+        ID = self.columns.name(self.first)
         if not self.ignore_ends:
             ID_tags = parse_tag(ID)
         
@@ -1864,42 +2532,31 @@ cdef class BAMobject:
             if s_tag or e_tag or stranded_method:
                 stranded = True
             
-            line = self.input_lines[i] # Each line must be a pysam.AlignedSegment
-            if self.should_skip(line): # Line must pass filters
+            r = self.first + i # Row of the line in self.columns
+            flag = self.columns.flags_v[r]
+            if self.should_skip(flag): # Line must pass filters
                 continue
             
-            mate, strand = self.determine_strand(line, stranded)
+            mate, strand = self.determine_strand(flag, stranded)
             if mate == 1:
                 counter += 1
             
-            try:
-                map_number = line.get_tag('HI')
-            except KeyError:
+            map_number = self.columns.hits_v[r]
+            if map_number < 0: # No HI tag
                 map_number = counter
             
-            seq = line.query_sequence
-            pos = line.reference_start
-            chrom_id = line.reference_id
-            try:
-                chrom = line.header.get_reference_name(chrom_id)
-            except:
-                chrom = line.reference_name
-            
-            # Parse the SAM CIGAR string to get mapped positions, splice junction sites, and softclipped positions
-            try:
-                errors = line.get_tag('nM')
-            except KeyError:
-                try:
-                    errors = line.get_tag('NM')
-                except KeyError:
-                    errors = 0
+            seq = self.columns.seq(r)
+            chrom_id = self.columns.ref_ids_v[r]
+            chrom = self.columns.chroms[r]
+            errors = self.columns.errors_v[r]
+            # Mapped positions, splice junction sites, and softclipped positions from the SAM CIGAR string
+            if self.columns.ran_out_v[r]:
+                print("# RAN OUT", file=sys.stderr)
             
-            try:
-                mdstring = line.get_tag('MD')
-            except KeyError:
-                mdstring = str(len(seq))
-            
-            ranges, introns, head, tail = parse_SAM_CIGAR(pos, line.cigartuples, mdstring, self.error_rate)
+            ranges = self.columns.ranges(r)
+            introns = self.columns.introns(r)
+            head = self.columns.head_v[r]
+            tail = self.columns.tail_v[r]
             number_of_blocks = len(ranges)
             if number_of_blocks == 0: # No exons of passing quality were found
                 continue
@@ -1907,7 +2564,7 @@ cdef class BAMobject:
                 alignment_strand = 0
                 splice = []
             else:
-                alignment_strand = self.get_alignment_strand(line, strand)
+                alignment_strand = self.get_alignment_strand(self.columns.strand_tags_v[r], strand)
                 splice = self.get_splice_info(ranges, introns, chrom, alignment_strand, self.remove_noncanonical) # Check which gaps between exon blocks are present in intron blocks
             
             if tail <= 0:
@@ -1925,7 +2582,7 @@ cdef class BAMobject:
             
             # EVALUATE SOFTCLIPPED NUCLEOTIDES
             fiveprime = mate == 1
-            threeprime = (mate == 1 and not line.is_paired) or mate == 2
+            threeprime = (mate == 1 and not flag & 0x1) or mate == 2
             s_tag, e_tag, capped = self.filter_labels_by_softclip_length(s_tag, e_tag, capped, fiveprime, threeprime, strand, head, tail)
             # Check for uuG's (5') or terminal mismatches (3')
             e_tag_added = False
@@ -2015,46 +2672,44 @@ cdef class BAMobject:
         """Given a list of pysam objects, determine
         how many locations in the genome the read (pair) mapped."""
         cdef int Nmap = 0
-        cdef int num_lines = len(self.input_lines)
-        if num_lines > 0: # Process the line(s)
+        cdef int num_lines = self.group_size
+        if len(self.input_lines) > 0: # Process the line(s)
             if num_lines == 1:
                 Nmap = 1
             else: # More than one line, could be multimapper and/or paired
-                line = self.input_lines[0]
-                try:
-                    Nmap = line.get_tag('NH')
-                except KeyError:
-                    if line.is_paired:
+                Nmap = self.columns.nh_v[self.first]
+                if Nmap < 0: # No NH tag
+                    if self.columns.flags_v[self.first] & 0x1:
                         Nmap = int(num_lines*0.5)
                     else:
                         Nmap = num_lines
         
         return Nmap
     
-    cdef (int, int) determine_strand(self, line, bint stranded):
-        """Determine the RNA strand of a pysam object"""
+    cdef (int, int) determine_strand(self, int flag, bint stranded):
+        """Determine the RNA strand of an alignment from its SAM flag"""
         cdef int mate, strand
         mate = 1
         strand = 0
-        if line.is_paired:
-            mate = 1 if line.is_read1 else 2
+        if flag & 0x1: # Paired
+            mate = 1 if flag & 0x40 else 2
         
         if mate == 1: # If stranded, sense w.r.t. RNA
             if stranded:
-                strand = -1 if line.is_reverse else 1
+                strand = -1 if flag & 0x10 else 1
         else:
             if stranded:
-                strand = 1 if line.is_reverse else -1
+                strand = 1 if flag & 0x10 else -1
         
         return mate, strand
     
-    cdef bint should_skip(self, line):
+    cdef bint should_skip(self, int flag):
         """The read should not be processed."""
-        if line.is_unmapped or line.is_supplementary: # Skip unmapped reads and poorly mapped reads
+        if flag & 0x4 or flag & 0x800: # Skip unmapped reads and poorly mapped (supplementary) reads
             return True
-        elif line.is_secondary and not self.secondary: # Unless secondary alignments are allowed, skip these too
+        elif flag & 0x100 and not self.secondary: # Unless secondary alignments are allowed, skip these too
             return True
-        elif line.is_paired and not line.is_proper_pair: # Ignore discordant reads
+        elif flag & 0x1 and not flag & 0x2: # Ignore discordant reads
             return True
         
         return False
@@ -2068,26 +2723,16 @@ cdef class BAMobject:
         
         return False
 
-    cdef int get_alignment_strand(self, line, int strand):
+    cdef int get_alignment_strand(self, int strand_tag, int strand):
         """Returns 1(+), -1(-), or 0(.) if one of the BAM
-        splice tags (XS, ts) contains strand information."""
-        cdef str js
-        cdef int alignment_strand
-        alignment_strand = 0
-        try:
-            js = line.get_tag('XS')
-            if js == '+':
-                alignment_strand = 1
-            elif js == '-':
-                alignment_strand = -1
-        except KeyError:
-            try:
-                js = line.get_tag('ts')
-                alignment_strand = {'+':strand, '-':-strand}[js]
-            except KeyError:
-                alignment_strand = 0
+        splice tags (XS, ts) contains strand information.
+        strand_tag is encoded as in AlignmentColumns."""
+        if strand_tag == 2: # ts:+ is the read's own strand
+            return strand
+        elif strand_tag == -2:
+            return -strand
         
-        return alignment_strand
+        return strand_tag
 
     cdef list get_splice_info(self, list ranges, list introns, str chrom, int alignment_strand, bint remove_noncanonical=False):
         """Returns a list of booleans denoting whether each gap
@@ -2250,16 +2895,21 @@ cdef class BAMobject:
         
         return False
 
-def read_generator(fileconn, RNAseqDataset dataset, str file_type, int max_gap, float minimum_proportion):
+def read_generator(fileconn, RNAseqDataset dataset, str file_type, int max_gap, float minimum_proportion, bint collapse=True):
     """Yields a contiguous chunk of reads from the input file
-    separated on either side by a gaps > max_gap"""
-    cdef RNAseqMapping read, outread
+    separated on either side by a gaps > max_gap.
+    If collapse, identical reads that share a start position
+    are merged into one read with their summed weight."""
+    cdef RNAseqMapping read, outread, identical
     cdef int l, r, old_chrom, old_l, old_r, rightmost, k
     cdef float read_weight, span_weight, current_cov
     cdef set covered_positions
-    cdef list passed_positions
+    cdef list passed_positions, totals
+    cdef dict start_window
     if file_type in ['elr','elr.gz']:
         add_read = dataset.add_read_from_ELR
+    elif file_type == 'elrb':
+        add_read = dataset.add_read_from_columns
     elif file_type == 'bed':
         add_read = dataset.add_read_from_BED
     elif file_type == 'bam' or file_type == 'sam':
@@ -2271,6 +2921,7 @@ def read_generator(fileconn, RNAseqDataset dataset, str file_type, int max_gap,
     old_chrom, old_l, old_r, rightmost, span_start = -1, -1, -1, -1, -1
     current_cov = 0
     span_weight = 0
+    start_window = {} # Reads that begin at old_l, keyed by their identity
     for line in fileconn:
         if type(line) is str:
             if line[0] == '#':
@@ -2287,6 +2938,21 @@ def read_generator(fileconn, RNAseqDataset dataset, str file_type, int max_gap,
         l, r = read.span
         read_weight = read.weight * (r-l)
         current_cov += read.weight
+        if collapse:
+            if read.chrom != old_chrom or l != old_l: # A new start position; reset the window
+                start_window = {}
+            
+            key = read.identity()
+            if key in start_window: # Add the weight to the existing read and discard the duplicate
+                identical, totals = start_window[key]
+                identical.collapse(read, totals)
+                dataset.read_list.pop()
+                end_positions[r] += read.weight
+                span_weight += read_weight
+                continue
+            
+            start_window[key] = (read, [read.weight, read.start_weight(), read.end_weight()])
+        
         if old_chrom == -1: # Uninitialized; add the read and make no other decisions
             span_start = l
             span_length = r - span_start
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import numpy as np
+from bookend.core.block_reader import BlockReader
+from bookend.core.block_writer import BlockWriter
+if __name__ == '__main__':
+    sys.path.append('../../bookend')
+    from argument_parsers import elr_convert_parser as parser
+
+# Binary ELR (.elrb) is a directory of fixed-width column files that
+# can be memory-mapped, plus the metadata needed to rebuild text ELR:
+#   chrom.bin    int32
+#   start.bin    int32
+#   length.bin   int32
+#   strand.bin   int8     1 (+), -1 (-), 0 (.)
+#   cigar.bin    int32    row of cigar.txt
+#   source.bin   int32
+#   weights.bin  float32  (rows x 3) weight, start weight, end weight;
+#                         a negative end weight means the read has none
+#   cigar.txt    one EL_CIGAR string per line
+#   header.json  row count, #C and #S tables, and, if the rows are
+#                sorted, the first row of each chrom (chrom_offsets)
+column_dtypes = [
+    ('chrom', np.int32),
+    ('start', np.int32),
+    ('length', np.int32),
+    ('strand', np.int8),
+    ('cigar', np.int32),
+    ('source', np.int32),
+    ('weights', np.float32)
+]
+strand_values = {'+':1, '-':-1, '.':0}
+strand_symbols = {1:'+', -1:'-', 0:'.'}
+buffer_rows = 65536
+
+def is_binary_elr(filename):
+    return filename.lower().rstrip('/').endswith('.elrb')
+
+def format_row_weights(weight, s_weight, e_weight):
+    """Writes binary weights as an ELR weight column ('w' or 'w|s|e')"""
+    if s_weight < 0 and e_weight < 0:
+        return str(round(weight,2))
+    
+    return '{}|{}|{}'.format(round(weight,2), round(max(0.,s_weight),2), round(max(0.,e_weight),2))
+
+class ELRbinaryWriter:
+    def __init__(self, path):
+        """Writes ELR reads to a binary ELR directory. Reads can be added
+        as ELR text with write(), so the writer can stand in for an output
+        file, or as whole columns with write_columns()."""
+        self.path = path.rstrip('/')
+        if not os.path.exists(self.path):
+            os.mkdir(self.path)
+        
+        self.column_files = {name:open(os.path.join(self.path, '{}.bin'.format(name)), 'wb') for name,dtype in column_dtypes}
+        self.buffers = {name:[] for name,dtype in column_dtypes}
+        self.chroms = {}
+        self.sources = {}
+        self.cigar_ids = {}
+        self.rows = 0
+        self.is_sorted = True
+        self.last_position = (-1, -1)
+    
+    def write(self, string):
+        for line in string.splitlines():
+            if line[0] == '#':
+                header_line = line.rstrip().split(' ')
+                if header_line[0] == '#C':
+                    self.chroms[int(header_line[1])] = header_line[-1]
+                elif header_line[0] == '#S':
+                    self.sources[int(header_line[1])] = header_line[-1]
+                
+                continue
+            
+            chrom, start, length, strand, elcigar, source, weight = line.rstrip().split('\t')
+            if '|' in weight:
+                weights = [float(w) for w in weight.split('|')]
+            else:
+                weights = [float(weight), -1., -1.]
+            
+            self.add_row(int(chrom), int(start), int(length), strand_values[strand], elcigar, int(source), weights)
+    
+    def get_cigar_id(self, elcigar):
+        cigar_id = self.cigar_ids.get(elcigar, None)
+        if cigar_id is None:
+            cigar_id = len(self.cigar_ids)
+            self.cigar_ids[elcigar] = cigar_id
+        
+        return cigar_id
+    
+    def add_row(self, chrom, start, length, strand, elcigar, source, weights):
+        position = (chrom, start)
+        if position < self.last_position:
+            self.is_sorted = False
+        
+        self.last_position = position
+        self.buffers['chrom'].append(chrom)
+        self.buffers['start'].append(start)
+        self.buffers['length'].append(length)
+        self.buffers['strand'].append(strand)
+        self.buffers['cigar'].append(self.get_cigar_id(elcigar))
+        self.buffers['source'].append(source)
+        self.buffers['weights'].append(weights)
+        self.rows += 1
+        if len(self.buffers['chrom']) >= buffer_rows:
+            self.flush()
+    
+    def write_columns(self, chrom, start, length, strand, cigar, cigar_strings, source, weights):
+        """Appends whole columns of reads. cigar indexes into the list cigar_strings."""
+        self.flush()
+        if len(chrom) == 0:
+            return
+        
+        position = (int(chrom[0]), int(start[0]))
+        if position < self.last_position or np.any(np.diff((chrom.astype(np.int64) << 32) | start) < 0):
+            self.is_sorted = False
+        
+        self.last_position = (int(chrom[-1]), int(start[-1]))
+        cigar_map = np.array([self.get_cigar_id(c) for c in cigar_strings], dtype=np.int32)
+        columns = {'chrom':chrom, 'start':start, 'length':length, 'strand':strand, 'cigar':cigar_map[cigar], 'source':source, 'weights':weights}
+        for name, dtype in column_dtypes:
+            np.asarray(columns[name], dtype=dtype).tofile(self.column_files[name])
+        
+        self.rows += len(chrom)
+    
+    def flush(self):
+        if len(self.buffers['chrom']) > 0:
+            for name, dtype in column_dtypes:
+                np.array(self.buffers[name], dtype=dtype).tofile(self.column_files[name])
+                self.buffers[name] = []
+    
+    def tell(self):
+        """Row number of the next read to be written"""
+        return self.rows
+    
+    def close(self):
+        self.flush()
+        for f in self.column_files.values():
+            f.close()
+        
+        cigar_file = open(os.path.join(self.path, 'cigar.txt'), 'w')
+        for elcigar in sorted(self.cigar_ids, key=self.cigar_ids.get):
+            cigar_file.write('{}\n'.format(elcigar))
+        
+        cigar_file.close()
+        chroms = [self.chroms[i] for i in sorted(self.chroms)]
+        chrom_offsets = None
+        if self.is_sorted:
+            chrom_column = np.fromfile(os.path.join(self.path, 'chrom.bin'), dtype=np.int32)
+            chrom_offsets = np.searchsorted(chrom_column, np.arange(len(chroms)+1)).tolist()
+        
+        header = {
+            'rows':self.rows,
+            'chroms':chroms,
+            'sources':[self.sources[i] for i in sorted(self.sources)],
+            'chrom_offsets':chrom_offsets
+        }
+        header_file = open(os.path.join(self.path, 'header.json'), 'w')
+        json.dump(header, header_file)
+        header_file.close()
+
+class ELRbinaryReader:
+    def __init__(self, path):
+        """Memory-maps the columns of a binary ELR directory. Columns are
+        read-only numpy arrays, so slices of them are not copied.
+        Iterating yields the header lines, then one tuple per read in the
+        form taken by RNAseqDataset.add_read_from_columns(). readline()
+        instead returns reads as ELR text, like an open ELR file."""
+        self.path = path.rstrip('/')
+        header_file = open(os.path.join(self.path, 'header.json'), 'r')
+        header = json.load(header_file)
+        header_file.close()
+        self.rows = header['rows']
+        self.chroms = header['chroms']
+        self.sources = header['sources']
+        self.chrom_offsets = header['chrom_offsets']
+        cigar_file = open(os.path.join(self.path, 'cigar.txt'), 'r')
+        self.cigar_strings = [c.rstrip() for c in cigar_file]
+        cigar_file.close()
+        self.columns = {}
+        for name, dtype in column_dtypes:
+            shape = (self.rows, 3) if name == 'weights' else (self.rows,)
+            if self.rows == 0:
+                self.columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(self.path, '{}.bin'.format(name)), dtype=dtype, mode='r', shape=shape)
+        
+        self.text_lines = None
+    
+    def header_lines(self):
+        return ['#C {} {}'.format(i, c) for i,c in enumerate(self.chroms)] + ['#S {} {}'.format(i, s) for i,s in enumerate(self.sources)]
+    
+    def chrom_rows(self, chrom):
+        """Returns the (first, last+1) rows of chrom in a sorted file"""
+        if self.chrom_offsets is None:
+            print("ERROR: chrom offsets are only stored for sorted binary ELR.")
+            sys.exit(1)
+        
+        i = self.chroms.index(chrom)
+        return self.chrom_offsets[i], self.chrom_offsets[i+1]
+    
+    def rows_in_chunks(self, first=0, last=None):
+        """Yields tuples of (chrom, start, length, strand, EL_CIGAR, source, weight, s_weight, e_weight)"""
+        if last is None:
+            last = self.rows
+        
+        for chunk_start in range(first, last, buffer_rows):
+            chunk = slice(chunk_start, min(last, chunk_start + buffer_rows))
+            weights = self.columns['weights'][chunk].tolist()
+            for chrom, start, length, strand, cigar, source, w in zip(
+                self.columns['chrom'][chunk].tolist(), self.columns['start'][chunk].tolist(),
+                self.columns['length'][chunk].tolist(), self.columns['strand'][chunk].tolist(),
+                self.columns['cigar'][chunk].tolist(), self.columns['source'][chunk].tolist(), weights):
+                yield chrom, start, length, strand, self.cigar_strings[cigar], source, w[0], w[1], w[2]
+    
+    def __iter__(self):
+        for line in self.header_lines():
+            yield line
+        
+        for chrom, start, length, strand, elcigar, source, weight, s_weight, e_weight in self.rows_in_chunks():
+            yield (chrom, start, strand, elcigar, source, weight, s_weight, e_weight)
+    
+    def lines(self):
+        """Yields the file as ELR text lines"""
+        for line in self.header_lines():
+            yield line
+        
+        for chrom, start, length, strand, elcigar, source, weight, s_weight, e_weight in self.rows_in_chunks():
+            yield '{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(chrom, start, length, strand_symbols[strand], elcigar, source, format_row_weights(weight, s_weight, e_weight))
+    
+    def seek(self, position):
+        """Rewinds readline() to the start of the file; only position 0 is supported"""
+        self.text_lines = None
+    
+    def readline(self):
+        if self.text_lines is None:
+            self.text_lines = self.lines()
+        
+        return next(self.text_lines, '')
+    
+    def close(self):
+        self.columns = {}
+        self.text_lines = None
+
+class ELRbinaryConverter:
+    def __init__(self, args):
+        """Converts text ELR (.elr, .elr.gz) to binary ELR (.elrb) or back"""
+        self.input = args['INPUT']
+        self.output = args['OUT']
+        self.force = args['FORCE']
+        self.linecount = 0
+        if self.output == '-':
+            self.output = 'stdout'
+        
+        if is_binary_elr(self.input) == is_binary_elr(self.output):
+            print("ERROR: convert between text ELR (.elr, .elr.gz) and binary ELR (.elrb).")
+            sys.exit(1)
+        
+        if self.output != 'stdout' and os.path.exists(self.output) and not self.force:
+            print("ERROR: output file already exists. Use -f/--force to overwrite.")
+            sys.exit(1)
+    
+    def run(self):
+        if self.output != 'stdout':
+            print(self.display_options())
+        
+        if is_binary_elr(self.input):
+            elr_in = ELRbinaryReader(self.input)
+            elr_out = BlockWriter(self.output)
+            for line in elr_in.lines():
+                elr_out.write('{}\n'.format(line))
+                self.linecount += 1
+        else:
+            elr_in = BlockReader(self.input)
+            elr_out = ELRbinaryWriter(self.output)
+            for line in elr_in:
+                elr_out.write(line)
+                self.linecount += 1
+        
+        elr_in.close()
+        elr_out.close()
+        if self.output != 'stdout':
+            print(self.display_summary())
+        return 0
+    
+    def display_options(self):
+        """Returns a string describing all input args"""
+        options_string = "\n/| bookend elr-convert |\\\n¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯\n"
+        options_string += "  Input file:    {}\n".format(self.input)
+        options_string += "  Output file:   {}\n".format(self.output)
+        return options_string
+    
+    def display_summary(self):
+        summary_string = ''
+        summary_string += 'Converted {} lines.\n'.format(self.linecount)
+        return summary_string
+
+
+if __name__ == '__main__':
+    args = vars(parser.parse_args())
+    obj = ELRbinaryConverter(args)
+    sys.exit(obj.run())
@@ -6,30 +6,169 @@ import sys
 import gzip
 import resource
 from math import ceil
+from multiprocessing import Pool
 from bookend.core.cython_utils._rnaseq_utils import RNAseqDataset
 from bookend.core.cython_utils._pq import IndexMinPQ
+from bookend.core.elr_binary import ELRbinaryReader, ELRbinaryWriter, is_binary_elr
+from bookend.core.block_writer import BlockWriter, temp_name, open_elr_output, IndexedELRwriter
 if __name__ == '__main__':
     sys.path.append('../../bookend')
     from argument_parsers import combine_parser as parser
 
+strand_sort_values = {'+':-1, '.':0, '-':1}
+strand_reverse_values = {-1:'+', 0:'.', 1:'-'}
+
+def pack_read_key(chrom, start, length, strand):
+    """Packs (chrom, start, length, strand) into one integer with the
+    same sort order, so reads can be compared with a single int comparison."""
+    return (chrom << 96) | (start << 64) | (length << 2) | (strand + 1)
+
+def unpack_read_key(key):
+    """Converts a key from pack_read_key() back into (chrom, start, length, strand)"""
+    return key >> 96, (key >> 64) & 0xFFFFFFFF, (key >> 2) & 0x3FFFFFFFFFFFFFFF, (key & 3) - 1
+
+def parse_weights(weight_string):
+    """Parses an ELR weight column ('w' or 'w|s|e') as a list of 3 floats"""
+    if '|' in weight_string:
+        return [float(w) for w in weight_string.split('|')]
+    
+    return [float(weight_string), 0., 0.]
+
+def sum_weights(weights1, weights2):
+    """Adds two weights, each either an unparsed ELR weight string
+    or a list of floats, returning a list of 3 floats"""
+    if isinstance(weights1, str):weights1 = parse_weights(weights1)
+    if isinstance(weights2, str):weights2 = parse_weights(weights2)
+    return [weights1[0]+weights2[0], weights1[1]+weights2[1], weights1[2]+weights2[2]]
+
+def format_weights(weights):
+    """Writes summed weights as either 'float' or 'float|float|float'"""
+    if weights[1]==0 and weights[2]==0:
+        return str(round(weights[0],2))
+    
+    return '{}|{}|{}'.format(round(weights[0],2), round(weights[1],2), round(weights[2],2))
+
+class LocusManifest:
+    def __init__(self, filename, max_gap):
+        """Records where sorted ELR output can be cut into independent loci.
+        A cut is made wherever a read starts at least max_gap past the end of
+        every earlier read on its chromosome, the same rule read_generator uses
+        to end a locus, so every cut here is also a cut in read_generator.
+        Each locus is written to filename as a tab-separated line of
+            chrom  offset  first  last  reads  weight
+        where offset is the byte offset of its first read in the output
+        (the virtual offset for block-gzipped output, or the row for binary output)."""
+        self.filename = filename
+        self.max_gap = max_gap
+        self.manifest_file = open(filename, 'w')
+        self.manifest_file.write('#chrom\toffset\tfirst\tlast\treads\tweight\n')
+        self.chrom_names = {}
+        self.bytes_written = 0
+        self.locus = None
+        self.locus_count = 0
+        self.compressed_output = None
+        self.unresolved = [] # Loci whose BGZF offsets are known once the output is flushed
+    
+    def add(self, line, output):
+        """Updates the current locus with an ELR line about to be written to output"""
+        if line[0] == '#':
+            header_line = line.rstrip().split(' ')
+            if header_line[0] == '#C':
+                self.chrom_names[header_line[1]] = header_line[-1]
+        else:
+            chrom, start, length, strand, elcigar, source, weight = line.rstrip().split('\t')
+            start = int(start)
+            end = start + int(length)
+            weight = float(weight.split('|')[0])
+            if self.locus is None or chrom != self.locus[0] or start >= self.locus[3] + self.max_gap:
+                self.write_locus()
+                offset = output.tell() if isinstance(output, (IndexedELRwriter, ELRbinaryWriter)) else self.bytes_written
+                self.locus = [chrom, offset, start, end, 1, weight]
+                if isinstance(output, IndexedELRwriter):
+                    self.compressed_output = output
+            else:
+                if end > self.locus[3]:
+                    self.locus[3] = end
+                
+                self.locus[4] += 1
+                self.locus[5] += weight
+        
+        self.bytes_written += len(line.rstrip()) + 1
+    
+    def write_locus(self):
+        if self.locus is not None:
+            if self.compressed_output is not None:
+                self.unresolved.append(self.locus)
+            else:
+                self.output_locus(self.locus)
+            
+            self.locus_count += 1
+            self.locus = None
+    
+    def output_locus(self, locus):
+        chrom, offset, first, last, reads, weight = locus
+        self.manifest_file.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(self.chrom_names.get(chrom, chrom), offset, first, last, reads, round(weight,2)))
+    
+    def close(self):
+        self.write_locus()
+        if self.compressed_output is not None:
+            self.compressed_output.flush()
+            for locus in self.unresolved:
+                locus[1] = self.compressed_output.resolve(locus[1])
+                self.output_locus(locus)
+        
+        self.manifest_file.close()
+
+def open_elr(filename):
+    """Opens a text, gzipped or binary ELR file for reading lines.
+    A filename of '-' reads standard input."""
+    if filename == '-':
+        return sys.stdin
+    elif is_binary_elr(filename):
+        return ELRbinaryReader(filename)
+    elif filename.lower().endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    
+    return open(filename, 'r')
+
+def merge_group(file_list, tempname):
+    """Merges one group of sorted ELR files into a compressed
+    intermediate run. Runs in a worker process during a tree merge.
+    Returns the number of lines read from file_list."""
+    combiner = ELRcombiner({'INPUT':file_list, 'OUTPUT':'stdout', 'TEMPDIR':None, 'TMPDIR':None, 'THREADS':1, 'FAN_IN':None, 'MANIFEST':None, 'MAX_GAP':0})
+    tempfile = BlockWriter(tempname, level=1)
+    for c in combiner.combine_files(combiner.input, tempfile):pass
+    tempfile.close()
+    return combiner.linecount
+
 class ELRcombiner:
     def __init__(self, args, printargs=False):
         """Leaves together ELR files in sort order"""
-        self.strand_sort_values = {'+':-1, '.':0, '-':1}
-        self.strand_reverse_values = {-1:'+', 0:'.', 1:'-'}
         self.input = args['INPUT']
         self.output = args['OUTPUT']
         self.temp = args['TEMPDIR']
+        if args['TMPDIR'] is not None:
+            self.temp = temp_name(self.temp, args['TMPDIR'])
+        
+        self.threads = max(1, args['THREADS'])
+        self.manifest = None
+        if args['MANIFEST'] is not None:
+            self.manifest = LocusManifest(args['MANIFEST'], args['MAX_GAP'])
+        
         self.write_header = True
+        if self.output == '-':
+            self.output = 'stdout'
+        
         if self.output == 'stdout':
             self.output_file = 'stdout'
         else:
-            self.output_file = open(self.output, 'w')
+            self.output_file = open_elr_output(self.output, self.threads)
         
         self.linecount = 0
         self.readcount = 0
         self.number_of_files = len(self.input)
         self.file_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        self.fan_in = self.file_limit if not args['FAN_IN'] else max(2, min(args['FAN_IN'], self.file_limit))
         self.PQ = IndexMinPQ(self.number_of_files)
         self.dataset = None
         if printargs:print(args)
@@ -41,7 +180,9 @@ class ELRcombiner:
         Returns the first line without a header and keeps
         the file open at the existing buffer position."""
         header = {'chrom':{}, 'source':{}}
-        file.seek(0)
+        if file is not sys.stdin:
+            file.seek(0)
+        
         line = file.readline().rstrip()
         if len(line) == 0:
             return header, line
@@ -57,31 +198,38 @@ class ELRcombiner:
             line = file.readline().rstrip()
         
         return header, line
-
+    
     def read_to_sortable_tuple(self, line, index):
-        """Convert an ELR line into an RNAseqMapping object
-        with shared chrom and source indices."""
+        """Convert an ELR line into a sortable (key, elcigar, source, weight)
+        record with shared chrom and source indices. The weight string is
+        only parsed if the read is collapsed with another."""
         split_line = line.split('\t')
         # Swap index for the merged index value
         chrom = int(self.dataset.chrom_dict[self.file_headers[index]['chrom'][split_line[0]]])
         start = int(split_line[1])
         length = int(split_line[2])
-        strand = self.strand_sort_values[split_line[3]]
+        strand = strand_sort_values[split_line[3]]
         elcigar = split_line[4]
         source = int(self.dataset.source_dict[self.file_headers[index]['source'][split_line[5]]])
         weight = split_line[6]
         self.linecount += 1
-        return (chrom, start, length, strand, elcigar, source, weight)
+        return (pack_read_key(chrom, start, length, strand), elcigar, source, weight)
     
     def sortable_tuple_to_read(self, sortable_tuple):
-        l = list(sortable_tuple)
-        l[3] = self.strand_reverse_values[l[3]]
-        return '\t'.join([str(i) for i in l])
+        key, elcigar, source, weight = sortable_tuple
+        chrom, start, length, strand = unpack_read_key(key)
+        if not isinstance(weight, str):
+            weight = format_weights(weight)
+        
+        return '{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(chrom, start, length, strand_reverse_values[strand], elcigar, source, weight)
     
     def output_line(self, line, output):
         """Takes a list of bed lines and writes
         them to the output stream.
         """
+        if self.manifest is not None:
+            self.manifest.add(line, output)
+        
         if output == 'stdout':
             print(line)
         else:
@@ -95,35 +243,26 @@ class ELRcombiner:
         
         if self.output != 'stdout':
             print(self.display_summary())
+            self.output_file.close()
     
     def combine_files(self, file_list, output, iterator=False):
         file_number = len(file_list)
         temp_list = []
         if file_list is self.input:
-            if not all([i.lower().endswith('.elr') or i.lower().endswith('.elr.gz') for i in self.input]):
+            if not all([i == '-' or i.lower().endswith('.elr') or i.lower().endswith('.elr.gz') or is_binary_elr(i) for i in self.input]):
                 print("\nERROR: all input files must be ELR format.")
                 sys.exit(1)
-        
-            if file_number > self.file_limit:
-                if not os.path.exists(self.temp):
-                    os.mkdir(self.temp)
-                
-                number_of_chunks = ceil(file_number / self.file_limit)
-                for c in range(number_of_chunks):
-                    chunk = file_list[c::number_of_chunks]
-                    tempname = '{}/tmp{}.elr'.format(self.temp,c)
-                    temp_list.append(tempname)
-                    tempfile = open(tempname,'w')
-                    for c in self.combine_files(chunk, tempfile):pass
-                
-                files = [open(f,'r') for f in temp_list]
+            
+            if file_number > self.fan_in:
+                temp_list = self.tree_merge(file_list)
+                files = [gzip.open(f,'rt') for f in temp_list]
             else:
-                files = [open(f,'r') if f.lower().endswith('.elr') else gzip.open(f,'rt') for f in file_list]
+                files = [open_elr(f) for f in file_list]
         elif file_list is None:
             print("\nERROR: requires ELR file as input.")
             sys.exit(1)
         else:
-            files = [open(f) for f in file_list]
+            files = [open_elr(f) for f in file_list]
         
         file_number = len(files)
         self.file_headers = [{}]*file_number
@@ -170,8 +309,8 @@ class ELRcombiner:
             index, item = self.PQ.pop(True)
             if last_item is None:
                 last_item = item
-            elif last_item[:6] == item[:6]: # Items can be collapsed
-                last_item = tuple(list(last_item[:6])+[self.sum_weights(last_item[6],item[6])])
+            elif last_item[:3] == item[:3]: # Items can be collapsed
+                last_item = last_item[:3] + (sum_weights(last_item[3], item[3]),)
             else:
                 # Items can't be collapsed, must output last_item
                 if iterator:
@@ -195,26 +334,49 @@ class ELRcombiner:
             else:
                 self.output_line(self.sortable_tuple_to_read(last_item), output)
         
-        if len(temp_list) > 0: # Clean up temp directory
+        if self.manifest is not None:
+            self.manifest.close()
+        
+        if len(temp_list) > 0: # Report lines of the original inputs, not of the intermediate runs
+            self.linecount = self.input_linecount
             for temp_file in temp_list:
                 os.remove(temp_file)
             
             os.rmdir(self.temp)
     
-    def sum_weights(self, string1, string2):
-        """Adds two weight strings, returning a single string
-        of either 'float' or 'float|float|float'"""
-        w1 = [float(w) for w in string1.split('|')]
-        if len(w1) == 1:w1 += [0, 0]
-        w2 = [float(w) for w in string2.split('|')]
-        if len(w2) == 1:w2 += [0, 0]
-        weights = [w1[0]+w2[0], w1[1]+w2[1], w1[2]+w2[2]]
-        if weights[1]==0 and weights[2]==0:
-            outweight = str(round(weights[0],2))
-        else:
-            outweight = '{}|{}|{}'.format(round(weights[0],2), round(weights[1],2), round(weights[2],2))
+    def tree_merge(self, file_list):
+        """Merges groups of at most fan_in files into compressed runs,
+        then merges those runs again, until at most fan_in runs remain.
+        Groups at each level are merged in parallel if threads > 1.
+        Returns the list of remaining runs. The lines read from
+        file_list in the first level are stored as input_linecount."""
+        if not os.path.exists(self.temp):
+            os.mkdir(self.temp)
         
-        return outweight
+        runs = file_list
+        level = 0
+        while len(runs) > self.fan_in:
+            number_of_groups = ceil(len(runs) / self.fan_in)
+            groups = [runs[g::number_of_groups] for g in range(number_of_groups)]
+            tempnames = ['{}/tmp{}_{}.elr.gz'.format(self.temp, level, g) for g in range(number_of_groups)]
+            if self.threads > 1:
+                pool = Pool(min(self.threads, number_of_groups))
+                linecounts = pool.starmap(merge_group, zip(groups, tempnames))
+                pool.close()
+                pool.join()
+            else:
+                linecounts = [merge_group(group, tempname) for group, tempname in zip(groups, tempnames)]
+            
+            if level == 0:
+                self.input_linecount = sum(linecounts)
+            else: # Intermediate runs from the last level are no longer needed
+                for run in runs:
+                    os.remove(run)
+            
+            runs = tempnames
+            level += 1
+        
+        return runs
     
     def display_options(self):
         """Returns a string describing all input args"""
@@ -222,6 +384,11 @@ class ELRcombiner:
         options_string += "  Input files:     {}\n".format(self.input)
         options_string += "  Output file:    {}\n".format(self.output)
         options_string += "  Temp directory: {}\n".format(self.temp)
+        options_string += "  Threads:        {}\n".format(self.threads)
+        options_string += "  Merge fan-in:   {}\n".format(self.fan_in)
+        if self.manifest is not None:
+            options_string += "  Locus manifest: {}\n".format(self.manifest.filename)
+        
         return options_string
     
     def display_summary(self):
@@ -4,10 +4,10 @@
 import sys
 import time
 import os
-import gzip
 import bookend.core.cython_utils._rnaseq_utils as ru
 from bookend.core.cython_utils._assembly_utils import Locus
-from bookend.core.elr_sort import ELRsorter
+from bookend.core.elr_sort import ELRsorter, open_sorted_input
+from bookend.core.block_writer import BlockWriter, temp_name
 
 if __name__ == '__main__':
     sys.path.append('../../bookend')
@@ -31,19 +31,22 @@ class Condenser:
         self.starts = args['STARTS']
         self.ends = args['ENDS']
         self.sparse = args['SPARSE']
+        self.tmpdir = args['TMPDIR']
         if self.output is None:
-            self.output = self.input.replace('.elr', '.cond.elr')
-            if '.cond.elr' not in self.output:
-                self.output = self.output+'.cond.elr'
+            if self.input == '-':
+                self.output = 'stdout'
+            else:
+                self.output = self.input.replace('.elr', '.cond.elr')
+                if '.cond.elr' not in self.output:
+                    self.output = self.output+'.cond.elr'
+        elif self.output == '-':
+            self.output = 'stdout'
         
         self.antisense_filter = 0.001
-        if self.input_is_valid(self.input):
-            self.file_type = self.file_extension(self.input)
+        if self.input == '-' or self.input_is_valid(self.input):
+            self.file_type = 'elr' if self.input == '-' else self.file_extension(self.input)
             self.dataset = ru.RNAseqDataset()
-            if self.file_type == 'elr.gz':
-                self.input_file = gzip.open(self.input, 'rt')
-            else:
-                self.input_file = open(self.input, 'r')
+            self.input_file, self.file_type = open_sorted_input(self.input, self.file_type, self.tmpdir)
         else:
             print("\nERROR: input file must be a valid format (ELR, BED).")
             sys.exit(1)
@@ -53,15 +56,16 @@ class Condenser:
         self.chunk_counter = 0
         self.transcripts_written = 0
         self.bases_used = 0
-        self.output_temp = open(self.output+'.tmp', 'w')
+        self.output_temp_name = temp_name(self.output, self.tmpdir, suffix='.tmp')
+        self.output_temp = BlockWriter(self.output_temp_name)
         if printargs:print(args)
         #self.output_file = open(self.output,'w')
     
     def sort_output(self):
         self.output_temp.close()
-        sorter = ELRsorter({'INPUT':self.output+'.tmp','OUT':self.output,'FORCE':True})
+        sorter = ELRsorter({'INPUT':self.output_temp_name,'OUT':self.output,'FORCE':True,'TMPDIR':self.tmpdir,'THREADS':1,'MEMORY':'2G','MANIFEST':None,'MAX_GAP':0})
         sorter.run()
-        os.remove(self.output+'.tmp')
+        os.remove(self.output_temp_name)
     
     def output_transcripts(self, transcript, printout=False):
         """Writes the RNAseqMapping object 'transcript' to an output stream,
@@ -74,7 +78,7 @@ class Condenser:
     
     def dump_starts(self, locus):
         start_groups = []
-        donors = [int(j.split(':')[0]) for j in locus.J_plus]
+        donors = [ru.key_to_span(j)[0] for j in locus.J_plus]
         for end_range in locus.end_ranges[0]: # Start Plus
             capped = self.cap_filter <= end_range.capped/end_range.weight
             right = min([d for d in donors if d >= end_range.right]+[locus.rightmost-locus.leftmost, end_range.right+max(locus.extend,self.minlen)])
@@ -82,7 +86,7 @@ class Condenser:
                 locus.chrom, 0, end_range.strand, [(end_range.peak+locus.leftmost, right+locus.leftmost)], [], True, False, capped, end_range.weight, False
             )))
         
-        donors = [int(j.split(':')[1]) for j in locus.J_minus]
+        donors = [ru.key_to_span(j)[1] for j in locus.J_minus]
         for end_range in locus.end_ranges[2]: # Start Minus
             capped = self.cap_filter <= end_range.capped/end_range.weight
             left = max([d+1 for d in donors if d < end_range.left]+[0, end_range.left-max(locus.extend,self.minlen)])
@@ -94,14 +98,14 @@ class Condenser:
     
     def dump_ends(self, locus):
         end_groups = []
-        acceptors = [int(j.split(':')[1]) for j in locus.J_plus]
+        acceptors = [ru.key_to_span(j)[1] for j in locus.J_plus]
         for end_range in locus.end_ranges[1]: # End Plus
             left = max([a+1 for a in acceptors if a < end_range.left]+[0, end_range.left-max(locus.extend,self.minlen)])
             end_groups.append(ru.RNAseqMapping(ru.ELdata(
                 locus.chrom, 0, end_range.strand, [(left+locus.leftmost, end_range.peak+1+locus.leftmost)], [], False, True, False, end_range.weight, False
             )))
         
-        acceptors = [int(j.split(':')[0]) for j in locus.J_minus]
+        acceptors = [ru.key_to_span(j)[0] for j in locus.J_minus]
         for end_range in locus.end_ranges[3]: # End Minus
             right = min([a for a in acceptors if a >= end_range.right]+[locus.rightmost-locus.leftmost, end_range.right+max(locus.extend,self.minlen)])
             end_groups.append(ru.RNAseqMapping(ru.ELdata(
@@ -195,7 +199,7 @@ class Condenser:
         else:
             return split_name[-1].lower()
     
-    def input_is_valid(self, filename, valid_formats=['elr', 'bed', 'elr.gz']):
+    def input_is_valid(self, filename, valid_formats=['elr', 'bed', 'elr.gz', 'elrb']):
         """Boolean if the file is a format that Assembler can parse."""
         if self.file_extension(filename) in valid_formats:
             return True
@@ -214,7 +218,9 @@ class Condenser:
     
     def run(self):
         """Executes end labeling on all reads."""
-        print(self.display_options())
+        if self.output != 'stdout':
+            print(self.display_options())
+        
         wrote_header = self.output_type == 'gtf'
         for locus in self.generator:
             if not wrote_header:
@@ -225,7 +231,8 @@ class Condenser:
         
         self.sort_output()
         self.end_time = time.time()
-        print(self.display_summary())
+        if self.output != 'stdout':
+            print(self.display_summary())
 
 if __name__ == '__main__':
     from argument_parsers import condense_parser as parser
@@ -3,7 +3,294 @@
 
 import sys
 import os
-from bookend.core.elr_combine import ELRcombiner
+import numpy as np
+from multiprocessing import Pool
+from bookend.core.block_writer import BlockWriter, is_stream, temp_name, open_elr_output
+from bookend.core.block_reader import BlockReader
+from bookend.core.elr_binary import ELRbinaryReader, ELRbinaryWriter, is_binary_elr
+from bookend.core.elr_combine import ELRcombiner, LocusManifest, parse_weights, format_weights, strand_sort_values, strand_reverse_values
+
+guard_memory = '2G' # Memory budget of SortedInput when it has to sort
+
+def parse_memory(memory):
+    """Converts a memory string with an optional K/M/G/T suffix to a number of bytes."""
+    multipliers = {'K':1024, 'M':1024**2, 'G':1024**3, 'T':1024**4}
+    memory = str(memory).strip().upper().rstrip('B')
+    try:
+        if memory[-1] in multipliers:
+            return int(float(memory[:-1]) * multipliers[memory[-1]])
+        
+        return int(float(memory))
+    except (ValueError, IndexError):
+        print("ERROR: could not parse memory value '{}'. Use a number of bytes or a K/M/G suffix (e.g. 8G).".format(memory))
+        sys.exit(1)
+
+def encode_lines(lines):
+    """Encodes ELR lines as compact sortable columns:
+        position: int64 chrom<<32 | start
+        shape:    int64 length<<2 | strand
+        cigar:    int32 id into a lexicographically sorted list of unique EL_CIGAR strings
+        source:   int32
+        weights:  float32 (n x 3) weight, start weight, end weight
+    Returns (position, shape, cigar, cigar_strings, source, weights)."""
+    columns = list(zip(*[line.rstrip().split('\t') for line in lines]))
+    position = (np.array(columns[0], dtype=np.int64) << 32) | np.array(columns[1], dtype=np.int64)
+    shape = (np.array(columns[2], dtype=np.int64) << 2) | np.array([strand_sort_values[s]+1 for s in columns[3]], dtype=np.int64)
+    cigar_strings = sorted(set(columns[4]))
+    cigar_index = {c:i for i,c in enumerate(cigar_strings)}
+    cigar = np.array([cigar_index[c] for c in columns[4]], dtype=np.int32)
+    source = np.array(columns[5], dtype=np.int32)
+    weights = np.array([parse_weights(w) for w in columns[6]], dtype=np.float32)
+    return position, shape, cigar, cigar_strings, source, weights
+
+def encode_binary(reader):
+    """Encodes the memory-mapped columns of a binary ELR file in the
+    same form as encode_lines(). Missing end weights are encoded as 0."""
+    columns = reader.columns
+    position = (columns['chrom'].astype(np.int64) << 32) | columns['start']
+    shape = (columns['length'].astype(np.int64) << 2) | (1 - columns['strand'].astype(np.int64))
+    cigar_strings = sorted(reader.cigar_strings)
+    cigar_rank = np.zeros(len(cigar_strings), dtype=np.int32)
+    cigar_rank[sorted(range(len(cigar_strings)), key=reader.cigar_strings.__getitem__)] = np.arange(len(cigar_strings), dtype=np.int32)
+    cigar = cigar_rank[columns['cigar']]
+    source = np.array(columns['source'], dtype=np.int32)
+    weights = np.maximum(columns['weights'], 0)
+    return position, shape, cigar, cigar_strings, source, weights
+
+def collapse_sorted(position, shape, cigar, source, weights):
+    """Sorts encoded columns and sums the weights of identical reads.
+    Returns the sorted unique (position, shape, cigar, source, weights)."""
+    order = np.lexsort((source, cigar, shape, position))
+    position, shape, cigar, source, weights = position[order], shape[order], cigar[order], source[order], weights[order]
+    first = np.ones(order.shape[0], dtype=bool)
+    first[1:] = (position[1:] != position[:-1]) | (shape[1:] != shape[:-1]) | (cigar[1:] != cigar[:-1]) | (source[1:] != source[:-1])
+    starts = np.where(first)[0]
+    summed = np.add.reduceat(weights.astype(np.float64), starts, axis=0)
+    return position[starts], shape[starts], cigar[starts], source[starts], summed
+
+def format_lines(position, shape, cigar, cigar_strings, source, weights):
+    """Yields ELR lines from encoded columns"""
+    for p, sh, c, src, w in zip(position.tolist(), shape.tolist(), cigar.tolist(), source.tolist(), weights.tolist()):
+        yield '{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(
+            p >> 32, p & 0xFFFFFFFF, sh >> 2,
+            strand_reverse_values[(sh & 3) - 1],
+            cigar_strings[c], src, format_weights(w)
+        )
+
+def sorted_lines(lines):
+    """Yields ELR lines in ascending order, collapsing any identical
+    reads into a single line with increased weight."""
+    if len(lines) == 0:
+        return
+    
+    position, shape, cigar, cigar_strings, source, weights = encode_lines(lines)
+    position, shape, cigar, source, weights = collapse_sorted(position, shape, cigar, source, weights)
+    for line in format_lines(position, shape, cigar, cigar_strings, source, weights):
+        yield line
+
+def sort_chunk(lines, header, tmpname):
+    """Sorts a list of ELR lines and writes them to a compressed
+    temp file. Runs in a worker process; returns the lines written."""
+    outlinecount = 0
+    tmpfile = BlockWriter(tmpname, level=1)
+    tmpfile.write(header)
+    for line in sorted_lines(lines):
+        tmpfile.write('{}\n'.format(line))
+        outlinecount += 1
+    
+    tmpfile.close()
+    return outlinecount
+
+def sorted_binary_lines(reader):
+    """Yields the header and reads of a binary ELR file that was not
+    written in order as ELR lines, sorting the reads in memory."""
+    header = reader.header_lines()
+    position, shape, cigar, cigar_strings, source, weights = encode_binary(reader)
+    position, shape, cigar, source, weights = collapse_sorted(position, shape, cigar, source, weights)
+    reader.close()
+    for header_line in header:
+        yield header_line
+    
+    for line in format_lines(position, shape, cigar, cigar_strings, source, weights):
+        yield line
+
+def open_sorted_input(filename, file_type, tmpdir=None):
+    """Opens an ELR input for read_generator(), which requires reads in
+    sort order. Returns (input_file, file_type). Text ELR is checked
+    before it is passed on and sorted if it is out of order; binary ELR
+    that was not written in order is sorted in memory and read as text
+    lines. A filename of '-' reads ELR from standard input."""
+    if file_type == 'elrb':
+        reader = ELRbinaryReader(filename)
+        if reader.chrom_offsets is not None:
+            return reader, file_type
+        
+        print('Input is not sorted; sorting {} reads in memory.'.format(reader.rows), file=sys.stderr)
+        return sorted_binary_lines(reader), 'elr'
+    elif file_type in ['elr', 'elr.gz']:
+        reopen = None if is_stream(filename) else BlockReader
+        return SortedInput(BlockReader(filename), filename, tmpdir, reopen=reopen), file_type
+    
+    return BlockReader(filename), file_type
+
+class SortedInput:
+    def __init__(self, elr_lines, name, tmpdir=None, memory=guard_memory, reopen=None):
+        """Iterates over the lines of an ELR input in sort order.
+        The whole input is checked before any read is passed on: it is in
+        order if no chrom is revisited and starts never decrease within a
+        chrom. Input in order is streamed unchanged; otherwise it is sorted
+        like elr-sort, in memory or as temp runs merged by ELRcombiner,
+        without writing a sorted copy of the whole file. Input larger than
+        one chunk is read again with reopen(name) once it has been checked,
+        or, if reopen is None (e.g. standard input), spooled to a temp run
+        while it is checked. Temp runs are written beside name or in tmpdir."""
+        self.elr_lines = elr_lines
+        self.name = name
+        self.tmpdir = tmpdir
+        self.reopen = reopen
+        self.chunk_bytes = max(1, parse_memory(memory) // 16) # As ELRsorter with one thread
+        self.header = ''
+        self.tmpcount = 0
+        self.spool = None
+        self.chrom = None
+        self.start = -1
+        self.seen_chroms = set()
+    
+    def tmpname(self, i):
+        return temp_name(self.name, self.tmpdir, suffix='.sorttmp{}.elr.gz'.format(i))
+    
+    def in_order(self, line):
+        """Returns False if line is out of order with the lines before it"""
+        chrom, start = line.split('\t', 2)[:2]
+        start = int(start)
+        if chrom != self.chrom:
+            if chrom in self.seen_chroms:
+                return False
+            
+            self.seen_chroms.add(chrom)
+            self.chrom = chrom
+        elif start < self.start:
+            return False
+        
+        self.start = start
+        return True
+    
+    def read_again(self):
+        """Closes the input and returns its reads from the beginning"""
+        self.close()
+        self.elr_lines = self.reopen(self.name)
+        return (line for line in self.elr_lines if line[0] != '#')
+    
+    def __iter__(self):
+        lines = iter(self.elr_lines)
+        chunk = []
+        buffered_bytes = 0
+        is_sorted = True
+        overflowed = False
+        for line in lines:
+            if line[0] == '#':
+                self.header += '{}\n'.format(line.rstrip())
+                continue
+            
+            chunk.append(line)
+            buffered_bytes += len(line)
+            if not self.in_order(line):
+                is_sorted = False
+                break
+            
+            if buffered_bytes >= self.chunk_bytes:
+                overflowed = True
+                self.spool_chunk(chunk)
+                chunk = []
+                buffered_bytes = 0
+        
+        if is_sorted:
+            for header_line in self.header.splitlines():
+                yield header_line
+            
+            if overflowed and self.reopen is not None:
+                chunk = self.read_again()
+            elif overflowed:
+                self.spool.close()
+                spooled = BlockReader(self.tmpname(0))
+                for line in spooled:
+                    if line[0] != '#':
+                        yield line
+                
+                spooled.close()
+                os.remove(self.tmpname(0))
+            
+            for line in chunk:
+                yield line
+            
+            return
+        
+        print('Input is not sorted; sorting reads before processing.', file=sys.stderr)
+        if overflowed and self.reopen is not None: # Start over, since the reads checked so far were not kept
+            lines = self.read_again()
+            chunk = []
+            buffered_bytes = 0
+        elif overflowed: # The reads spooled so far are in order, so they form the first run
+            self.spool.close()
+            self.tmpcount = 1
+        
+        for line in lines:
+            if buffered_bytes >= self.chunk_bytes:
+                self.spill_chunk(chunk)
+                chunk = []
+                buffered_bytes = 0
+            
+            chunk.append(line)
+            buffered_bytes += len(line)
+        
+        if self.tmpcount == 0: # The whole input fit in one chunk
+            for header_line in self.header.splitlines():
+                yield header_line
+            
+            for line in sorted_lines(chunk):
+                yield line
+            
+            return
+        
+        self.spill_chunk(chunk)
+        combine_args = {
+            'INPUT':[self.tmpname(i) for i in range(self.tmpcount)],
+            'OUTPUT':'stdout',
+            'TEMPDIR':temp_name(self.name, self.tmpdir, suffix='_combinetmp'),
+            'TMPDIR':None,
+            'THREADS':1,
+            'FAN_IN':None,
+            'MANIFEST':None,
+            'MAX_GAP':0
+        }
+        combiner = ELRcombiner(combine_args)
+        for line in combiner.combine_files(combiner.input, combiner.output_file, iterator=True):
+            yield line
+        
+        for i in range(self.tmpcount):
+            os.remove(self.tmpname(i))
+    
+    def spool_chunk(self, chunk):
+        """Appends reads that are in order to the first temp run,
+        unless the input can be read again instead."""
+        if self.reopen is not None:
+            return
+        
+        if self.spool is None:
+            self.spool = BlockWriter(self.tmpname(0), level=1)
+            self.spool.write(self.header)
+        
+        for line in chunk:
+            self.spool.write('{}\n'.format(line.rstrip()))
+    
+    def spill_chunk(self, chunk):
+        if len(chunk) > 0:
+            sort_chunk(chunk, self.header, self.tmpname(self.tmpcount))
+            self.tmpcount += 1
+    
+    def close(self):
+        if hasattr(self.elr_lines, 'close'):
+            self.elr_lines.close()
 
 class ELRsorter:
     def __init__(self, args):
@@ -11,130 +298,171 @@ class ELRsorter:
         self.input = args['INPUT']
         self.output = args['OUT']
         self.force = args['FORCE']
-        self.strand_sort_values = {'+':-1, '.':0, '-':1}
-        self.strand_reverse_values = {-1:'+', 0:'.', 1:'-'}
-        self.read_tuples = []
-        self.sortsize = 5000000
+        self.tmpdir = args['TMPDIR']
+        self.threads = max(1, args['THREADS'])
+        self.memory = args['MEMORY']
+        self.manifest_path = args['MANIFEST']
+        self.max_gap = args['MAX_GAP']
+        self.manifest = None
+        self.read_lines = []
+        # Splitting lines into columns takes roughly 8x the space of the raw
+        # text, and up to threads+1 chunks (one per worker, one buffering) are in memory.
+        self.chunk_bytes = max(1, parse_memory(self.memory) // (self.threads+1) // 8)
+        self.buffered_bytes = 0
         self.linecount = 0
         self.outlinecount = 0
         self.tmpcount = 0
         self.header = ''
+        self.pool = None
+        self.sorted_columns = None
+        self.pending = []
+        if self.output == '-':
+            self.output = 'stdout'
+        
         if self.output == 'stdout':
             self.output_file = 'stdout'
         else:
             if self.force or not os.path.exists(self.output):
-                self.output_file = open(self.output,'w')
+                self.output_file = open_elr_output(self.output, self.threads)
             else:
                 print("ERROR: output file already exists. Use -f/--force to overwrite.")
                 sys.exit(1)
-
+    
     def run(self):
         if self.output != 'stdout' and __name__ == '__main__':
             print(self.display_options())
         
-        self.process_input()
+        if is_binary_elr(self.input):
+            self.sort_binary()
+        else:
+            self.process_input()
+        
+        self.finish()
+    
+    def finish(self):
+        """Writes all reads added so far to output in sort order"""
+        if self.tmpcount > 0 and len(self.read_lines) > 0:
+            self.spill_chunk()
+        
+        if self.pool is not None:
+            for result in self.pending:
+                self.outlinecount += result.get()
+            
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        
         if self.tmpcount > 0:
             if self.output != 'stdout':
                 print('Combining sorted reads from {} files.'.format(self.tmpcount))
             
             combine_args = {
-                'INPUT':['{}.tmp{}.elr'.format(self.input,i) for i in range(self.tmpcount)],
+                'INPUT':[self.tmpname(i) for i in range(self.tmpcount)],
                 'OUTPUT':'stdout',
-                'TEMPDIR':'{}_combinetmp'.format(self.input)
+                'TEMPDIR':temp_name(self.input, self.tmpdir, suffix='_combinetmp'),
+                'TMPDIR':None,
+                'THREADS':self.threads,
+                'FAN_IN':None,
+                'MANIFEST':self.manifest_path,
+                'MAX_GAP':self.max_gap
             }
             combiner = ELRcombiner(combine_args)
             for c in combiner.combine_files(combiner.input, self.output_file):pass
             
             for i in range(self.tmpcount):
-                os.remove('{}.tmp{}.elr'.format(self.input,i))
-        else:
+                os.remove(self.tmpname(i))
+        else: # The combiner writes its own header; only write it when sorting in memory
+            if self.manifest_path is not None:
+                self.manifest = LocusManifest(self.manifest_path, self.max_gap)
+            
+            for header_line in self.header.splitlines():
+                self.output_line(header_line)
+            
             self.dump_sorted_reads()
+            if self.manifest is not None:
+                self.manifest.close()
         
         if self.output != 'stdout':
             print(self.display_summary())
             self.output_file.close()
     
+    def tmpname(self, i):
+        return temp_name(self.input, self.tmpdir, suffix='.tmp{}.elr.gz'.format(i))
+    
     def process_input(self):
-        """Yield a BED line from each line of a ELR input."""
-        elr_in = open(self.input, 'r')
+        """Buffers ELR lines until the memory budget for one chunk is
+        reached, then sorts the chunk into a compressed temp file."""
+        elr_in = BlockReader(self.input)
         for elr_line in elr_in:
-            if elr_line[0] == '#':
-                self.header += elr_line
-                self.output_line(elr_line.rstrip())
-                continue
+            self.add_line(elr_line)
+        
+        elr_in.close()
+    
+    def add_line(self, elr_line):
+        """Adds one ELR line (header or read) to the sort buffer. Other
+        converters can push their reads here directly instead of writing
+        an unsorted file first; finish() then writes the sorted output."""
+        if elr_line[0] == '#':
+            self.header += '{}\n'.format(elr_line.rstrip())
+            return
+        
+        self.read_lines.append(elr_line)
+        self.linecount += 1
+        self.buffered_bytes += len(elr_line)
+        if self.buffered_bytes >= self.chunk_bytes:
+            self.spill_chunk()
+    
+    def add_lines(self, elr_lines):
+        for elr_line in elr_lines:
+            self.add_line(elr_line)
+    
+    def spill_chunk(self):
+        """Sorts the buffered lines into the next temp file. With more than
+        one thread, chunks are sorted by a pool of worker processes while
+        the next chunk is read; at most one chunk per worker is in flight."""
+        if self.threads > 1:
+            if self.pool is None:
+                self.pool = Pool(self.threads)
             
-            self.add_read_tuple(elr_line)
-            self.linecount += 1
-            if self.linecount >= self.sortsize:
-                self.linecount = 0
-                tmpfile = open('{}.tmp{}.elr'.format(self.input,self.tmpcount),'w')
-                tmpfile.write(self.header)
-                self.dump_sorted_reads(tmpfile)
-                tmpfile.close()
-                self.tmpcount += 1
+            while len(self.pending) >= self.threads:
+                self.outlinecount += self.pending.pop(0).get()
             
-        if self.tmpcount > 0:
-            tmpfile = open('{}.tmp{}.elr'.format(self.input,self.tmpcount),'w')
-            tmpfile.write(self.header)
-            self.dump_sorted_reads(tmpfile)
-            tmpfile.close()
-            self.tmpcount += 1
+            self.pending.append(self.pool.apply_async(sort_chunk, (self.read_lines, self.header, self.tmpname(self.tmpcount))))
+        else:
+            self.outlinecount += sort_chunk(self.read_lines, self.header, self.tmpname(self.tmpcount))
+        
+        self.read_lines = []
+        self.buffered_bytes = 0
+        self.tmpcount += 1
+    
+    def sort_binary(self):
+        """Sorts and collapses all reads of a binary ELR input in memory.
+        Columns are read directly from the memory-mapped file."""
+        reader = ELRbinaryReader(self.input)
+        self.header = ''.join(['{}\n'.format(h) for h in reader.header_lines()])
+        self.linecount = reader.rows
+        position, shape, cigar, self.cigar_strings, source, weights = encode_binary(reader)
+        self.sorted_columns = collapse_sorted(position, shape, cigar, source, weights)
+        reader.close()
     
     def dump_sorted_reads(self, tmpfile=None):
         """Writes sorted reads to output, collapsing
         any identical reads into a single line with increased weight"""
-        self.read_tuples.sort(reverse=True)
-        if len(self.read_tuples) > 0:
-            read_tuple = self.read_tuples.pop()
-            weights = [float(w) for w in read_tuple[6].split('|')]
-            if len(weights) == 1:
-                weights += [0, 0]
-            
-            while self.read_tuples:
-                next_tuple = self.read_tuples.pop()
-                if next_tuple[:6] == read_tuple[:6]:
-                    new_weights = [float(w) for w in read_tuple[6].split('|')]
-                    if len(new_weights) == 1:
-                        new_weights += [0, 0]
-                    
-                    weights = [weights[0]+new_weights[0], weights[1]+new_weights[1], weights[2]+new_weights[2]]
-                    continue
-                else:
-                    if weights[1]==0 and weights[2]==0:
-                        outweight = str(round(weights[0],2))
-                    else:
-                        outweight = '{}|{}|{}'.format(round(weights[0],2), round(weights[1],2), round(weights[2],2))
-                    
-                    line = '{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(
-                        read_tuple[0],read_tuple[1],read_tuple[2],
-                        self.strand_reverse_values[read_tuple[3]],
-                        read_tuple[4],read_tuple[5],outweight
-                    )
-                    self.output_line(line, tmpfile)
-                    self.outlinecount += 1
-                    read_tuple = next_tuple
-                    weights = [float(w) for w in read_tuple[6].split('|')]
-                    if len(weights) == 1:
-                        weights += [0, 0]
-            
-            if weights[1]==0 and weights[2]==0:
-                outweight = str(round(weights[0],2))
-            else:
-                outweight = '{}|{}|{}'.format(round(weights[0],2), round(weights[1],2), round(weights[2],2))
-
-            line = '{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(
-                read_tuple[0],read_tuple[1],read_tuple[2],
-                self.strand_reverse_values[read_tuple[3]],
-                read_tuple[4],read_tuple[5],outweight
-            )
+        if self.sorted_columns is not None:
+            position, shape, cigar, source, weights = self.sorted_columns
+            if isinstance(self.output_file, ELRbinaryWriter) and self.manifest is None: # Write columns without rounding weights
+                weights[(weights[:,1] == 0) & (weights[:,2] == 0), 1:] = -1
+                self.output_file.write_columns(position >> 32, position & 0xFFFFFFFF, shape >> 2, 1 - (shape & 3), cigar, self.cigar_strings, source, weights)
+                self.outlinecount += len(position)
+                return
+            
+            lines = format_lines(position, shape, cigar, self.cigar_strings, source, weights)
+        else:
+            lines = sorted_lines(self.read_lines)
+        
+        for line in lines:
             self.output_line(line, tmpfile)
             self.outlinecount += 1
-
-    def add_read_tuple(self, elr_line):
-        l = elr_line.rstrip().split('\t')
-        # parse the line as a tuple of sortable values
-        read_tuple = (int(l[0]), int(l[1]), int(l[2]), self.strand_sort_values[l[3]], l[4], int(l[5]), l[6])
-        self.read_tuples.append(read_tuple)
     
     def output_line(self, line, tmpfile=None):
         """Takes a list of bed lines and writes
@@ -143,6 +471,9 @@ class ELRsorter:
         if tmpfile is not None:
             tmpfile.write('{}\n'.format(line.rstrip()))
         else:
+            if self.manifest is not None:
+                self.manifest.add(line, self.output_file)
+            
             if self.output_file == 'stdout':
                 print(line)
             else:
@@ -153,11 +484,18 @@ class ELRsorter:
         options_string = "\n/| bookend sort-elr |\\\n¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯\n"
         options_string += "  Input file:    {}\n".format(self.input)
         options_string += "  Output file:   {}\n".format(self.output)
+        options_string += "  Threads:       {}\n".format(self.threads)
+        options_string += "  Memory:        {}\n".format(self.memory)
+        if self.tmpdir is not None:
+            options_string += "  Temp dir:      {}\n".format(self.tmpdir)
+        if self.manifest_path is not None:
+            options_string += "  Manifest:      {}\n".format(self.manifest_path)
+        
         return options_string
     
     def display_summary(self):
         summary_string = ''
-        summary_string += 'Processed {} lines.\n'.format((self.tmpcount*1000000)+self.linecount)
+        summary_string += 'Processed {} lines.\n'.format(self.linecount)
         summary_string += 'Wrote {} sorted unique reads.\n'.format(self.outlinecount)
         return summary_string
 
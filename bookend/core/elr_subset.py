@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+from bisect import bisect_right
+from pysam.libcbgzf import BGZFile
+from bookend.core.block_writer import open_elr_output, index_name, index_is_current
+if __name__ == '__main__':
+    sys.path.append('../../bookend')
+    from argument_parsers import elr_subset_parser as parser
+
+class ELRsubsetter:
+    def __init__(self, args):
+        """Writes all reads from an ELR file that overlap a genomic region.
+        Block-gzipped input with an index is read by seeking directly to
+        the region; any other ELR input is scanned from the beginning."""
+        self.input = args['INPUT']
+        self.output = args['OUT']
+        self.force = args['FORCE']
+        self.region = args['REGION']
+        self.chrom, self.start, self.end = self.parse_region(self.region)
+        self.indexed = self.input != '-' and index_is_current(self.input)
+        self.linecount = 0
+        self.outlinecount = 0
+        if self.output == '-':
+            self.output = 'stdout'
+        
+        if self.output == 'stdout':
+            self.output_file = 'stdout'
+        else:
+            if self.force or not os.path.exists(self.output):
+                self.output_file = open_elr_output(self.output)
+            else:
+                print("ERROR: output file already exists. Use -f/--force to overwrite.")
+                sys.exit(1)
+    
+    def parse_region(self, region):
+        """Converts 'chrom:start-end' (1-based, inclusive) or 'chrom'
+        to (chrom, start, end) as a 0-based half-open interval."""
+        chrom, _, span = region.rpartition(':')
+        if chrom == '':
+            return span, 0, float('inf')
+        
+        try:
+            start, end = span.replace(',', '').split('-')
+            return chrom, int(start) - 1, int(end)
+        except ValueError:
+            print("ERROR: could not parse region '{}'. Use the format chrom:start-end.".format(region))
+            sys.exit(1)
+    
+    def run(self):
+        if self.output != 'stdout':
+            print(self.display_options())
+        
+        if not (self.input == '-' or self.input.lower().endswith('.elr') or self.input.lower().endswith('.elr.gz')):
+            print("ERROR: input must be in the ELR format (.elr)")
+            return 1
+        
+        if self.indexed:
+            self.process_indexed_input()
+        else:
+            self.process_input()
+        
+        if self.output != 'stdout':
+            print(self.display_summary())
+            self.output_file.close()
+        
+        return 0
+    
+    def read_header(self, elr_in):
+        """Writes the header of elr_in to output and returns the
+        chrom index of self.chrom and the first read line."""
+        chrom_index = None
+        line = elr_in.readline()
+        if isinstance(line, bytes):
+            line = line.decode()
+        
+        while line and line[0] == '#':
+            self.output_line(line)
+            header_line = line.rstrip().split(' ')
+            if header_line[0] == '#C' and header_line[-1] == self.chrom:
+                chrom_index = header_line[1]
+            
+            line = elr_in.readline()
+            if isinstance(line, bytes):
+                line = line.decode()
+        
+        if chrom_index is None:
+            print("ERROR: chromosome {} not found in the ELR header.".format(self.chrom))
+            sys.exit(1)
+        
+        return chrom_index, line
+    
+    def read_index(self, chrom_index):
+        """Returns the sorted (position, virtual_offset) entries and the
+        longest read length on chrom_index from the input's index file."""
+        positions = []
+        offsets = []
+        max_length = 0
+        index_file = open(index_name(self.input), 'r')
+        for index_line in index_file:
+            if index_line[0] == '#':
+                header_line = index_line.rstrip().split(' ')
+                if header_line[1] == chrom_index:
+                    max_length = int(header_line[2])
+                
+                continue
+            
+            chrom, position, offset = index_line.rstrip().split('\t')
+            if chrom == chrom_index:
+                positions.append(int(position))
+                offsets.append(int(offset))
+        
+        index_file.close()
+        return positions, offsets, max_length
+    
+    def process_indexed_input(self):
+        """Seeks to the last indexed bin that starts before any read that
+        could overlap the region, then reads until the region is passed."""
+        elr_in = BGZFile(self.input, 'rb')
+        chrom_index, line = self.read_header(elr_in)
+        positions, offsets, max_length = self.read_index(chrom_index)
+        if len(positions) > 0:
+            i = max(0, bisect_right(positions, self.start - max_length) - 1)
+            elr_in.seek(offsets[i])
+            for elr_line in elr_in:
+                if not self.write_if_overlapping(elr_line.decode(), chrom_index):
+                    break
+        
+        elr_in.close()
+    
+    def process_input(self):
+        """Scans every line of the input for reads overlapping the region."""
+        if self.input == '-':
+            elr_in = sys.stdin
+        elif self.input.lower().endswith('.gz'):
+            elr_in = gzip.open(self.input, 'rt')
+        else:
+            elr_in = open(self.input, 'r')
+        
+        chrom_index, line = self.read_header(elr_in)
+        if line:
+            self.write_if_overlapping(line, chrom_index)
+            for elr_line in elr_in:
+                self.write_if_overlapping(elr_line, chrom_index)
+        
+        elr_in.close()
+    
+    def write_if_overlapping(self, elr_line, chrom_index):
+        """Writes elr_line if it overlaps the region. Returns False once
+        a sorted input has passed the end of the region."""
+        chrom, start, length = elr_line.split('\t', 3)[:3]
+        self.linecount += 1
+        if chrom != chrom_index:
+            return not self.indexed
+        
+        start = int(start)
+        if start >= self.end:
+            return not self.indexed
+        
+        if start + int(length) > self.start:
+            self.output_line(elr_line)
+            self.outlinecount += 1
+        
+        return True
+    
+    def output_line(self, line):
+        """Takes an ELR line and writes it to the output stream."""
+        if self.output_file == 'stdout':
+            print(line.rstrip())
+        else:
+            self.output_file.write('{}\n'.format(line.rstrip()))
+    
+    def display_options(self):
+        """Returns a string describing all input args"""
+        options_string = "\n/| bookend elr-subset |\\\n¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯\n"
+        options_string += "  Input file:    {}\n".format(self.input)
+        options_string += "  Output file:   {}\n".format(self.output)
+        options_string += "  Region:        {}\n".format(self.region)
+        options_string += "  Indexed:       {}\n".format(self.indexed)
+        return options_string
+    
+    def display_summary(self):
+        summary_string = ''
+        summary_string += 'Read {} lines.\n'.format(self.linecount)
+        summary_string += 'Wrote {} reads in {}.\n'.format(self.outlinecount, self.region)
+        return summary_string
+
+
+if __name__ == '__main__':
+    args = vars(parser.parse_args())
+    obj = ELRsubsetter(args)
+    sys.exit(obj.run())
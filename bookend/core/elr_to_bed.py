@@ -2,21 +2,55 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import gzip
 from bookend.core.cython_utils._rnaseq_utils import RNAseqDataset
+from bookend.core.block_writer import BlockWriter
+from bookend.core.block_reader import BlockReader
 if __name__ == '__main__':
     sys.path.append('../../bookend')
     from argument_parsers import bed_to_elr_parser as parser
 
+class BEDwriter:
+    def __init__(self, filename, threads=1):
+        """Stands in for an ELR output file, converting each ELR line
+        to BED12 as it is written, so sorted reads can be written as
+        BED without an intermediate ELR file."""
+        self.filename = filename
+        self.writer = BlockWriter(filename, threads)
+        self.dataset = RNAseqDataset()
+    
+    def write(self, string):
+        for line in string.splitlines():
+            if line[0] == '#':
+                header_line = line.rstrip().split(' ')
+                if header_line[0] == '#S':
+                    self.dataset.add_source(header_line[-1])
+                elif header_line[0] == '#C':
+                    self.dataset.add_chrom(header_line[-1])
+                
+                continue
+            
+            self.dataset.add_read_from_ELR(line)
+            while len(self.dataset.read_list) > 0:
+                self.writer.write('{}\n'.format(self.dataset.pop_read('bed').rstrip()))
+    
+    def tell(self):
+        return self.writer.tell()
+    
+    def close(self):
+        self.writer.close()
+
 class ELRtoBEDconverter:
     def __init__(self, args):
         """Converts each line of BED-formatted input to ELR"""
         self.input = args['INPUT']
         self.output = args['OUTPUT']
+        if self.output == '-':
+            self.output = 'stdout'
+        
         if self.output == 'stdout':
             self.output_file = 'stdout'
         else:
-            self.output_file = open(self.output, 'w')
+            self.output_file = BlockWriter(self.output)
         
         self.linecount = 0
         self.readcount = 0
@@ -24,11 +58,7 @@ class ELRtoBEDconverter:
 
     def process_input(self):
         """Yield a BED line from each line of a ELR input."""
-        if self.input.lower().endswith('.elr.gz'):
-            elr_in = gzip.open(self.input, 'rt')
-        else:
-            elr_in = open(self.input, 'r')
-        
+        elr_in = BlockReader(self.input)
         for elr_line in elr_in:
             if elr_line[0] == '#':
                 header_line = elr_line.rstrip().split(' ')
@@ -63,12 +93,13 @@ class ELRtoBEDconverter:
     
     def run(self):
         if __name__ == '__main__':print(self.display_options())
-        if not (self.input.lower().endswith('.elr') or self.input.lower().endswith('.elr.gz')):
+        if not (self.input == '-' or self.input.lower().endswith('.elr') or self.input.lower().endswith('.elr.gz')):
             print("ERROR: input must be in the ELR format (.elr)")
             return 1
         
         self.process_input()
-        print(self.display_summary())
+        if self.output != 'stdout':
+            print(self.display_summary())
         return 0
     
     def display_options(self):
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from bookend.core.cython_utils._fasta_utils import pack_genome, genome_pack_suffix
+if __name__ == '__main__':
+    sys.path.append('../../bookend')
+    from argument_parsers import genome_index_parser as parser
+
+class GenomeIndexer:
+    def __init__(self, args):
+        """Writes a genome FASTA file as a packed genome (.gpack): 2-bit bases
+        plus the runs of N and soft-masked (lowercase) sequence. Commands that
+        take a genome read genome.fasta.gpack in place of genome.fasta when it
+        is newer, or can be given the .gpack path directly."""
+        self.input = args['INPUT']
+        self.output = args['OUT']
+        self.force = args['FORCE']
+        self.header = None
+        if self.output is None:
+            self.output = self.input.rstrip('/') + genome_pack_suffix
+        
+        if not self.output.rstrip('/').endswith(genome_pack_suffix):
+            print("ERROR: output path must end in {}".format(genome_pack_suffix))
+            sys.exit(1)
+        
+        if os.path.exists(self.output) and not self.force:
+            print("ERROR: output file already exists. Use -f/--force to overwrite.")
+            sys.exit(1)
+    
+    def run(self):
+        print(self.display_options())
+        self.header = pack_genome(self.input, self.output)
+        print(self.display_summary())
+        return 0
+    
+    def display_options(self):
+        """Returns a string describing all input args"""
+        options_string = "\n/| bookend genome-index |\\\n¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯¯\n"
+        options_string += "  Input file:    {}\n".format(self.input)
+        options_string += "  Output file:   {}\n".format(self.output)
+        return options_string
+    
+    def display_summary(self):
+        summary_string = ''
+        summary_string += 'Packed {} bases on {} chromosomes.\n'.format(sum(self.header['lengths']), len(self.header['chroms']))
+        summary_string += '{} N runs, {} soft-masked runs.\n'.format(self.header['n_runs_offsets'][-1], self.header['soft_runs_offsets'][-1])
+        return summary_string
+
+
+if __name__ == '__main__':
+    args = vars(parser.parse_args())
+    obj = GenomeIndexer(args)
+    sys.exit(obj.run())
@@ -9,10 +9,76 @@ if __name__ == '__main__':
 from bookend.core.cython_utils._rnaseq_utils import RNAseqDataset, get_flank
 from bookend.core.sj_merge import SJobject
 
+junction_types = {'GTAG':1, 'CTAC':2, 'GCAG':3, 'CTGC':4, 'ATAC':5, 'GTAT':6}
+
+def get_junction_type(genome, chrom, left, right):
+    """ Returns the sequence motif ID for a splice junction based
+    on the flanking genomic sequence."""
+    flanking_sequence = get_flank(genome, chrom, left-1, 1, 'E', 2) + get_flank(genome, chrom, right, 1, 'S', 2)
+    flanking_sequence = flanking_sequence.upper()
+    return junction_types.get(flanking_sequence,0)
+
+class SJcollector:
+    def __init__(self):
+        """Tallies the splice junctions of converted reads, so that an SJ
+        table can be written in the same pass that writes the reads.
+        Junctions are stored as (chrom, left, right, strand):[unique, multi, overhang]
+        with chrom as an index into the dataset's chrom_array, which keeps
+        the tally small to send back from a worker process."""
+        self.junctions = {}
+    
+    def add_reads(self, reads, multi=False):
+        """Counts each junction of a list of RNAseqMapping objects once.
+        multi marks the mappings of a read that aligned to more than one place."""
+        for read in reads:
+            for i in range(len(read.splice)):
+                if not read.splice[i]:
+                    continue
+                
+                l, r = read.ranges[i][1], read.ranges[i+1][0]
+                overhang = min(l-read.ranges[i][0], read.ranges[i+1][1]-r)
+                key = (read.chrom, l, r, read.strand)
+                tally = self.junctions.get(key)
+                if tally is None:
+                    tally = self.junctions[key] = [0, 0, 0]
+                
+                tally[1 if multi else 0] += 1
+                tally[2] = max(tally[2], overhang)
+    
+    def update(self, junctions):
+        """Merges a junction tally from another SJcollector"""
+        for key, (unique, multi, overhang) in junctions.items():
+            tally = self.junctions.get(key)
+            if tally is None:
+                self.junctions[key] = [unique, multi, overhang]
+            else:
+                tally[0] += unique
+                tally[1] += multi
+                tally[2] = max(tally[2], overhang)
+    
+    def write(self, filename, dataset, linetype='star'):
+        """Writes the junctions as SJ.out.tab (linetype='star') or SJ.bed.
+        Motifs are looked up in the dataset's genome, if it has one."""
+        output_file = open(filename, 'w')
+        sj_list = []
+        for (chrom_id, l, r, strand), (unique, multi, overhang) in self.junctions.items():
+            chrom = dataset.chrom_array[chrom_id]
+            motif = get_junction_type(dataset.genome, chrom, l, r) if dataset.genome else 0
+            SJ_line = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+                chrom, l+1, r, 2 if strand == -1 else strand, motif, 0, unique, multi, overhang
+            )
+            sj_list.append(SJobject(SJ_line, 'star'))
+        
+        for i, sj in enumerate(sorted(sj_list)):
+            sj.name = 'SJ.{}'.format(i+1)
+            output_file.write(sj.as_string(linetype))
+        
+        output_file.close()
+        return len(sj_list)
+
 class SAMtoSJconverter:
     def __init__(self, args):
         """Generates an SJ.out.tab file with splice junction information from a SAM file."""
-        self.junction_types = {'GTAG':1, 'CTAC':2, 'GCAG':3, 'CTGC':4, 'ATAC':5, 'GTAT':6}    
         self.fasta = args['FASTA']
         self.format = args['FORMAT']
         self.filter = args['FILTER']
@@ -41,7 +107,7 @@ class SAMtoSJconverter:
     def write_sj_dict_to_file(self):
         outfile_name = self.input+'.SJ.out.tab'
         output_file = open(outfile_name, 'w')
-        for sj in sorted(list(self.sj_dict.items())):
+        for sj in sorted(self.sj_dict.values()):
             output_file.write(sj.as_string(self.format))
         
         output_file.close()
@@ -66,10 +132,7 @@ class SAMtoSJconverter:
     def get_junction_type(self, chrom, left, right):
         """ Returns the sequence motif ID for a splice junction based
         on the flanking genomic sequence."""
-        flanking_sequence = get_flank(self.dataset.genome, chrom, left-1, '+', 'E', 2) + get_flank(self.dataset.genome, chrom, right, '+', 'S', 2)
-        flanking_sequence = flanking_sequence.upper()
-        jtype = self.junction_types.get(flanking_sequence,0)
-        return jtype
+        return get_junction_type(self.dataset.genome, chrom, left, right)
     
     def add_entry_to_sj_dict(self, entry):
         """Extract all splice junctions from the read(s) of a SAM entry"""
@@ -114,7 +177,7 @@ class SAMtoSJconverter:
         options_string += "  Genome FASTA:       {}\n".format(self.fasta)
         options_string += "  *** Parameters ***\n"
         options_string += "  Output format:      {}\n".format(self.format)
-        options_string += "  Canonical SJ only:  {}\n".format(self.bridge_min)
+        options_string += "  Canonical SJ only:  {}\n".format(self.filter)
         return options_string        
     
     def display_summary(self):
@@ -1,11 +1,10 @@
 from setuptools import setup
 from setuptools.extension import Extension
 try:
-    from Cython.setuptools import build_ext
-except:
+    from Cython.Build import cythonize
+except ImportError:
     # If we couldn't import Cython, use the normal setuptools
     # and look for a pre-compiled .c file instead of a .pyx file
-    from setuptools.command.build_ext import build_ext
     ext_modules = [
         Extension("bookend.core.cython_utils._assembly_utils", ["bookend/core/cython_utils/_assembly_utils.c"]),
         Extension("bookend.core.cython_utils._element_graph", ["bookend/core/cython_utils/_element_graph.c"]),
@@ -22,6 +21,9 @@ else:
         Extension("bookend.core.cython_utils._pq", ["bookend/core/cython_utils/_pq.pyx"]),
         Extension("bookend.core.cython_utils._rnaseq_utils", ["bookend/core/cython_utils/_rnaseq_utils.pyx"]),
     ]
+    ext_modules = cythonize(ext_modules, language_level=3)
+
+from setuptools.command.build_ext import build_ext
 
 class CustomBuildExtCommand(build_ext):
     """build_ext command for use when numpy headers are needed."""
@@ -0,0 +1,55 @@
+import os
+import pysam
+import pytest
+from bookend.core.cython_utils._fasta_utils import import_genome
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+GENOME = os.path.join(RES, 'test_genome.fasta')
+
+@pytest.fixture(scope='session')
+def chrom_sequence():
+    """The sequence of chr1frag, the only chrom of the test genome"""
+    return import_genome(GENOME)[0]['chr1frag']
+
+@pytest.fixture
+def sam_record(chrom_sequence):
+    """Returns a function that writes one SAM line of a perfect alignment to
+    chr1frag. blocks are 0-based (start, end) exons, joined by N operations."""
+    def record(name, blocks, flag=0, mate_start=None, tags=()):
+        cigar = ''
+        for i, (start, end) in enumerate(blocks):
+            if i > 0:
+                cigar += '{}N'.format(start - blocks[i-1][1])
+            
+            cigar += '{}M'.format(end - start)
+        
+        sequence = ''.join(chrom_sequence[start:end] for start, end in blocks).upper()
+        mate = ['=', str(mate_start + 1)] if mate_start is not None else ['*', '0']
+        fields = [name, str(flag), 'chr1frag', str(blocks[0][0] + 1), '255', cigar] + mate + ['0', sequence, 'I' * len(sequence)]
+        return '\t'.join(fields + ['MD:Z:{}'.format(len(sequence))] + list(tags))
+    
+    return record
+
+@pytest.fixture
+def make_bam(tmp_path):
+    """Returns a function that writes SAM lines to a BAM file, in the given
+    order or sorted and indexed by coordinate"""
+    def make(name, lines, coordinate_sorted=False):
+        sam = str(tmp_path / '{}.sam'.format(name))
+        bam = str(tmp_path / '{}.bam'.format(name))
+        sam_file = open(sam, 'w')
+        sam_file.write('@HD\tVN:1.6\tSO:{}\n'.format('coordinate' if coordinate_sorted else 'unsorted'))
+        sam_file.write('@SQ\tSN:chr1frag\tLN:11000\n')
+        for line in lines:
+            sam_file.write(line + '\n')
+        
+        sam_file.close()
+        if coordinate_sorted:
+            pysam.sort('-o', bam, sam)
+            pysam.index(bam)
+        else:
+            pysam.view('-b', '-o', bam, sam, catch_stdout=False)
+        
+        return bam
+    
+    return make
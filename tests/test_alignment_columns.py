@@ -0,0 +1,69 @@
+import random
+import pytest
+from bookend.core.cython_utils._rnaseq_utils import AlignmentColumns, parse_SAM_CIGAR
+
+OPERATORS = 'MIDNSH'
+
+def random_alignment(rng):
+    """Returns (cigartuples, MD string) of a random spliced alignment with
+    mismatches, indels and clipping; the MD string matches the CIGAR."""
+    cigartuples = []
+    if rng.random() < .3:
+        cigartuples.append((rng.choice([4, 5]), rng.randint(1, 20)))
+    
+    cigartuples.append((0, rng.randint(1, 60)))
+    for i in range(rng.randint(0, 4)):
+        cigartuples.append((rng.choice([1, 2, 3, 3]), rng.randint(1, 500)))
+        cigartuples.append((0, rng.randint(1, 60)))
+    
+    if rng.random() < .3:
+        cigartuples.append((rng.choice([4, 5]), rng.randint(1, 20)))
+    
+    md = []
+    matches = 0
+    for operator, length in cigartuples:
+        if operator == 0:
+            for i in range(length):
+                if rng.random() < .05:
+                    md += [str(matches), rng.choice('ACGT')]
+                    matches = 0
+                else:
+                    matches += 1
+        elif operator == 2:
+            md += [str(matches), '^' + ''.join(rng.choice('ACGT') for i in range(length))]
+            matches = 0
+    
+    md.append(str(matches))
+    return cigartuples, ''.join(md)
+
+def sam_line(name, pos, cigartuples, md):
+    query_length = sum(l for o, l in cigartuples if o in (0, 1, 4))
+    cigar = ''.join('{}{}'.format(l, OPERATORS[o]) for o, l in cigartuples)
+    return '\t'.join([name, '0', 'chr1', str(pos+1), '255', cigar, '*', '0', '0', 'A'*query_length, 'I'*query_length, 'NH:i:1', 'MD:Z:{}'.format(md)])
+
+@pytest.mark.parametrize('error_rate', [0.1, 0.02])
+def test_columns_match_parse_SAM_CIGAR(error_rate):
+    rng = random.Random(0)
+    alignments = [random_alignment(rng) for i in range(500)]
+    positions = [rng.randint(0, 100000) for i in range(500)]
+    lines = [sam_line('read{}'.format(i), p, c, md) for i, (p, (c, md)) in enumerate(zip(positions, alignments))]
+    columns = AlignmentColumns(lines, {'chr1':0}, error_rate)
+    assert len(columns) == len(lines)
+    for r, (pos, (cigartuples, md)) in enumerate(zip(positions, alignments)):
+        ranges, gaps, head, tail = parse_SAM_CIGAR(pos, cigartuples, md, error_rate)
+        assert columns.ranges(r) == ranges
+        assert columns.introns(r) == gaps
+        assert (columns.head[r], columns.tail[r]) == (head, tail)
+        assert columns.name(r) == 'read{}'.format(r)
+        assert columns.chroms[r] == 'chr1' and columns.ref_ids[r] == 0
+        assert columns.nh[r] == 1 and columns.hits[r] == -1
+
+def test_short_MD_string_is_flagged(capsys):
+    line = sam_line('read0', 100, [(0, 30), (3, 200), (0, 20)], '10')
+    columns = AlignmentColumns([line], {'chr1':0})
+    ranges, gaps, head, tail = parse_SAM_CIGAR(100, [(0, 30), (3, 200), (0, 20)], '10')
+    assert columns.ran_out[0]
+    assert columns.ranges(0) == ranges and columns.introns(0) == gaps
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert '# RAN OUT' in captured.err
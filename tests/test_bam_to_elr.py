@@ -0,0 +1,141 @@
+import random
+import pysam
+import pytest
+from bookend.core.argument_parsers import bam_to_elr_parser, elr_sort_parser
+from bookend.core.bam_to_elr import BAMtoELRconverter, MatePairer, UMIdeduplicator, generate_region_groups
+from bookend.core.elr_sort import ELRsorter
+
+@pytest.fixture
+def paired_lines(sam_record):
+    """SAM lines of proper pairs, some spliced and some repeated, and single reads, grouped by name"""
+    rng = random.Random(0)
+    lines = []
+    for i in range(80):
+        start = rng.randint(500, 9500)
+        left = [(start, start + 40)] if rng.random() < .7 else [(start, start + 20), (start + 150, start + 170)]
+        right_start = left[-1][0] + rng.randint(0, 400)
+        right = [(right_start, right_start + 40)]
+        for copy in range(rng.choice([1, 1, 2])):
+            name = 'pair{}_{}'.format(i, copy)
+            lines.append(sam_record(name, left, flag=99, mate_start=right[0][0], tags=['NH:i:1']))
+            lines.append(sam_record(name, right, flag=147, mate_start=left[0][0], tags=['NH:i:1']))
+    
+    for i in range(40):
+        start = rng.randint(0, 10900)
+        lines.append(sam_record('single{}'.format(i), [(start, start + 50)], tags=['NH:i:1']))
+    
+    return lines
+
+def convert(bam, output, *options):
+    BAMtoELRconverter(vars(bam_to_elr_parser.parse_args([bam, '-o', output] + list(options)))).run()
+    return output
+
+def sort(path, output):
+    ELRsorter(vars(elr_sort_parser.parse_args([path, '-o', output]))).run()
+    return open(output).read()
+
+@pytest.mark.parametrize('region_size', ['137', '1000', '20000'])
+def test_by_region_matches_convert_then_sort(tmp_path, make_bam, paired_lines, region_size):
+    named = make_bam('named', paired_lines)
+    expected = sort(convert(named, str(tmp_path / 'named.elr')), str(tmp_path / 'named.sorted.elr'))
+    coordinate = make_bam('coordinate', paired_lines, coordinate_sorted=True)
+    by_region = open(convert(coordinate, str(tmp_path / 'regions.elr'), '--by_region', '--region_size', region_size)).read()
+    assert len(expected.splitlines()) > 100
+    assert by_region == expected
+
+def test_identical_reads_from_neighboring_regions_are_collapsed(tmp_path, make_bam, sam_record):
+    coordinate = make_bam('coordinate', [sam_record('read', [(1000, 1050)])], coordinate_sorted=True)
+    converter = BAMtoELRconverter(vars(bam_to_elr_parser.parse_args([coordinate, '-o', str(tmp_path / 'regions.elr'), '--by_region', '--region_size', '1002'])))
+    results = [(['0\t1000\t50\t.\t.50.\t0\t1.0'], {}, None, 0), (['0\t1000\t50\t.\t.50.\t0\t2.0', '0\t1003\t47\t.\t.47.\t0\t1.0'], {}, None, 0)]
+    converter.generate_region_results = lambda regions: iter(results + [([], {}, None, 0)] * len(regions))
+    converter.process_regions()
+    reads = [l for l in open(str(tmp_path / 'regions.elr')).read().splitlines() if l[0] != '#']
+    assert reads == ['0\t1000\t50\t.\t.50.\t0\t3.0', '0\t1003\t47\t.\t.47.\t0\t1.0']
+
+class Read:
+    """Stands in for an RNAseqMapping in UMIdeduplicator tests"""
+    def __init__(self, span, strand=1, s_tag=False, e_tag=False, introns=(), chrom=0):
+        self.chrom, self.span, self.strand, self.s_tag, self.e_tag, self.introns = chrom, span, strand, s_tag, e_tag, list(introns)
+    
+    def junctions(self):
+        return self.introns
+
+def test_dedup_compares_labeled_ends_and_introns():
+    deduplicator = UMIdeduplicator()
+    assert not deduplicator.is_duplicate('AAA', Read((100, 200), s_tag=True, introns=[(120, 150)]))
+    assert deduplicator.is_duplicate('AAA', Read((100, 180), s_tag=True, introns=[(120, 150)]))
+    assert not deduplicator.is_duplicate('AAA', Read((101, 200), s_tag=True, introns=[(120, 150)]))
+    assert not deduplicator.is_duplicate('AAA', Read((100, 200), s_tag=True, introns=[(120, 160)]))
+    assert not deduplicator.is_duplicate('CCC', Read((100, 200), s_tag=True, introns=[(120, 150)]))
+    assert not deduplicator.is_duplicate('AAA', Read((100, 200), strand=-1, e_tag=True, introns=[(120, 150)]))
+    assert deduplicator.is_duplicate('AAA', Read((100, 250), strand=-1, e_tag=True, introns=[(120, 150)]))
+    assert deduplicator.removed == 2
+
+def test_dedup_remembers_long_inserts():
+    """A pair is yielded when its right mate is read, after reads near that mate"""
+    deduplicator = UMIdeduplicator(window=10000)
+    assert not deduplicator.is_duplicate('AAA', Read((0, 15050), introns=[(100, 14000)]))
+    assert not deduplicator.is_duplicate('CCC', Read((15000, 15050)))
+    assert deduplicator.is_duplicate('AAA', Read((0, 15050), introns=[(100, 14000)]))
+
+def test_dedup_state_stays_bounded():
+    deduplicator = UMIdeduplicator(window=100)
+    for i in range(1000):
+        deduplicator.is_duplicate('AAA', Read((i * 50, i * 50 + 40), s_tag=True))
+    
+    assert len(deduplicator.seen) <= 4 and len(deduplicator.ends) <= 4
+    deduplicator.is_duplicate('AAA', Read((0, 40), s_tag=True, chrom=1))
+    assert len(deduplicator.seen) == 1
+
+def test_dedup_umi_removes_duplicate_reads(tmp_path, make_bam, sam_record):
+    lines = []
+    unspliced, spliced = [(1000, 1050)], [(2000, 2050), (2300, 2350)]
+    for i, (umi, blocks) in enumerate([('AAAA', unspliced), ('AAAA', unspliced), ('CCCC', unspliced), ('AAAA', spliced), ('AAAA', spliced), ('AAAA', spliced)]):
+        lines.append(sam_record('read{}_UMI={}'.format(i, umi), blocks, tags=['NH:i:1']))
+    
+    coordinate = make_bam('umi', lines, coordinate_sorted=True)
+    converter = BAMtoELRconverter(vars(bam_to_elr_parser.parse_args([coordinate, '-o', str(tmp_path / 'dedup.elr'), '--dedup_umi'])))
+    converter.run()
+    reads = [l.split('\t') for l in open(str(tmp_path / 'dedup.elr')).read().splitlines() if l[0] != '#']
+    assert converter.duplicates == 3
+    assert [(r[1], float(r[6])) for r in reads] == [('1000', 2.0), ('2000', 1.0)]
+
+def group_names(groups):
+    return sorted(tuple((line.query_name, line.flag, line.reference_start) for line in group) for group in groups)
+
+def test_mate_pairer_matches_region_groups(make_bam, paired_lines):
+    coordinate = make_bam('coordinate', paired_lines, coordinate_sorted=True)
+    bam_in = pysam.AlignmentFile(coordinate)
+    expected = group_names(generate_region_groups(bam_in, 'chr1frag', 0, 11000))
+    paired = group_names(MatePairer(pysam.AlignmentFile(coordinate)))
+    assert sum(len(group) == 2 for group in paired) > 50
+    assert paired == expected
+
+def test_stream_matches_convert_then_sort(tmp_path, make_bam, paired_lines):
+    named = make_bam('named', paired_lines)
+    expected = sort(convert(named, str(tmp_path / 'named.elr')), str(tmp_path / 'named.sorted.elr'))
+    coordinate = make_bam('coordinate', paired_lines, coordinate_sorted=True)
+    converter = BAMtoELRconverter(vars(bam_to_elr_parser.parse_args([coordinate])))
+    streamed = list(converter.generate_stream_lines(str(tmp_path / 'streamed.elr')))
+    assert streamed == expected.splitlines()
+    assert open(str(tmp_path / 'streamed.elr')).read() == expected
+
+def test_mate_pairer_yields_far_and_missing_mates_alone(make_bam, sam_record):
+    lines = [
+        sam_record('near', [(1000, 1040)], flag=99, mate_start=1100),
+        sam_record('near', [(1100, 1140)], flag=147, mate_start=1000),
+        sam_record('far', [(2000, 2040)], flag=99, mate_start=2500),
+        sam_record('far', [(2500, 2540)], flag=147, mate_start=2000),
+        sam_record('lost', [(3000, 3040)], flag=99, mate_start=3100),
+        sam_record('single', [(3200, 3240)]),
+    ]
+    bam_in = pysam.AlignmentFile(make_bam('mates', lines, coordinate_sorted=True))
+    groups = [[(line.query_name, line.reference_start) for line in group] for group in MatePairer(bam_in, window=200)]
+    assert groups == [[('near', 1000), ('near', 1100)], [('far', 2000)], [('far', 2500)], [('lost', 3000)], [('single', 3200)]]
+
+def test_mate_pairer_rejects_unsorted_input(make_bam, sam_record):
+    lines = [sam_record('late', [(2000, 2040)]), sam_record('early', [(1000, 1040)])]
+    bam_in = pysam.AlignmentFile(make_bam('unsorted', lines))
+    with pytest.raises(SystemExit):
+        list(MatePairer(bam_in))
+
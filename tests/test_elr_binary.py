@@ -0,0 +1,57 @@
+import os
+from bookend.core.argument_parsers import elr_convert_parser
+from bookend.core.elr_binary import ELRbinaryConverter, ELRbinaryReader
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+
+def convert(path, output):
+    ELRbinaryConverter(vars(elr_convert_parser.parse_args([path, '-o', output, '-f']))).run()
+    return output
+
+def end_weighted_copy(tmp_path):
+    """The test reads with a mix of plain and start|end weights, some of them 0"""
+    weights = ['2.0|0.0|1.5', '1.0', '3.5|1.0|0.0', '4.0|0.0|0.0', '1.25', '0.5|0.5|0.5']
+    lines = []
+    i = 0
+    for line in open(os.path.join(RES, 'test_reads_single.elr')):
+        if line[0] != '#':
+            line = '{}\t{}\n'.format(line.rsplit('\t', 1)[0], weights[i % len(weights)])
+            i += 1
+        
+        lines.append(line)
+    
+    path = str(tmp_path / 'weighted.elr')
+    open(path, 'w').write(''.join(lines))
+    return path
+
+def test_text_binary_text_round_trip(tmp_path):
+    path = end_weighted_copy(tmp_path)
+    binary = convert(path, str(tmp_path / 'weighted.elrb'))
+    text = convert(binary, str(tmp_path / 'round_trip.elr'))
+    assert open(text).read() == open(path).read()
+
+def test_binary_columns(tmp_path):
+    path = os.path.join(RES, 'test_reads_single.elr')
+    reader = ELRbinaryReader(convert(path, str(tmp_path / 'reads.elrb')))
+    reads = [l.rstrip().split('\t') for l in open(path) if l[0] != '#']
+    assert reader.rows == len(reads)
+    assert reader.chroms == ['chr1frag']
+    assert reader.chrom_offsets == [0, len(reads)]
+    assert reader.columns['start'].tolist() == [int(r[1]) for r in reads]
+    assert reader.columns['length'].tolist() == [int(r[2]) for r in reads]
+    assert [reader.cigar_strings[c] for c in reader.columns['cigar']] == [r[4] for r in reads]
+    assert reader.columns['weights'][:,0].tolist() == [float(r[6]) for r in reads]
+    reader.close()
+
+def test_unsorted_input_has_no_chrom_offsets(tmp_path):
+    lines = open(os.path.join(RES, 'test_reads_single.elr')).read().splitlines(True)
+    header = [l for l in lines if l[0] == '#']
+    reads = [l for l in lines if l[0] != '#']
+    path = str(tmp_path / 'reversed.elr')
+    open(path, 'w').write(''.join(header + reads[::-1]))
+    reader = ELRbinaryReader(convert(path, str(tmp_path / 'reversed.elrb')))
+    assert reader.chrom_offsets is None
+    rows = [l.split('\t') for l in list(reader.lines())[len(header):]]
+    assert [r[:6] for r in rows] == [l.rstrip().split('\t')[:6] for l in reads[::-1]]
+    assert [float(r[6]) for r in rows] == [float(l.rstrip().split('\t')[6]) for l in reads[::-1]]
+    reader.close()
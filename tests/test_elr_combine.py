@@ -0,0 +1,46 @@
+import os
+from bookend.core.argument_parsers import combine_parser
+from bookend.core.elr_combine import ELRcombiner
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+
+def split_inputs(tmp_path, parts=5):
+    """Deals the reads of a sorted test file round-robin into sorted parts,
+    plus one full copy so that every read is collapsed with another"""
+    lines = open(os.path.join(RES, 'test_reads_single.elr')).read().splitlines(True)
+    header = [l for l in lines if l[0] == '#']
+    reads = [l for l in lines if l[0] != '#']
+    paths = []
+    for i in range(parts):
+        paths.append(str(tmp_path / 'part{}.elr'.format(i)))
+        open(paths[-1], 'w').write(''.join(header + reads[i::parts]))
+    
+    paths.append(str(tmp_path / 'full.elr'))
+    open(paths[-1], 'w').write(''.join(header + reads))
+    return paths, 2 * len(reads)
+
+def combine(paths, output, *options):
+    args = vars(combine_parser.parse_args(paths + ['-o', output, '--tmpdir', os.path.dirname(output)] + list(options)))
+    combiner = ELRcombiner(args)
+    combiner.run()
+    return open(output).read(), combiner.linecount
+
+def test_tree_merge_matches_direct_merge(tmp_path):
+    paths, number_of_reads = split_inputs(tmp_path)
+    direct, direct_count = combine(paths, str(tmp_path / 'direct.elr'))
+    tree, tree_count = combine(paths, str(tmp_path / 'tree.elr'), '--fan_in', '2')
+    parallel, parallel_count = combine(paths, str(tmp_path / 'parallel.elr'), '--fan_in', '2', '--threads', '2')
+    assert tree == direct
+    assert parallel == direct
+    assert direct_count == tree_count == parallel_count == number_of_reads
+    assert not [f for f in os.listdir(str(tmp_path)) if 'tmp' in f]
+
+def test_combine_sums_weights(tmp_path):
+    paths, number_of_reads = split_inputs(tmp_path)
+    output, linecount = combine(paths, str(tmp_path / 'direct.elr'))
+    reads = [l for l in output.splitlines() if l[0] != '#']
+    original = [l.rstrip() for l in open(os.path.join(RES, 'test_reads_single.elr')) if l[0] != '#']
+    assert len(reads) == len(original)
+    for line, original_line in zip(reads, original):
+        assert line.rsplit('\t', 1)[0] == original_line.rsplit('\t', 1)[0]
+        assert float(line.rsplit('\t', 1)[1]) == 2 * float(original_line.rsplit('\t', 1)[1])
@@ -0,0 +1,42 @@
+import os
+import random
+from bookend.core.argument_parsers import elr_sort_parser
+from bookend.core.elr_sort import ELRsorter
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+
+def shuffled_copy(tmp_path, name='test_reads_single.elr'):
+    """Writes the reads of a test ELR file in random order, keeping the header first"""
+    lines = open(os.path.join(RES, name)).read().splitlines(True)
+    header = [l for l in lines if l[0] == '#']
+    reads = [l for l in lines if l[0] != '#']
+    random.Random(1).shuffle(reads)
+    path = str(tmp_path / 'shuffled.elr')
+    open(path, 'w').write(''.join(header + reads))
+    return path
+
+def sort_file(path, output, *options):
+    args = vars(elr_sort_parser.parse_args([path, '-o', output] + list(options)))
+    ELRsorter(args).run()
+    return open(output).read().splitlines()
+
+def read_key(line):
+    chrom, start, length, strand, elcigar, source = line.split('\t')[:6]
+    return (int(chrom), int(start))
+
+def test_sort_orders_and_collapses(tmp_path):
+    path = shuffled_copy(tmp_path)
+    lines = sort_file(path, str(tmp_path / 'sorted.elr'))
+    reads = [l for l in lines if l[0] != '#']
+    assert reads == sorted(reads, key=read_key)
+    identities = [l.rsplit('\t', 1)[0] for l in reads]
+    assert len(identities) == len(set(identities))
+    input_weight = sum(float(l.rstrip().split('\t')[6].split('|')[0]) for l in open(path) if l[0] != '#')
+    assert abs(sum(float(l.split('\t')[6].split('|')[0]) for l in reads) - input_weight) < 1e-3
+
+def test_parallel_runs_match_in_memory_sort(tmp_path):
+    path = shuffled_copy(tmp_path)
+    in_memory = sort_file(path, str(tmp_path / 'memory.elr'))
+    runs = sort_file(path, str(tmp_path / 'runs.elr'), '--threads', '2', '--memory', '200K')
+    assert runs == in_memory
+    assert not [f for f in os.listdir(str(tmp_path)) if 'tmp' in f]
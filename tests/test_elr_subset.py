@@ -0,0 +1,49 @@
+import os
+import gzip
+import time
+import pytest
+from bookend.core import block_writer
+from bookend.core.argument_parsers import elr_sort_parser, elr_subset_parser
+from bookend.core.elr_sort import ELRsorter
+from bookend.core.elr_subset import ELRsubsetter
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+REGIONS = ['chr1frag', 'chr1frag:1-500', 'chr1frag:2000-9000', 'chr1frag:4001-4001', 'chr1frag:10500-11000']
+
+@pytest.fixture
+def indexed_elr(tmp_path, monkeypatch):
+    """The test reads as block-gzipped ELR, indexed in small bins so that seeks land mid-file"""
+    monkeypatch.setattr(block_writer, 'index_bin_size', 500)
+    path = str(tmp_path / 'reads.elr.gz')
+    ELRsorter(vars(elr_sort_parser.parse_args([os.path.join(RES, 'test_reads_single.elr'), '-o', path]))).run()
+    assert len(open(block_writer.index_name(path)).readlines()) > 10
+    return path
+
+def subset(path, region, output):
+    subsetter = ELRsubsetter(vars(elr_subset_parser.parse_args([path, '-r', region, '-o', output, '-f'])))
+    subsetter.run()
+    return subsetter.indexed, open(output).read()
+
+def test_indexed_subset_matches_scan(tmp_path, indexed_elr):
+    plain = str(tmp_path / 'reads.elr')
+    open(plain, 'w').write(gzip.open(indexed_elr, 'rt').read())
+    for region in REGIONS:
+        indexed, from_index = subset(indexed_elr, region, str(tmp_path / 'indexed.elr'))
+        scanned, from_scan = subset(plain, region, str(tmp_path / 'scanned.elr'))
+        assert indexed and not scanned
+        assert from_index == from_scan
+
+def test_subset_selects_overlapping_reads(tmp_path):
+    indexed, output = subset(os.path.join(RES, 'test_reads_single.elr'), 'chr1frag:2000-9000', str(tmp_path / 'subset.elr'))
+    reads = [l.split('\t') for l in output.splitlines() if l[0] != '#']
+    expected = [l.split('\t') for l in open(os.path.join(RES, 'test_reads_single.elr')).read().splitlines() if l[0] != '#']
+    expected = [r for r in expected if int(r[1]) < 9000 and int(r[1]) + int(r[2]) > 1999]
+    assert reads == expected
+
+def test_stale_index_is_not_used(tmp_path, indexed_elr):
+    indexed, from_index = subset(indexed_elr, REGIONS[2], str(tmp_path / 'indexed.elr'))
+    later = time.time() + 10
+    os.utime(indexed_elr, (later, later))
+    indexed_again, from_scan = subset(indexed_elr, REGIONS[2], str(tmp_path / 'scanned.elr'))
+    assert indexed and not indexed_again
+    assert from_index == from_scan
@@ -0,0 +1,74 @@
+import os
+import time
+import random
+import pytest
+from bookend.core.cython_utils._fasta_utils import import_genome, index_fasta, open_genome, pack_genome, IndexedGenome, PackedGenome
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+
+@pytest.fixture
+def masked_fasta(tmp_path):
+    """A FASTA file with soft-masked runs, N runs, other IUPAC bases and uneven chrom lengths"""
+    rng = random.Random(0)
+    path = str(tmp_path / 'masked.fasta')
+    fasta = open(path, 'w')
+    for chrom, length in [('chrA', 1001), ('chrB', 64), ('chrC', 2503)]:
+        bases = [rng.choice('ACGT') for i in range(length)]
+        for i in range(0, length, 97):
+            bases[i:i+13] = [b.lower() for b in bases[i:i+13]]
+        
+        bases[length//3:length//3+25] = ['N'] * 25
+        bases[length//2] = 'R'
+        bases[-1] = 'y'
+        sequence = ''.join(bases)[:length]
+        fasta.write('>{} description\n'.format(chrom))
+        for i in range(0, length, 60):
+            fasta.write(sequence[i:i+60] + '\n')
+    
+    fasta.close()
+    return path
+
+def assert_same_sequences(genome, reference):
+    rng = random.Random(1)
+    assert sorted(genome.keys()) == sorted(reference.keys())
+    for chrom, sequence in reference.items():
+        assert len(genome[chrom]) == len(sequence)
+        assert str(genome[chrom]) == sequence
+        assert genome[chrom][-1] == sequence[-1]
+        for i in range(200):
+            l = rng.randint(-5, len(sequence))
+            r = rng.randint(l, len(sequence) + 5)
+            assert genome[chrom][max(l, 0):r] == sequence[max(l, 0):r]
+
+@pytest.mark.parametrize('fasta', ['masked', 'fixture'])
+def test_indexed_genome_matches_imported_fasta(masked_fasta, fasta):
+    path = masked_fasta if fasta == 'masked' else os.path.join(RES, 'test_genome.fasta')
+    reference, index = import_genome(path)
+    genome = IndexedGenome(path, index_fasta(path))
+    assert_same_sequences(genome, reference)
+    genome.close()
+
+@pytest.mark.parametrize('fasta', ['masked', 'fixture'])
+def test_packed_genome_matches_imported_fasta(masked_fasta, tmp_path, fasta):
+    path = masked_fasta if fasta == 'masked' else os.path.join(RES, 'test_genome.fasta')
+    reference, index = import_genome(path)
+    packed = str(tmp_path / 'genome.gpack')
+    header = pack_genome(path, packed)
+    assert header['lengths'] == [len(reference[c]) for c in header['chroms']]
+    genome = PackedGenome(packed)
+    assert_same_sequences(genome, reference)
+    genome.close()
+
+def test_open_genome_uses_current_pack_only(masked_fasta):
+    reference, index = import_genome(masked_fasta)
+    genome, genome_index = open_genome(masked_fasta)
+    assert isinstance(genome, IndexedGenome)
+    pack_genome(masked_fasta, masked_fasta + '.gpack')
+    genome, genome_index = open_genome(masked_fasta)
+    assert isinstance(genome, PackedGenome)
+    assert genome_index.split()[:2] == ['chrA', '1001']
+    assert_same_sequences(genome, reference)
+    later = time.time() + 10
+    os.utime(masked_fasta, (later, later))
+    genome, genome_index = open_genome(masked_fasta)
+    assert isinstance(genome, IndexedGenome)
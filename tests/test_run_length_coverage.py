@@ -0,0 +1,64 @@
+import numpy as np
+from bookend.core.cython_utils._rnaseq_utils import RunLengthCoverage, accumulate_runs
+
+def dense_coverage(rows, lefts, rights, weights, number_of_rows, length):
+    """Per-base reference for accumulate_runs()"""
+    dense = np.zeros((number_of_rows, length), dtype=np.float64)
+    for row, l, r, w in zip(rows, lefts, rights, weights):
+        dense[row, max(l, 0):min(r, length)] += w
+    
+    return dense
+
+def test_accumulate_runs_matches_dense():
+    rng = np.random.default_rng(0)
+    length = 500
+    lefts = rng.integers(0, length, 200)
+    rights = np.minimum(lefts + rng.integers(1, 80, 200), length)
+    rows = rng.integers(0, 3, 200).tolist()
+    weights = rng.uniform(0.1, 5, 200).tolist()
+    runs = accumulate_runs(rows, lefts.tolist(), rights.tolist(), weights, 3, length)
+    dense = dense_coverage(rows, lefts, rights, weights, 3, length)
+    for i in range(3):
+        assert np.allclose(runs[i].to_array(), dense[i], atol=1e-4)
+        assert np.array_equal(runs[i].to_array() == 0, dense[i] == 0)
+
+def test_accumulate_runs_uncovered_runs_are_zero():
+    runs = accumulate_runs([0, 0], [10, 20], [20, 30], [0.1, 0.2], 1, 40)[0]
+    assert runs.at(5) == 0
+    assert runs.at(35) == 0
+    assert np.isclose(runs.at(15), 0.1)
+
+def test_at_slice_total_mean():
+    cov = RunLengthCoverage([0, 10, 25], [1, 3, 0], 40)
+    dense = cov.to_array()
+    assert cov.at(9) == 1 and cov.at(10) == 3 and cov.at(39) == 0
+    assert np.array_equal(cov.at(np.arange(40)), dense)
+    part = cov.slice(5, 30)
+    assert len(part) == 25
+    assert np.array_equal(part.to_array(), dense[5:30])
+    assert len(cov.slice(30, 20)) == 0
+    assert cov.slice(-5, 100).length == 40
+    assert cov.total(5, 30) == dense[5:30].sum()
+    assert cov.mean(5, 30) == dense[5:30].mean()
+    assert np.isnan(cov.mean(20, 20))
+
+def test_add_scale_merge():
+    a = RunLengthCoverage([0, 10], [1, 2], 20)
+    b = RunLengthCoverage([0, 5, 15], [1, 0, 3], 20)
+    assert np.array_equal(a.add(b).to_array(), a.to_array() + b.to_array())
+    assert np.array_equal(a.scale(.5).to_array(), a.to_array() * .5)
+    merged = RunLengthCoverage([0, 5, 10], [1, 1, 2], 20).merge()
+    assert merged.starts.tolist() == [0, 10]
+
+def test_interp_matches_dense_interpolation():
+    cov = RunLengthCoverage([0, 10, 20, 30], [1, 0, 0.5, 0], 40)
+    known = np.array([True, False, True, False])
+    detail = np.array([False, True, False, False])
+    filled = cov.interp(known, detail)
+    dense = cov.to_array()
+    positions = np.arange(40)
+    mask = np.repeat(known, np.diff(np.append(cov.starts, cov.length)))
+    expected = np.interp(positions, positions[mask], dense[mask])
+    assert np.allclose(filled.to_array()[10:20], expected[10:20])
+    assert np.allclose(filled.to_array()[:10], dense[:10])
+    assert np.isclose(filled.at(30), expected[30])
@@ -0,0 +1,36 @@
+import os
+import pytest
+from bookend.core.argument_parsers import bam_to_elr_parser, sam_sj_parser
+from bookend.core.bam_to_elr import BAMtoELRconverter
+from bookend.core.sam_sj_out import SAMtoSJconverter
+
+GENOME = os.path.join(os.path.dirname(__file__), 'res', 'test_genome.fasta')
+
+@pytest.fixture
+def spliced_bam(sam_record, make_bam):
+    """Unique and multimapping spliced reads, grouped by name. m1 and m2 report
+    NH:i:2 but only one of their alignments is in the file."""
+    lines = [
+        sam_record('u1', [(1000, 1030), (1200, 1230)], tags=['NH:i:1']),
+        sam_record('u2', [(1010, 1030), (1200, 1245)], tags=['NH:i:1']),
+        sam_record('u3', [(1020, 1030), (1200, 1260), (1400, 1420)]),
+        sam_record('m1', [(1005, 1030), (1200, 1225)], tags=['NH:i:2', 'HI:i:1']),
+        sam_record('m2', [(3000, 3040), (3500, 3540)], tags=['NH:i:2', 'HI:i:2']),
+    ]
+    return make_bam('spliced', lines)
+
+def sj_table(path):
+    return sorted(l.split('\t')[:9] for l in open(path).read().splitlines())
+
+@pytest.mark.parametrize('threads', ['1', '2'])
+def test_sj_out_matches_sam_to_sj(tmp_path, spliced_bam, threads):
+    sj_out = str(tmp_path / 'converted.SJ.out.tab')
+    args = vars(bam_to_elr_parser.parse_args([spliced_bam, '--genome', GENOME, '-o', str(tmp_path / 'reads.elr'), '--sj_out', sj_out, '--threads', threads]))
+    BAMtoELRconverter(args).run()
+    SAMtoSJconverter(vars(sam_sj_parser.parse_args(['-F', GENOME, spliced_bam]))).run()
+    converted = sj_table(sj_out)
+    assert converted == sj_table(spliced_bam + '.SJ.out.tab')
+    counts = {(int(sj[1]), int(sj[2])):(int(sj[6]), int(sj[7]), int(sj[8])) for sj in converted}
+    assert counts[(1031, 1200)] == (3, 1, 30)
+    assert counts[(1261, 1400)] == (1, 0, 20)
+    assert counts[(3041, 3500)] == (0, 1, 40)
@@ -0,0 +1,46 @@
+import os
+import random
+import pytest
+from bookend.core.block_reader import BlockReader
+from bookend.core.elr_sort import SortedInput, sorted_lines
+
+RES = os.path.join(os.path.dirname(__file__), 'res')
+LINES = open(os.path.join(RES, 'test_reads_single.elr')).read().splitlines(True)
+HEADER = [l for l in LINES if l[0] == '#']
+READS = ['{}\n'.format(l) for l in sorted_lines([l for l in LINES if l[0] != '#'])] # Weights written as elr-sort writes them
+
+def write_reads(tmp_path, name, reads):
+    path = str(tmp_path / name)
+    open(path, 'w').write(''.join(HEADER + reads))
+    return path
+
+def read_all(path, tmp_path, reopen):
+    """Iterates over a SortedInput with a budget far smaller than the input"""
+    sorted_input = SortedInput(BlockReader(path), path, str(tmp_path), memory='4K', reopen=reopen)
+    lines = [l.rstrip() for l in sorted_input]
+    sorted_input.close()
+    return lines
+
+@pytest.mark.parametrize('reopen', [BlockReader, None])
+def test_sorted_input_is_streamed_unchanged(tmp_path, reopen):
+    path = write_reads(tmp_path, 'sorted.elr', READS)
+    assert read_all(path, tmp_path, reopen) == [l.rstrip() for l in HEADER + READS]
+    assert sorted(os.listdir(str(tmp_path))) == ['sorted.elr']
+
+@pytest.mark.parametrize('reopen', [BlockReader, None])
+def test_late_disorder_is_sorted_before_any_output(tmp_path, reopen):
+    """A swap near the end is only found after many chunks have been read"""
+    reads = READS[:]
+    reads[-1], reads[-50] = reads[-50], reads[-1]
+    path = write_reads(tmp_path, 'late.elr', reads)
+    expected = [l.rstrip() for l in HEADER + READS]
+    assert read_all(path, tmp_path, reopen) == expected
+    assert sorted(os.listdir(str(tmp_path))) == ['late.elr']
+
+@pytest.mark.parametrize('reopen', [BlockReader, None])
+def test_shuffled_input_is_sorted(tmp_path, reopen):
+    reads = READS[:]
+    random.Random(1).shuffle(reads)
+    path = write_reads(tmp_path, 'shuffled.elr', reads)
+    expected = [l.rstrip() for l in HEADER + READS]
+    assert read_all(path, tmp_path, reopen) == expected